@@ -0,0 +1,449 @@
+# Benchmarks for the stock app's core operations on synthetic workbooks
+#
+# Builds workbooks with the same 13 sheets as EUC_Perth_Assets.xlsx at the
+# requested sizes, then times what euc_stock_wa.v2.py does with them. The app
+# opens its window at import time, so the operations are driven headlessly
+# through the modules it uses (journal, SAN index, item model, plots), in the
+# same order its handlers call them. Results are printed as JSON, or written
+# with --output, so runs can be compared between versions.
+#
+#   python benchmark.py --sans 1000 10000 100000 --log-rows 10000
+#   python benchmark.py --sans 100000 --log-rows 1000000 --output bench.json
+
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from zipfile import ZIP_DEFLATED, ZipFile
+
+from openpyxl import Workbook, load_workbook
+
+from inventory_ledger import Ledger
+import inventory_plots
+from lazy_workbook import LazyWorkbook
+from san_index import SanIndex, latest_san_locations, normalize_san
+from search_index import SearchIndex
+from stock_journal import StockJournal
+import warm_start
+from workbook_model import ItemModel, WorkbookFingerprint
+from workbook_reader import LOG_HEADER, parse_action, timestamp_now, to_datetime
+from xlsx_partial import read_sheet_parts
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Items stocked at every site; the G8/G9/G10 ones are tracked by SAN
+ITEMS = [
+    'Desktop Mini G9', 'Desktop Mini G10', 'Laptop 840 G8', 'Laptop 840 G9', 'Laptop 840 G10',
+    'Dock Thunderbolt G2', 'Dock Thunderbolt Slim', 'Monitor 24"', 'Monitor 27"',
+    'Wired Keyboard', 'Wired Mouse', 'Wireless Keyboard', 'Wired Headset Poly',
+    'USB-C Adapter', 'HDMI Cable', 'DisplayPort Cable', 'Power Adapter 65W',
+]
+SAN_ITEMS = [item for item in ITEMS if any(g in item for g in ["G8", "G9", "G10"])]
+
+# Site -> share of the log rows; the sheet order matches the real workbook
+SITES = {'4.2': 0.4, 'BR': 0.25, 'L17': 0.05, 'B4.3': 0.05, 'Darwin': 0.25}
+SAN_LOCATIONS = {'4.2_Timestamps': '4.2', 'BR_Timestamps': 'BR', 'Darwin_Timestamps': 'Darwin'}
+ITEM_SHEETS = [f"{site}_Items" for site in SITES]
+
+TIMESTAMP_HEADER = LOG_HEADER
+
+# What euc_stock_wa.v2.py imports before its window is built; pandas, matplotlib
+# and the email modules are imported by the menu items that need them
+APP_IMPORTS = [
+    'customtkinter', 'openpyxl', 'stock_journal', 'san_index', 'workbook_model', 'warm_start', 'virtual_treeview',
+    'search_index', 'sqlite_store', 'io_worker', 'workbook_reader', 'plot_cache', 'plot_archive', 'diagnostics',
+]
+
+
+def generate_workbook(path, sans, log_rows, seed=0, text_timestamps=False):
+    """
+    Write a workbook with the real 13-sheet layout, `sans` rows in All_SANs and
+    `log_rows` rows spread over the *_Timestamps sheets. Timestamps are datetime
+    cells, or text as in workbooks not yet run through migrate_timestamps.py.
+    """
+    def stamp(when):
+        return when.strftime(TIMESTAMP_FORMAT) if text_timestamps else when.replace(microsecond=0)
+
+    rng = random.Random(seed)
+    start = datetime(2024, 1, 1)
+    span = (datetime(2024, 12, 31) - start).total_seconds()
+    workbook = Workbook(write_only=True)  # Streams rows out; needed for 1M-row logs
+
+    all_sans = workbook.create_sheet('All_SANs')
+    all_sans.append(['SAN Number', 'Item', 'Time', 'Location'])
+    san_numbers = []
+    for i in range(sans):
+        san_number = f"SAN{100000 + i}"
+        san_numbers.append(san_number)
+        when = start + timedelta(seconds=rng.random() * span)
+        all_sans.append([san_number, rng.choice(SAN_ITEMS), stamp(when),
+                         rng.choice(list(SAN_LOCATIONS.values()))])
+
+    for site, share in SITES.items():
+        items = workbook.create_sheet(f"{site}_Items")
+        if site == 'B4.3':
+            items.append(['Item', 'LastCount', 'NewCount'])
+        else:
+            items.append(['Item', 'LastCount', 'NewCount', 'Threshold' if site != 'L17' else None])
+        for item in ITEMS:
+            new_count = rng.randint(0, 60)
+            row = [item, max(new_count - rng.randint(0, 5), 0), new_count]
+            if site != 'B4.3':
+                row.append(10 if site != 'L17' else None)
+            items.append(row)
+
+        timestamps = workbook.create_sheet(f"{site}_Timestamps")
+        timestamps.append(TIMESTAMP_HEADER)
+        count = int(log_rows * share)
+        step = span / max(count, 1)
+        for i in range(count):
+            when = start + timedelta(seconds=i * step)
+            item = rng.choice(ITEMS)
+            operation = rng.choice(['add', 'subtract'])
+            if item in SAN_ITEMS and san_numbers and rng.random() < 0.5:
+                row = [stamp(when), item, operation, rng.choice(san_numbers)]
+            else:
+                row = [stamp(when), item, f"{operation} {rng.randint(1, 5)}", None]
+            timestamps.append(row + list(parse_action(row[2])))
+
+    headsets = workbook.create_sheet('Headsets')
+    headsets.append(['Serial #', 'ServiceNow #', ' Notes'])
+    for i in range(50):
+        headsets.append([f"HS{i:05d}", f"RITM{300000 + i}", None])
+
+    returns = workbook.create_sheet('SAN_Returns')
+    returns.append(['SAN', 'Gen:', 'Returned By', 'Returned To', None, 'Notes', 'Timestamp'])
+    for i in range(min(sans, 500)):
+        when = start + timedelta(seconds=rng.random() * span)
+        returns.append([san_numbers[i][3:], 'G9', 'user', 'stores', None, None, stamp(when)])
+
+    workbook.save(path)
+    return path
+
+
+def add_trailing_rows(path):
+    """
+    End every *_Items and *_Timestamps sheet with the empty but formatted row
+    1048576 that Excel leaves behind, as in several sheets of the real workbook.
+    """
+    temp_path = Path(f"{path}.tmp")
+    with ZipFile(path) as source, ZipFile(temp_path, "w", ZIP_DEFLATED) as target:
+        members = {member for name, member in read_sheet_parts(source).items()
+                   if name.endswith(('_Items', '_Timestamps'))}
+        for info in source.infolist():
+            data = source.read(info)
+            if info.filename in members:
+                data = data.replace(b'</sheetData>', b'<row r="1048576" ht="12.75" customHeight="1"/></sheetData>', 1)
+            target.writestr(info, data)
+    os.replace(temp_path, path)
+
+
+def summarize(times):
+    return {
+        'runs': len(times),
+        'min': min(times),
+        'median': statistics.median(times),
+        'max': max(times),
+    }
+
+
+def timed(func, repeat):
+    """
+    Run func `repeat` times and return timing statistics in seconds.
+    """
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - started)
+    return summarize(times)
+
+
+class AppState:
+    """
+    The objects euc_stock_wa.v2.py keeps after startup, built the same way.
+    """
+
+    def __init__(self, workbook_path):
+        self.workbook_path = workbook_path
+        self.workbook = load_workbook(workbook_path)
+        self.journal = StockJournal(workbook_path)
+        self.journal.replay(self.workbook)
+        self.san_index = SanIndex.from_sheet(self.workbook['All_SANs'])
+        self.item_model = ItemModel()
+        self.item_model.load(self.workbook, ITEM_SHEETS)
+        self._next_san = 900000
+
+    def new_san(self):
+        self._next_san += 1
+        return normalize_san(self._next_san)
+
+    def log_change(self, sheet_name, item, action_text, san_number=""):
+        timestamp = timestamp_now()
+        self.journal.record(self.workbook, "append", sheet=sheet_name,
+                            row=[timestamp, item, action_text, san_number, *parse_action(action_text)])
+
+    def set_count(self, items_sheet, item, delta):
+        row = self.item_model.get(items_sheet, item)
+        last_count = row[2] or 0
+        new_count = max(last_count + delta, 0)
+        self.journal.record(self.workbook, "set_count", sheet=items_sheet, item=item, last=last_count, new=new_count)
+        self.item_model.set_count(items_sheet, item, last_count, new_count)
+
+    # The update_count paths
+
+    def add_san(self, site, item):
+        san_number = self.new_san()
+        if san_number in self.san_index:
+            raise ValueError(f"{san_number} already in All_SANs")
+        timestamp = timestamp_now()
+        location = SAN_LOCATIONS.get(f"{site}_Timestamps")
+        self.journal.record(self.workbook, "append", sheet='All_SANs', row=[san_number, item, timestamp, location])
+        self.san_index.add(san_number, item, timestamp, location)
+        self.log_change(f"{site}_Timestamps", item, 'add', san_number)
+        self.set_count(f"{site}_Items", item, 1)
+        self.log_change(f"{site}_Timestamps", item, 'add 1')
+        return san_number
+
+    def subtract_san(self, site, san_number):
+        san_record = self.san_index.get(san_number)
+        self.journal.record(self.workbook, "delete_san", san=san_number, row=san_record.row)
+        self.san_index.remove(san_number)
+        self.log_change(f"{site}_Timestamps", san_record.item, 'subtract', san_number)
+        self.set_count(f"{site}_Items", san_record.item, -1)
+        self.log_change(f"{site}_Timestamps", san_record.item, 'subtract 1')
+
+    def change_count(self, site, item, delta):
+        self.set_count(f"{site}_Items", item, delta)
+        self.log_change(f"{site}_Timestamps", item, f"{'add' if delta > 0 else 'subtract'} {abs(delta)}")
+
+    # Views and reports
+
+    def log_view_rows(self, sheet_name):
+        rows = [row for row in self.workbook[sheet_name].iter_rows(min_row=2, values_only=True) if row[0] is not None]
+        rows = [(to_datetime(row[0]) or row[0],) + row[1:] for row in rows]
+        rows.sort(key=lambda r: r[0] if isinstance(r[0], datetime) else datetime.min, reverse=True)
+        return rows
+
+    def update_locations(self):
+        latest_locations = latest_san_locations(self.workbook, SAN_LOCATIONS)
+        changed_cells = []
+        for san_number in self.san_index:
+            san_record = self.san_index.get(san_number)
+            location = latest_locations.get(san_number)
+            if location != san_record.location:
+                changed_cells.append([san_record.row, 4, location])
+                self.san_index.set_location(san_number, location)
+        if changed_cells:
+            self.journal.record(self.workbook, "set_cells", sheet='All_SANs', cells=changed_cells)
+        return len(changed_cells)
+
+    def restock_check(self):
+        low = []
+        for sheet_name in ['4.2_Items', 'BR_Items', 'Darwin_Items']:
+            for row in self.item_model.rows(sheet_name):
+                if len(row) >= 4 and row[2] is not None and row[3] is not None and row[2] < row[3]:
+                    low.append((sheet_name, row[0], row[2], row[3]))
+        return low
+
+    def search_rows(self):
+        rows = []
+        for san_number in self.san_index:
+            san_record = self.san_index.get(san_number)
+            rows.append((san_number, san_record.item, san_record.timestamp, san_record.location))
+        return rows
+
+    def close(self):
+        self.journal.close()
+
+
+def warm_start_models(workbook_path):
+    """
+    What the app does at a warm start before its window is usable: check the
+    xlsx against the snapshot and build the SAN index and item model from it.
+    """
+    fingerprint = WorkbookFingerprint(workbook_path)
+    fingerprint.capture()
+    snapshot = warm_start.load(warm_start.warm_start_path_for(workbook_path), fingerprint)
+    item_model = ItemModel()
+    for sheet_name in ITEM_SHEETS:
+        item_model.load_rows(sheet_name, snapshot['headers'].get(sheet_name, ()), snapshot['items'].get(sheet_name, []))
+    return SanIndex.from_rows(snapshot['sans'], snapshot['san_max_row']), item_model
+
+
+def app_import_times(repeat):
+    """
+    Time a fresh interpreter importing APP_IMPORTS, which is most of the app's
+    time to first interaction once the workbook loads in the background.
+    Modules that aren't installed here (e.g. customtkinter) are left out.
+    """
+    modules = [name for name in APP_IMPORTS if importlib.util.find_spec(name) is not None]
+    code = (f"import time; started = time.perf_counter(); import {', '.join(modules)}; "
+            f"print(time.perf_counter() - started)")
+    times = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                                cwd=Path(__file__).parent).stdout
+        times.append(float(output))
+    return {**summarize(times), 'modules': modules}
+
+
+def lazy_start_models(workbook_path):
+    """
+    What the app does at a cold start: open the workbook with only the first
+    site's sheets parsed and build the SAN index and item model from it.
+    """
+    workbook = LazyWorkbook(workbook_path, preload=(ITEM_SHEETS[0], f"{list(SITES)[0]}_Timestamps"))
+    item_model = ItemModel()
+    item_model.load(workbook, ITEM_SHEETS)
+    return SanIndex.from_workbook(workbook), item_model
+
+
+def run_size(work_dir, sans, log_rows, repeat, skip=(), text_timestamps=False):
+    """
+    Generate one workbook and time every operation on it.
+    """
+    workbook_path = Path(work_dir) / f"bench_{sans}_{log_rows}.xlsx"
+    started = time.perf_counter()
+    generate_workbook(workbook_path, sans, log_rows, text_timestamps=text_timestamps)
+    result = {
+        'sans': sans,
+        'log_rows': log_rows,
+        'text_timestamps': text_timestamps,
+        'generate_seconds': time.perf_counter() - started,
+        'workbook_bytes': workbook_path.stat().st_size,
+        'operations': {},
+    }
+    operations = result['operations']
+
+    def measure(name, func, runs=repeat):
+        if name in skip:
+            return
+        operations[name] = timed(func, runs)
+        print(f"  {name}: {operations[name]['median']:.4f}s median", file=sys.stderr)
+
+    print(f"{sans} SANs, {log_rows} log rows ({result['workbook_bytes']} bytes)", file=sys.stderr)
+    measure('load_workbook', lambda: load_workbook(workbook_path), runs=1)
+    measure('lazy_start', lambda: lazy_start_models(workbook_path), runs=1)
+
+    started = time.perf_counter()
+    state = AppState(workbook_path)
+    result['startup_seconds'] = time.perf_counter() - started
+    try:
+        fingerprint = WorkbookFingerprint(workbook_path)
+        fingerprint.capture()
+        warm_start.save(warm_start.capture(state.workbook, fingerprint, ITEM_SHEETS),
+                        warm_start.warm_start_path_for(workbook_path))
+        measure('warm_start', lambda: warm_start_models(workbook_path))
+
+        san_item = SAN_ITEMS[0]
+        existing = [san for san, _ in zip(state.san_index, range(1000))]
+        lookups = existing + [normalize_san(500000 + i) for i in range(len(existing))]
+        measure('san_uniqueness', lambda: [san in state.san_index for san in lookups])
+        result['san_uniqueness_lookups'] = len(lookups)
+
+        added = []
+        measure('add_with_san', lambda: added.append(state.add_san('4.2', san_item)))
+        measure('subtract_with_san', lambda: state.subtract_san('4.2', added.pop()) if added else None)
+        measure('add_without_san', lambda: state.change_count('BR', 'Wired Mouse', 3))
+        measure('subtract_without_san', lambda: state.change_count('BR', 'Wired Mouse', -3))
+        measure('log_view_rebuild', lambda: state.log_view_rows('4.2_Timestamps'))
+        measure('location_update', state.update_locations)
+        measure('restock_check', state.restock_check)
+
+        def search():
+            search_index = SearchIndex(state.search_rows(), fields=(0, 1))
+            for query in ("s", "sa", "san1", "san10", "san100", "laptop"):
+                search_index.search(query)
+        measure('san_search', search)
+
+        measure('save', lambda: state.journal.checkpoint(state.workbook, force=True, full=True))
+        # A checkpoint after one movement only rewrites the two sheets it touched
+        measure('save_one_change', lambda: (state.change_count('BR', 'Wired Mouse', 1),
+                                            state.journal.checkpoint(state.workbook)))
+        plot_dir = Path(work_dir) / "plots"
+        measure('plot_generation', lambda: inventory_plots.render_all(workbook_path, plot_dir))
+        # Second and later runs are served by the plot cache
+        cache_dir = Path(work_dir) / "plot_cache"
+        measure('plot_generation_cached',
+                lambda: inventory_plots.render_all(workbook_path, plot_dir, cache_dir=cache_dir))
+    finally:
+        state.close()
+
+    # Counts replayed from the logs (inventory_ledger.py): every row with no
+    # snapshot to start from, then only what follows a snapshot of the last row
+    ledger = Ledger(workbook_path)
+    measure('ledger_full_replay', ledger.replay, runs=1)
+    ledger.take_snapshot(adopt=True)
+    measure('ledger_tail_replay', ledger.replay)
+    # Replays stop at the last row with values, not at the row Excel formatted last
+    add_trailing_rows(workbook_path)
+    measure('ledger_tail_replay_trailing_row', ledger.replay)
+    return result
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=Path(__file__).parent, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time the stock app's core operations on synthetic workbooks.")
+    parser.add_argument("--sans", type=int, nargs="+", default=[1000, 10000],
+                        help="All_SANs sizes to test (default: 1000 10000)")
+    parser.add_argument("--log-rows", type=int, nargs="+", default=[10000],
+                        help="Total *_Timestamps rows to test (default: 10000)")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per operation (default: 5)")
+    parser.add_argument("--skip", action="append", default=[], help="Operation to leave out (repeatable)")
+    parser.add_argument("--output", help="Write the JSON results here instead of stdout")
+    parser.add_argument("--keep", help="Keep the generated workbooks in this directory")
+    parser.add_argument("--text-timestamps", action="store_true",
+                        help="Write timestamps as text, like a workbook that hasn't been migrated")
+    args = parser.parse_args(argv)
+
+    work_dir = args.keep or tempfile.mkdtemp(prefix="euc_bench_")
+    Path(work_dir).mkdir(parents=True, exist_ok=True)
+    report = {
+        'revision': git_revision(),
+        'started': datetime.now().strftime(TIMESTAMP_FORMAT),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'repeat': args.repeat,
+        'results': [],
+    }
+    if 'app_imports' not in args.skip:
+        report['app_imports'] = app_import_times(args.repeat)
+        print(f"app_imports: {report['app_imports']['median']:.4f}s median", file=sys.stderr)
+    try:
+        for sans in args.sans:
+            for log_rows in args.log_rows:
+                report['results'].append(run_size(work_dir, sans, log_rows, args.repeat, skip=set(args.skip),
+                                                  text_timestamps=args.text_timestamps))
+    finally:
+        if not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(output + "\n", encoding="utf-8")
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,327 @@
+# Latency instrumentation for euc_stock_wa.v2.py
+#
+# Handlers are wrapped with @timed, which records each call's duration in a
+# per-handler histogram (fixed millisecond buckets) along with the count, total
+# and maximum. Time spent waiting on the user inside a handler (the SAN entry
+# dialog) is left out with `with untimed():`. Jobs finished by the I/O worker are
+# recorded through record(). The Diagnostics window under Options shows the
+# numbers live and can start/stop cProfile or take a tracemalloc snapshot; the
+# same statistics are appended as JSON lines to a size-rotated file for offline
+# analysis.
+
+import cProfile
+from contextlib import contextmanager
+from datetime import datetime
+import functools
+import io
+import json
+import logging
+import logging.handlers
+from pathlib import Path
+import pstats
+import threading
+import time
+import tracemalloc
+import tkinter as tk
+from tkinter import ttk
+
+# Upper bounds of the histogram buckets in milliseconds; the last bucket is open-ended
+BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+
+class HandlerStats:
+    """
+    Call count, total/max latency and histogram for one handler.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.histogram = [0] * (len(BUCKETS_MS) + 1)
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        milliseconds = seconds * 1000
+        for bucket, bound in enumerate(BUCKETS_MS):
+            if milliseconds <= bound:
+                break
+        else:
+            bucket = len(BUCKETS_MS)
+        self.histogram[bucket] += 1
+
+    def percentile(self, fraction):
+        """
+        Estimate a percentile in milliseconds as the upper bound of its bucket.
+        """
+        if not self.count:
+            return None
+        target = fraction * self.count
+        seen = 0
+        for bucket, hits in enumerate(self.histogram):
+            seen += hits
+            if seen >= target:
+                bound = BUCKETS_MS[bucket] if bucket < len(BUCKETS_MS) else float('inf')
+                return min(bound, self.max * 1000)
+        return self.max * 1000
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'mean_ms': self.total / self.count * 1000 if self.count else None,
+            'p50_ms': self.percentile(0.5),
+            'p95_ms': self.percentile(0.95),
+            'max_ms': self.max * 1000,
+            'histogram': dict(zip([f"<={bound}ms" for bound in BUCKETS_MS] + [f">{BUCKETS_MS[-1]}ms"],
+                                  self.histogram)),
+        }
+
+
+class TimingStats:
+    """
+    Handler name -> HandlerStats, safe to update from any thread.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._local = threading.local()  # Per-thread stack of running timers
+        self.changed = False  # Set on every record; cleared when written to the log file
+
+    def record(self, name, seconds):
+        with self._lock:
+            self._stats.setdefault(name, HandlerStats()).add(seconds)
+            self.changed = True
+
+    def snapshot(self):
+        """
+        Return {handler: stats dict}, sorted by handler name.
+        """
+        with self._lock:
+            return {name: self._stats[name].as_dict() for name in sorted(self._stats)}
+
+    def reset(self):
+        with self._lock:
+            self._stats = {}
+            self.changed = False
+
+    def _stack(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    @contextmanager
+    def timing(self, name):
+        """
+        Time the enclosed block under the given handler name.
+        """
+        frame = [0.0]  # Seconds to leave out, added to by untimed()
+        stack = self._stack()
+        stack.append(frame)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started - frame[0]
+            stack.pop()
+            self.record(name, elapsed)
+
+    @contextmanager
+    def untimed(self):
+        """
+        Leave the enclosed block (e.g. waiting for user input) out of every running timer.
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            paused = time.perf_counter() - started
+            for frame in self._stack():
+                frame[0] += paused
+
+
+STATS = TimingStats()
+record = STATS.record
+timing = STATS.timing
+untimed = STATS.untimed
+
+
+def timed(func):
+    """
+    Decorator recording the latency of every call under the function's name.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with timing(func.__name__):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+class StatsLog:
+    """
+    Appends the statistics as one JSON line at a time to a size-rotated file.
+    """
+
+    def __init__(self, path, max_bytes=1024 * 1024, backup_count=5):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.logger = logging.getLogger("euc.diagnostics")
+        self.logger.propagate = False  # Keep the JSON out of the app log
+        self.logger.setLevel(logging.INFO)
+        handler = logging.handlers.RotatingFileHandler(self.path, maxBytes=max_bytes,
+                                                       backupCount=backup_count, encoding="utf-8")
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        self.logger.addHandler(handler)
+
+    def write(self, force=False):
+        """
+        Write the current statistics if anything was recorded since the last write.
+        """
+        if not STATS.changed and not force:
+            return False
+        STATS.changed = False
+        self.logger.info(json.dumps({'time': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                                     'handlers': STATS.snapshot()}))
+        return True
+
+
+class Profiler:
+    """
+    On-demand cProfile and tracemalloc dumps into a directory.
+    """
+
+    def __init__(self, output_dir):
+        self.output_dir = Path(output_dir)
+        self._profile = None
+
+    @property
+    def profiling(self):
+        return self._profile is not None
+
+    def start(self):
+        """
+        Start profiling the Tk thread, where the handlers run.
+        """
+        self._profile = cProfile.Profile()
+        self._profile.enable()
+
+    def stop(self, top=25):
+        """
+        Stop profiling, save the .prof file and return (path, summary text).
+        """
+        profile, self._profile = self._profile, None
+        profile.disable()
+        path = self._dump_path("profile", ".prof")
+        profile.dump_stats(path)
+        summary = io.StringIO()
+        pstats.Stats(profile, stream=summary).sort_stats("cumulative").print_stats(top)
+        return path, summary.getvalue()
+
+    def memory_snapshot(self, top=25):
+        """
+        Save a tracemalloc snapshot and return (path, summary text). The first
+        call starts tracing, so it only covers allocations from then on.
+        """
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        snapshot = tracemalloc.take_snapshot()
+        path = self._dump_path("memory", ".snapshot")
+        snapshot.dump(path)
+        current, peak = tracemalloc.get_traced_memory()
+        lines = [f"Traced memory: {current / 1024:.0f} KiB (peak {peak / 1024:.0f} KiB)"]
+        lines += [str(stat) for stat in snapshot.statistics("lineno")[:top]]
+        return path, "\n".join(lines)
+
+    def _dump_path(self, prefix, suffix):
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        return self.output_dir / f"{prefix}_{datetime.now().strftime('%Y%m%d_%H%M%S')}{suffix}"
+
+
+def open_diagnostics_window(root, profiler, stats_log=None, refresh_ms=1000):
+    """
+    Show live handler latencies with buttons for profiling and memory snapshots.
+    """
+    window = tk.Toplevel(root)
+    window.title("Diagnostics")
+    window.geometry("760x600")
+
+    columns = ("Handler", "Calls", "Mean ms", "p50 ms", "p95 ms", "Max ms")
+    stats_tree = ttk.Treeview(window, columns=columns, show="headings", height=12)
+    for col in columns:
+        stats_tree.heading(col, text=col, anchor='w')
+        stats_tree.column(col, anchor='w', width=240 if col == "Handler" else 90)
+    stats_tree.pack(fill="x", padx=10, pady=10)
+
+    histogram_label = tk.Label(window, text="Select a handler to see its latency histogram.",
+                               justify="left", anchor="w", font=("Courier", 10))
+    histogram_label.pack(fill="x", padx=10)
+
+    buttons_frame = tk.Frame(window)
+    buttons_frame.pack(fill="x", padx=10, pady=5)
+
+    output = tk.Text(window, height=14, wrap="none", font=("Courier", 9))
+    output.pack(expand=True, fill="both", padx=10, pady=5)
+
+    def show_output(text):
+        output.delete("1.0", "end")
+        output.insert("1.0", text)
+
+    def format_ms(value):
+        return "" if value is None else f"{value:.1f}"
+
+    def show_histogram(*args):
+        selection = stats_tree.selection()
+        if not selection:
+            return
+        stats = STATS.snapshot().get(selection[0])
+        if stats is None:
+            return
+        peak = max(stats['histogram'].values()) or 1
+        lines = [f"{bucket:>10} {'#' * round(hits / peak * 40):<40} {hits}"
+                 for bucket, hits in stats['histogram'].items() if hits]
+        histogram_label.config(text="\n".join(lines))
+
+    def refresh():
+        if not window.winfo_exists():
+            return
+        selected = stats_tree.selection()
+        stats_tree.delete(*stats_tree.get_children())
+        for name, stats in STATS.snapshot().items():
+            stats_tree.insert('', 'end', iid=name, values=(
+                name, stats['count'], format_ms(stats['mean_ms']), format_ms(stats['p50_ms']),
+                format_ms(stats['p95_ms']), format_ms(stats['max_ms'])))
+        if selected and stats_tree.exists(selected[0]):
+            stats_tree.selection_set(selected[0])
+        window.after(refresh_ms, refresh)
+
+    def toggle_profiling():
+        if profiler.profiling:
+            path, summary = profiler.stop()
+            profile_button.config(text="Start profiling")
+            show_output(f"Saved {path}\n\n{summary}")
+        else:
+            profiler.start()
+            profile_button.config(text="Stop profiling")
+            show_output("Profiling... use the app, then press 'Stop profiling'.")
+
+    def take_memory_snapshot():
+        path, summary = profiler.memory_snapshot()
+        show_output(f"Saved {path}\n\n{summary}")
+
+    def write_stats():
+        if stats_log is not None:
+            stats_log.write(force=True)
+            show_output(f"Statistics written to {stats_log.path}")
+
+    profile_button = ttk.Button(buttons_frame, text="Stop profiling" if profiler.profiling else "Start profiling",
+                                command=toggle_profiling)
+    profile_button.pack(side="left", padx=5)
+    ttk.Button(buttons_frame, text="Memory snapshot", command=take_memory_snapshot).pack(side="left", padx=5)
+    ttk.Button(buttons_frame, text="Write stats file", command=write_stats).pack(side="left", padx=5)
+    ttk.Button(buttons_frame, text="Reset", command=STATS.reset).pack(side="left", padx=5)
+
+    stats_tree.bind("<<TreeviewSelect>>", show_histogram)
+    refresh()
+    return window
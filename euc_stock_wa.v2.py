@@ -1,25 +1,41 @@
 # Macdara O Murchu
 # 19.11.24
 
+import time
+LAUNCH_STARTED = time.perf_counter()  # Time to first interaction is measured from here
 
 import logging.config
 from pathlib import Path
 from tkinter import Menu
 import customtkinter as ctk
 import os
+import re
+import sys
 import tkinter as tk
 from tkinter import ttk
-from openpyxl import load_workbook, Workbook
-from datetime import datetime
+from openpyxl import Workbook
+from datetime import datetime, timedelta
+import shutil
+import stat
 import subprocess
 from tkinter import filedialog
 from tkinter import messagebox
-import pandas as pd  # Ensure pandas is imported for date operations
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from email.mime.base import MIMEBase
-from email import encoders
+import json
+from stock_journal import StockJournal, Checkpointer
+from san_index import SanIndex, latest_san_locations, normalize_san
+from workbook_model import ItemModel, WorkbookFingerprint
+from lazy_workbook import LazyWorkbook, sheet_values
+import warm_start
+from warm_start import PendingWorkbook, warm_start_path_for
+from virtual_treeview import VirtualTreeview
+from search_index import SearchIndex
+from sqlite_store import SqliteStore, SqliteJournal, is_sqlite_path
+from io_worker import IOWorker
+from workbook_reader import LOG_HEADER, timestamp_now, to_datetime
+from plot_cache import chart_digest, model_rows, renderer_id
+from plot_archive import PlotArchive
+import diagnostics
+from diagnostics import timed, untimed
 
 
 # Function to save the workbook path to config.py
@@ -38,27 +54,51 @@ else:
     logging.basicConfig(level=logging.DEBUG)
 
 
-def run_inventory_script(script_name, output_prefix, success_message):
+@timed
+def run_inventory_script(script_name, output_prefix, success_message, item_sheets):
     """
     Generalized function to run an inventory script and handle its output.
+    The script runs on the report worker, so neither the window nor journal writes wait for it.
+    If the chart's rows haven't changed today, the archived chart is reused instead.
+    Either way the chart is recorded in the Plots archive's report history.
     """
-    script_path = script_directory / script_name
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")  # Generate a timestamp
-    output_path = script_directory / "Plots" / f"{output_prefix}_{timestamp}.png"
+    from inventory_plots import TITLE_DATE_FORMAT  # Pulls in pandas, so it's imported on first use
 
-    # Ensure the output directory exists
-    output_path.parent.mkdir(parents=True, exist_ok=True)
+    script_path = script_directory / script_name
 
     if script_path.exists():
-        try:
-            subprocess.run(
-                ["python", str(script_path), "--output", str(output_path)],
-                check=True,
-            )
-            messagebox.showinfo("Success", f"{success_message} saved to {output_path}")
-        except subprocess.CalledProcessError as e:
+        # Copy the rows now; the model belongs to the Tk thread
+        rows = model_rows(item_model, item_sheets)
+        title_date = datetime.now().strftime(TITLE_DATE_FORMAT)
+
+        def run_script():
+            digest = chart_digest(renderer_id(script_path), rows, title_date)
+            content_hash = plot_archive.find(digest)
+            cached = content_hash is not None
+            if not cached:
+                output_path = plot_archive.incoming_path(output_prefix)
+                journal.checkpoint(workbook)  # The script reads the xlsx from disk
+                subprocess.run(
+                    ["python", str(script_path), "--output", str(output_path), "--workbook", str(workbook_path)],
+                    check=True,
+                )
+                content_hash = plot_archive.add_file(output_path, digest, move=True)
+            logging.info(f"{success_message} {'reused from' if cached else 'added to'} the plot archive "
+                         f"({content_hash[:12]})")
+            plot_archive.record(output_prefix, content_hash, digest, cached=cached)
+            plot_archive.prune(**PLOT_RETENTION)
+
+        def on_error(e):
             logging.error(f"Error running {script_name}: {e}")
             tk.messagebox.showerror("Error", f"Failed to run the script: {e}")
+
+        report_worker.submit(
+            run_script,
+            description=f"Creating {success_message}",
+            on_done=lambda _: messagebox.showinfo(
+                "Success", f"{success_message} saved. Open it from Options > Inventory > Report History."),
+            on_error=on_error,
+        )
     else:
         tk.messagebox.showerror(
             "Error", f"The script '{script_name}' does not exist in the directory."
@@ -85,13 +125,9 @@ def set_item_threshold():
     item_dropdown = ttk.Combobox(threshold_window, textvariable=item_var)
     item_dropdown.pack(pady=5)
 
-    # Update item list when sheet changes
+    # Update item list when sheet changes; the item model mirrors the *_Items sheets
     def update_item_list(*args):
-        sheet_name = sheet_var.get()
-        if sheet_name in workbook.sheetnames:
-            sheet = workbook[sheet_name]
-            items = [row[0] for row in sheet.iter_rows(min_row=2, max_col=1, values_only=True) if row[0]]
-            item_dropdown['values'] = items
+        item_dropdown['values'] = [row[0] for row in item_model.rows(sheet_var.get())]
 
     sheet_var.trace("w", update_item_list)
     update_item_list()
@@ -112,18 +148,28 @@ def set_item_threshold():
             tk.messagebox.showerror("Error", "All fields are required.", parent=threshold_window)
             return
 
-        if sheet_name in workbook.sheetnames:
+        def write_threshold():
+            # On the I/O worker, the only thread that touches the workbook
+            if sheet_name not in workbook.sheetnames:
+                return None
             sheet = workbook[sheet_name]
-            for row in sheet.iter_rows(min_row=2, values_only=True):
+            for row_idx, row in enumerate(sheet.iter_rows(min_row=2, values_only=True), start=2):
                 if row[0] == item_name:
-                    row_idx = row[0].row
                     threshold_col_idx = sheet.max_column  # Assume last column is Threshold
-                    sheet.cell(row=row_idx, column=threshold_col_idx, value=threshold_value)
-                    workbook.save(workbook_path)
-                    tk.messagebox.showinfo("Success", f"Threshold for '{item_name}' set to {threshold_value}.", parent=threshold_window)
-                    break
-            else:
+                    journal.record(workbook, "set_cell", sheet=sheet_name, row=row_idx,
+                                   column=threshold_col_idx, value=threshold_value)
+                    return sheet_values(workbook, sheet_name)  # For the item model
+            return None
+
+        def on_saved(rows):
+            if rows is None:
                 tk.messagebox.showerror("Error", f"Item '{item_name}' not found in {sheet_name}.", parent=threshold_window)
+                return
+            item_model.load_rows(sheet_name, rows[0] if rows else (), rows[1:])
+            if threshold_window.winfo_exists():
+                tk.messagebox.showinfo("Success", f"Threshold for '{item_name}' set to {threshold_value}.", parent=threshold_window)
+
+        io_worker.submit(write_threshold, description="Saving the threshold", on_done=on_saved)
 
     tk.Button(threshold_window, text="Save Threshold", command=save_threshold).pack(pady=10)
 
@@ -133,78 +179,148 @@ def run_basement_4_2_inventory():
     run_inventory_script(
         script_name="inventory-levels_4.2v3.py",
         output_prefix="Basement_4.2_inventory",
-        success_message="Basement 4.2 inventory plot"
+        success_message="Basement 4.2 inventory plot",
+        item_sheets=['4.2_Items']
     )
 
 def run_build_room_inventory():
     run_inventory_script(
         script_name="inventory-levels_BRv2.3.py",
         output_prefix="Build_Room_inventory",
-        success_message="Build Room inventory plot"
+        success_message="Build Room inventory plot",
+        item_sheets=['BR_Items']
     )
 
 def run_darwin_inventory():
     run_inventory_script(
         script_name="inventory-levels_darwin.v2.py",
         output_prefix="Darwin_inventory",
-        success_message="Darwin inventory plot"
+        success_message="Darwin inventory plot",
+        item_sheets=['Darwin_Items']
     )
 
 def run_combined_inventory():
     run_inventory_script(
         script_name="inventory-levels_combinedv1.5.py",
         output_prefix="Combined_inventory",
-        success_message="Combined inventory plot"
+        success_message="Combined inventory plot",
+        item_sheets=['4.2_Items', 'BR_Items', 'Darwin_Items']
     )
 
 
+PLOT_JOBS = min(4, os.cpu_count() or 1)  # Processes used to render the emailed plots
+PLOT_ARCHIVE_DIR = Path(__file__).parent / "Plots"
+plot_archive = PlotArchive(PLOT_ARCHIVE_DIR)  # Charts stored once, with their history; see plot_archive.py
+# Applied after every run so scheduled reports can't grow Plots/ without bound:
+# forget generations older than keep_days (always keeping each chart's newest
+# keep_last), then trim the oldest until the images fit in max_bytes.
+PLOT_RETENTION = {'keep_days': 90, 'keep_last': 20, 'max_bytes': 200 * 1024 * 1024}
+
+
 def save_and_email_plots():
     """
-    Saves an image of each inventory data to a timestamped subfolder within the 'Plots' directory.
+    Saves an image of each inventory data to the Plots archive as one report.
     Then sends the saved files via email.
     """
-    plots_dir = script_directory / "Plots"
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    save_dir = plots_dir / f"All_{timestamp}"
-    save_dir.mkdir(parents=True, exist_ok=True)  # Ensure the directory exists
-
-    inventory_scripts = [
-        ("inventory-levels_4.2v3.py", "Basement_4.2_inventory", "Basement 4.2 inventory plot"),
-        ("inventory-levels_BRv2.3.py", "Build_Room_inventory", "Build Room inventory plot"),
-        ("inventory-levels_darwin.v2.py", "Darwin_inventory", "Darwin inventory plot"),
-        ("inventory-levels_combinedv1.5.py", "Combined_inventory", "Combined inventory plot"),
-    ]
-
-    saved_files = []
-
-    for script_name, output_prefix, success_message in inventory_scripts:
-        script_path = script_directory / script_name
-        if script_path.exists():
-            try:
-                output_path = save_dir / f"{output_prefix}.png"
-                subprocess.run(
-                    ["python", str(script_path), "--output", str(output_path)],
-                    check=True,
-                    env={**os.environ, "MPLBACKEND": "Agg"}  # Headless matplotlib
-                )
-                logging.info(f"{success_message} saved to {output_path}")
-                saved_files.append(str(output_path))
-            except subprocess.CalledProcessError as e:
-                logging.error(f"Error while saving {success_message}: {e}")
-                tk.messagebox.showerror("Error", f"Error while saving {success_message}: {e}")
-        else:
-            logging.error(f"Script '{script_name}' not found!")
-            tk.messagebox.showerror("Error", f"Script '{script_name}' not found!")
-
-    # Send the saved files via email
-    if saved_files:
-        recipient_email = "recipient@example.com"  # Replace with the recipient's email address
-        send_email_with_attachments(
-            recipient=recipient_email,
-            subject="Daily Inventory Plots",
-            body="Please find attached the daily inventory plots.",
-            files=saved_files
+    from inventory_plots import (COMBINED_CHART, SITE_CHARTS, TITLE_DATE_FORMAT, fetch_cached, items_frame_from_model,
+                                 plot_jobs)
+
+    report = f"All_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    save_dir = plot_archive.incoming_dir / report  # Emptied into the archive once rendered
+
+    # Copy the rows now; the model belongs to the Tk thread
+    items_frame = items_frame_from_model(item_model)
+
+    def render_plots():
+        # Nothing to draw if every chart's rows and date match an archived chart
+        title_date = datetime.now().strftime(TITLE_DATE_FORMAT)
+        jobs = plot_jobs(items_frame, save_dir, list(SITE_CHARTS))
+        cached, pending = fetch_cached(jobs, title_date, plot_archive)
+        if not pending:
+            logging.info(f"All {len(jobs)} plots reused from the plot archive")
+            return archive_plots([cached[index] for index in range(len(jobs))])
+
+        journal.checkpoint(workbook)  # The plots are rendered from the xlsx on disk
+        # Parse the workbook once and render every per-site chart and the combined
+        # chart in a pool of processes. The pool lives in its own interpreter so its
+        # workers never re-import this script (and open another window).
+        completed = subprocess.run(
+            ["python", str(script_directory / "inventory_plots.py"), "--output-dir", str(save_dir),
+             "--workbook", str(workbook_path), "--jobs", str(PLOT_JOBS), "--json",
+             "--archive", str(PLOT_ARCHIVE_DIR), "--no-history"],
+            capture_output=True, text=True,
         )
+        try:
+            result = json.loads(completed.stdout)
+        except json.JSONDecodeError:
+            raise RuntimeError(completed.stdout.strip() or completed.stderr.strip() or "inventory_plots.py failed")
+        for job in result['jobs']:
+            if job['ok'] and job.get('cached'):
+                logging.info(f"{job['name']} inventory plot reused from the plot archive")
+            elif job['ok']:
+                logging.info(f"{job['name']} inventory plot rendered in {job['seconds']:.2f}s")
+            else:
+                logging.error(f"{job['name']} inventory plot failed: {job['error']}")
+        logging.info(f"Rendered {len(result['jobs'])} plots in {result['seconds']:.2f}s")
+        return archive_plots(result['jobs'])
+
+    def archive_plots(jobs):
+        # Move the charts into the archive (a no-op for images it already has),
+        # record them as one report and point each job at its archived file
+        for job in jobs:
+            if job['ok']:
+                chart = SITE_CHARTS[job['name']][1] if job['name'] in SITE_CHARTS else COMBINED_CHART[0]
+                content_hash = plot_archive.add_file(job['path'], job.get('digest'), move=True)
+                plot_archive.record(chart, content_hash, job.get('digest'), report=report,
+                                    cached=job.get('cached', False), site=job['name'])
+                job['path'], job['filename'] = str(plot_archive.blob_path(content_hash)), f"{chart}.png"
+        if save_dir.exists() and not any(save_dir.iterdir()):
+            save_dir.rmdir()
+        plot_archive.prune(**PLOT_RETENTION)
+        return jobs
+
+    def on_render_error(e):
+        logging.error(f"Error while saving inventory plots: {e}")
+        tk.messagebox.showerror("Error", f"Error while saving inventory plots: {e}")
+
+    def on_email_error(e):
+        logging.error(f"Failed to send email: {e}")
+        tk.messagebox.showerror("Error", f"Failed to send email: {e}")
+
+    # Send the saved files via email once every chart has finished, also from the report worker
+    def email_plots(jobs):
+        failed = [job for job in jobs if not job['ok']]
+        if failed:
+            tk.messagebox.showerror("Error", "Error while saving inventory plots:\n" +
+                                    "\n".join(f"{job['name']}: {job['error']}" for job in failed))
+        saved = [job for job in jobs if job['ok']]
+        if saved:
+            recipient_email = "recipient@example.com"  # Replace with the recipient's email address
+            report_worker.submit(
+                send_email_with_attachments,
+                recipient=recipient_email,
+                subject="Daily Inventory Plots",
+                body="Please find attached the daily inventory plots.",
+                files=[job['path'] for job in saved],
+                filenames=[job['filename'] for job in saved],
+                description="Sending email",
+                on_done=lambda _: tk.messagebox.showinfo("Success", "Email sent successfully!"),
+                on_error=on_email_error,
+            )
+
+    report_worker.submit(render_plots, description="Saving plots", on_done=email_plots, on_error=on_render_error)
+
+
+def open_with_default_app(path):
+    """
+    Open a file or folder with the system's default application.
+    """
+    if os.name == 'nt':  # Windows
+        os.startfile(path)
+    elif sys.platform == 'darwin':  # macOS
+        subprocess.run(['open', path])
+    else:  # Linux and others
+        subprocess.run(['xdg-open', path])
 
 
 def open_folder_prompt(folder_path):
@@ -212,12 +328,7 @@ def open_folder_prompt(folder_path):
     Prompts the user to open the folder where plots are saved.
     """
     def open_folder():
-        if os.name == 'nt':  # Windows
-            os.startfile(folder_path)
-        elif sys.platform == 'darwin':  # macOS
-            subprocess.run(['open', folder_path])
-        else:  # Linux and others
-            subprocess.run(['xdg-open', folder_path])
+        open_with_default_app(folder_path)
 
     info_window = tk.Toplevel(root)
     info_window.title("Info")
@@ -228,113 +339,240 @@ def open_folder_prompt(folder_path):
     open_folder_button.pack(pady=10)
 
 
-def send_email_with_attachments(recipient, subject, body, files):
+HISTORY_PERIODS = {"Last 7 days": 7, "Last 30 days": 30, "Last 90 days": 90, "All": None}
+
+
+def view_report_history():
+    """
+    Browse the charts in the Plots archive, newest first. Reads the archive's
+    catalog, so it opens instantly however many reports have been generated.
     """
-    Send an email with the given subject, body, and attachments.
+    history_window = tk.Toplevel(root)
+    history_window.title("Report History")
+    history_window.geometry("950x550")
+
+    filter_frame = ttk.Frame(history_window)
+    filter_frame.pack(fill="x", padx=10, pady=(10, 0))
+    tk.Label(filter_frame, text="Site:").pack(side="left")
+    site_var = tk.StringVar(value="All")
+    site_dropdown = ttk.Combobox(filter_frame, textvariable=site_var, state="readonly", width=12,
+                                 values=["All"] + plot_archive.sites())
+    site_dropdown.pack(side="left", padx=5)
+    tk.Label(filter_frame, text="Period:").pack(side="left", padx=(15, 0))
+    period_var = tk.StringVar(value="Last 30 days")
+    period_dropdown = ttk.Combobox(filter_frame, textvariable=period_var, state="readonly", width=14,
+                                   values=list(HISTORY_PERIODS))
+    period_dropdown.pack(side="left", padx=5)
+    summary_label = tk.Label(filter_frame, text="")
+    summary_label.pack(side="right")
+
+    columns = ("Generated", "Site", "Chart", "Report", "Reused", "Size")
+    history_tree = ttk.Treeview(history_window, columns=columns, show="headings")
+    for col in columns:
+        history_tree.heading(col, text=col)
+        history_tree.column(col, anchor="w", width=220 if col in ("Chart", "Report") else 110)
+    history_tree.pack(expand=True, fill="both", padx=10, pady=10)
+    entries = {}  # Treeview item -> history entry
+
+    def refresh_history(*args):
+        days = HISTORY_PERIODS[period_var.get()]
+        site = None if site_var.get() == "All" else site_var.get()
+        history = plot_archive.history(site=site, since=datetime.now() - timedelta(days=days) if days else None)
+        history_tree.delete(*history_tree.get_children())
+        entries.clear()
+        for entry in history:
+            item_id = history_tree.insert("", "end", values=(
+                entry['generated_at'], entry['site'] or "", entry['chart'], entry['report'] or "",
+                "Yes" if entry['cached'] else "", f"{(entry['size'] or 0) / 1024:.0f} KB"))
+            entries[item_id] = entry
+        reports, blobs, size = plot_archive.stats()
+        summary_label.config(text=f"{len(history)} shown. Archive: {reports} charts stored as "
+                                  f"{blobs} images ({size / 1024 / 1024:.1f} MB)")
+
+    def selected_entry():
+        selection = history_tree.selection()
+        if not selection:
+            tk.messagebox.showinfo("Info", "Select a chart first.", parent=history_window)
+            return None
+        entry = entries[selection[0]]
+        if not entry['path'].exists():
+            tk.messagebox.showerror("Error", "This chart is no longer in the archive.", parent=history_window)
+            return None
+        return entry
+
+    def open_selected(event=None):
+        entry = selected_entry()
+        if entry:
+            open_with_default_app(entry['path'])
+
+    def save_selected():
+        entry = selected_entry()
+        if not entry:
+            return
+        stamp = to_datetime(entry['generated_at']).strftime("%Y%m%d_%H%M%S")
+        target = filedialog.asksaveasfilename(parent=history_window, defaultextension=".png",
+                                              initialfile=f"{entry['chart']}_{stamp}.png",
+                                              filetypes=[("PNG images", "*.png")])
+        if target:
+            shutil.copy2(entry['path'], target)
+
+    site_var.trace("w", refresh_history)
+    period_var.trace("w", refresh_history)
+    history_tree.bind("<Double-1>", open_selected)
+    add_copy_option(history_tree)
+
+    button_frame = ttk.Frame(history_window)
+    button_frame.pack(pady=(0, 10))
+    ttk.Button(button_frame, text="Open", command=open_selected).pack(side="left", padx=5)
+    ttk.Button(button_frame, text="Save a Copy...", command=save_selected).pack(side="left", padx=5)
+    refresh_history()
+
+
+def send_email_with_attachments(recipient, subject, body, files, filenames=None):
+    """
+    Send an email with the given subject, body, and attachments. Runs on the
+    I/O worker, so failures are raised for the caller to report.
 
     :param recipient: Email address of the recipient.
     :param subject: Subject of the email.
     :param body: Body text of the email.
     :param files: List of file paths to attach.
+    :param filenames: Names to give the attachments (default: the files' own names).
     """
+    import smtplib
+    from email import encoders
+    from email.mime.base import MIMEBase
+    from email.mime.multipart import MIMEMultipart
+    from email.mime.text import MIMEText
+
     sender_email = "your_email@example.com"  # Replace with your email
     sender_password = "your_password"       # Replace with your email password
 
-    try:
-        # Set up the email
-        msg = MIMEMultipart()
-        msg['From'] = sender_email
-        msg['To'] = recipient
-        msg['Subject'] = subject
-
-        # Attach the email body
-        msg.attach(MIMEText(body, 'plain'))
-
-        # Attach files
-        for file in files:
-            with open(file, "rb") as attachment:
-                part = MIMEBase("application", "octet-stream")
-                part.set_payload(attachment.read())
-                encoders.encode_base64(part)
-                part.add_header("Content-Disposition", f"attachment; filename={Path(file).name}")
-                msg.attach(part)
-
-        # Connect to the SMTP server and send the email
-        with smtplib.SMTP("smtp.gmail.com", 587) as server:
-            server.starttls()
-            server.login(sender_email, sender_password)
-            server.sendmail(sender_email, recipient, msg.as_string())
-
-        tk.messagebox.showinfo("Success", "Email sent successfully!")
-    except Exception as e:
-        logging.error(f"Failed to send email: {e}")
-        tk.messagebox.showerror("Error", f"Failed to send email: {e}")
+    # Set up the email
+    msg = MIMEMultipart()
+    msg['From'] = sender_email
+    msg['To'] = recipient
+    msg['Subject'] = subject
+
+    # Attach the email body
+    msg.attach(MIMEText(body, 'plain'))
+
+    # Attach files
+    for file, filename in zip(files, filenames or [Path(file).name for file in files]):
+        with open(file, "rb") as attachment:
+            part = MIMEBase("application", "octet-stream")
+            part.set_payload(attachment.read())
+            encoders.encode_base64(part)
+            part.add_header("Content-Disposition", f"attachment; filename={filename}")
+            msg.attach(part)
 
+    # Connect to the SMTP server and send the email
+    with smtplib.SMTP("smtp.gmail.com", 587) as server:
+        server.starttls()
+        server.login(sender_email, sender_password)
+        server.sendmail(sender_email, recipient, msg.as_string())
+
+
+
+EXPORT_SUFFIX = '.export.xlsx'  # Read-only copy of a SQLite store opened in Excel
 
 
 def open_spreadsheet():
-    try:
+    def save_and_open():
+        journal.checkpoint(workbook)  # Make sure Excel sees the latest changes
+        spreadsheet_path = workbook_path
+        if store is not None:
+            # Regenerate an xlsx from the SQLite store for Excel users. It gets a name
+            # of its own, never the xlsx the store was imported from: the export has
+            # no formatting, and nothing edited in it is read back into the store
+            spreadsheet_path = str(Path(workbook_path).with_suffix(EXPORT_SUFFIX))
+            if os.path.exists(spreadsheet_path):
+                os.chmod(spreadsheet_path, stat.S_IREAD | stat.S_IWRITE)
+            store.export_workbook(spreadsheet_path)
+            os.chmod(spreadsheet_path, stat.S_IREAD)  # So Excel opens it read-only
         if os.name == 'nt':
-            os.startfile(workbook_path)
+            os.startfile(spreadsheet_path)
         else:
             opener = "open" if sys.platform == "darwin" else "xdg-open"
-            subprocess.run([opener, workbook_path])
-    except Exception as e:
-        tk.messagebox.showerror("Error", f"Failed to open the spreadsheet: {e}")
+            subprocess.run([opener, spreadsheet_path])
+        return spreadsheet_path if store is not None else None
+
+    def on_opened(exported_path):
+        if exported_path is not None:
+            tk.messagebox.showinfo(
+                "Read-only copy",
+                f"Opened {Path(exported_path).name}, a read-only copy of the database without formatting. "
+                f"Changes made to it in Excel are not saved back; make them in the app.")
+
+    io_worker.submit(
+        save_and_open,
+        description="Opening spreadsheet",
+        on_done=on_opened,
+        on_error=lambda e: tk.messagebox.showerror("Error", f"Failed to open the spreadsheet: {e}"),
+    )
 
 
-def update_all_sans_location():
-    """
-    Updates the 'Location' column in the 'All_SANs' sheet based on the presence of SANs
-    in specific timestamp sheets.
-    """
-    # Ensure the 'All_SANs' sheet exists
-    if 'All_SANs' not in workbook.sheetnames:
-        tk.messagebox.showerror("Error", "'All_SANs' sheet not found in the workbook.")
-        return
+# Mapping of timestamp sheets to the short location stored in All_SANs
+SAN_LOCATIONS = {
+    '4.2_Timestamps': '4.2',
+    'BR_Timestamps': 'BR',
+    'Darwin_Timestamps': 'Darwin'
+}
 
-    all_sans_sheet = workbook['All_SANs']
 
-    # Ensure the Location column (D) has a header
-    if all_sans_sheet.max_column < 4:
-        all_sans_sheet.cell(row=1, column=4, value="Location")
+@timed
+def update_all_sans_location(on_updated=None):
+    """
+    Updates the 'Location' column in the 'All_SANs' sheet from the most recent
+    movement of each SAN in the timestamp sheets. Only changed cells are written.
 
-    # Mapping of sheets to short locations
-    location_mapping = {
-        '4.2_Timestamps': '4.2',
-        'BR_Timestamps': 'BR',
-        'Darwin_Timestamps': 'Darwin'
-    }
+    The timestamp sheets are read on the I/O worker; on_updated() is called once
+    the SAN index holds the new locations.
+    """
+    def read_locations():
+        # Checked here rather than on the Tk thread, which would wait for a
+        # workbook still being parsed in the background
+        if 'All_SANs' not in workbook.sheetnames:
+            return None
+        header = workbook['All_SANs'].cell(row=1, column=4).value
+        return header, latest_san_locations(workbook, SAN_LOCATIONS)
+
+    def apply_locations(result):
+        if result is None:
+            tk.messagebox.showerror("Error", "'All_SANs' sheet not found in the workbook.")
+            return
+        header, latest_locations = result
+        changed_cells = []
+        # Ensure the Location column (D) has a header
+        if header is None:
+            changed_cells.append([1, 4, "Location"])
 
-    # Iterate over rows in All_SANs and update the location
-    for row_idx, row in enumerate(all_sans_sheet.iter_rows(min_row=2, values_only=True), start=2):
-        san_number = row[0]
-        location = None
+        for san_number in san_index:
+            san_record = san_index.get(san_number)
+            location = latest_locations.get(san_number)
+            if location != san_record.location:
+                changed_cells.append([san_record.row, 4, location])
+                san_index.set_location(san_number, location)
 
-        # Check each timestamp sheet for the SAN
-        for sheet_name, loc in location_mapping.items():
-            if sheet_name in workbook.sheetnames:
-                timestamp_sheet = workbook[sheet_name]
-                if any(san_number == cell[0] for cell in timestamp_sheet.iter_rows(min_row=2, min_col=1, max_col=1, values_only=True)):
-                    location = loc
-                    break
+        # Nothing moved: leave the workbook (and the journal) untouched
+        if changed_cells:
+            record_change("set_cells", sheet='All_SANs', cells=changed_cells)
+            logging.info(f"Updated {len(changed_cells)} locations in All_SANs")
+        if on_updated is not None:
+            on_updated()
 
-        # Write the location to the Location column (Column D)
-        all_sans_sheet.cell(row=row_idx, column=4, value=location)
+    io_worker.submit(read_locations, description="Updating SAN locations", on_done=apply_locations)
 
-    # Save the workbook after updating
-    workbook.save(workbook_path)
+
+SEARCH_DEBOUNCE_MS = 150  # Delay after the last keystroke before searching
 
 
 def view_all_sans_log():
     """
     Displays the updated All_SANs data in a Treeview widget with columns
     'SAN Number', 'Item', 'Time', and 'Location'.
-    Includes a search box to filter SAN numbers dynamically.
+    Includes a search box to filter SAN numbers and items dynamically.
     """
-    # Update the 'Location' column in the 'All_SANs' sheet
-    update_all_sans_location()
-
     log_window = tk.Toplevel(root)
     log_window.title("SANs In Stock")
     log_window.geometry("800x800")
@@ -351,7 +589,7 @@ def view_all_sans_log():
 
     # Treeview and scrollbar
     columns = ("SAN Number", "Item", "Time", "Location")
-    log_tree = ttk.Treeview(log_window, columns=columns, show="headings")
+    log_tree = VirtualTreeview(log_window, columns=columns, show="headings")
     for col in columns:
         log_tree.heading(col, text=col)
         log_tree.column(col, anchor="w")
@@ -361,31 +599,43 @@ def view_all_sans_log():
     scrollbar.pack(side="right", fill="y")
     log_tree.configure(yscrollcommand=scrollbar.set)
 
-    # Load data from the "All_SANs" sheet
+    # Rows come from the SAN index, which mirrors the "All_SANs" sheet
+    search_index = None
+
+    def build_search_index():
+        nonlocal search_index
+        all_rows = []
+        for san_number in san_index:
+            san_record = san_index.get(san_number)
+            all_rows.append((san_number, san_record.item, san_record.timestamp, san_record.location))
+        search_index = SearchIndex(all_rows, fields=(0, 1))  # SAN Number and Item
+
     def load_data(filter_text=""):
         """
         Populates the Treeview with data, filtering by filter_text.
         """
-        log_tree.delete(*log_tree.get_children())  # Clear current data
-        if 'All_SANs' in workbook.sheetnames:
-            all_sans_sheet = workbook['All_SANs']
-            for row in all_sans_sheet.iter_rows(min_row=2, values_only=True):
-                san_number, item, timestamp, location = row
-                # Filter by the search text
-                if filter_text.lower() in str(san_number).lower():
-                    log_tree.insert('', 'end', values=(san_number, item, timestamp, location))
-        else:
-            tk.messagebox.showinfo("Info", "'All_SANs' sheet not found or empty.", parent=log_window)
+        log_tree.set_rows(search_index.search(filter_text))
+
+    # Trigger search on text change, once typing pauses (barcode scanners type fast)
+    pending_search = None
 
-    # Trigger search on text change
     def on_search(*args):
-        filter_text = search_var.get()
-        load_data(filter_text)
+        nonlocal pending_search
+        if pending_search is not None:
+            log_window.after_cancel(pending_search)
+        pending_search = log_window.after(SEARCH_DEBOUNCE_MS, lambda: load_data(search_var.get()))
 
     search_var.trace("w", on_search)  # Bind dynamic updates to search
 
-    # Load initial data
+    # Show what the index holds now, then again once the locations are refreshed
+    def on_locations_updated():
+        if log_window.winfo_exists():
+            build_search_index()
+            load_data(search_var.get())
+
+    build_search_index()
     load_data()
+    update_all_sans_location(on_updated=on_locations_updated)
 
 def view_san_returns_log():
     """
@@ -393,11 +643,8 @@ def view_san_returns_log():
     'SAN', 'Gen', 'Returned By', 'Returned To', 'Notes', and 'Timestamp'.
     """
     # Ensure the 'SAN_Returns' sheet exists
-    if 'SAN_Returns' not in workbook.sheetnames:
-        tk.messagebox.showinfo("Info", "'SAN_Returns' sheet not found. Creating it now.")
-        san_returns_sheet = workbook.create_sheet('SAN_Returns')
-        san_returns_sheet.append(["SAN", "Gen", "Returned By", "Returned To", "Notes", "Timestamp"])  # Updated headers
-        workbook.save(workbook_path)
+    ensure_sheet('SAN_Returns', ["SAN", "Gen", "Returned By", "Returned To", "Notes", "Timestamp"],  # Updated headers
+                 on_created=lambda: tk.messagebox.showinfo("Info", "'SAN_Returns' sheet not found. Created it now."))
 
     log_window = tk.Toplevel(root)
     log_window.title("SAN Return Log")
@@ -528,6 +775,7 @@ def open_san_return_form_with_tree(returns_tree):
 
 
 
+@timed
 def submit_san_return(san, gen, returned_by, returned_to, notes, timestamp, form_window, returns_tree):
     """
     Validates input and submits the data to the SAN_Returns sheet.
@@ -537,37 +785,46 @@ def submit_san_return(san, gen, returned_by, returned_to, notes, timestamp, form
     if not san or not gen or not returned_by or not returned_to or not timestamp:
         tk.messagebox.showerror("Error", "All fields except 'Notes' are required.", parent=form_window)
         return
+    returned_at = to_datetime(timestamp)
+    if returned_at is None:
+        tk.messagebox.showerror("Error", "Timestamp must be in the format YYYY-MM-DD HH:MM:SS.", parent=form_window)
+        return
 
     # Ensure the 'SAN_Returns' sheet exists
-    if 'SAN_Returns' not in workbook.sheetnames:
-        san_returns_sheet = workbook.create_sheet('SAN_Returns')
-        san_returns_sheet.append(["SAN", "Gen", "Returned By", "Returned To", "Notes", "Timestamp"])  # Add headers
-    else:
-        san_returns_sheet = workbook['SAN_Returns']
+    ensure_sheet('SAN_Returns', ["SAN", "Gen", "Returned By", "Returned To", "Notes", "Timestamp"])  # Add headers
 
-    # Append the data to the SAN_Returns sheet
-    san_returns_sheet.append([san, gen, returned_by, returned_to, notes, timestamp])
+    def on_submitted(_):
+        # Update the Treeview dynamically
+        if returns_tree is not None and returns_tree.winfo_exists():
+            refresh_san_returns_log(returns_tree)
 
-    # Save the workbook
-    workbook.save(workbook_path)
+        # Inform the user and close the form
+        if form_window.winfo_exists():
+            tk.messagebox.showinfo("Success", "SAN return data submitted successfully!", parent=form_window)
+            form_window.destroy()  # Close the form window
 
-    # Update the Treeview dynamically
-    refresh_san_returns_log(returns_tree)
-
-    # Inform the user and close the form
-    tk.messagebox.showinfo("Success", "SAN return data submitted successfully!", parent=form_window)
-    form_window.destroy()  # Close the form window
+    # Append the data to the SAN_Returns sheet; writes are applied in the order queued
+    record_change("append", on_done=on_submitted, sheet='SAN_Returns',
+                  row=[san, gen, returned_by, returned_to, notes, returned_at])
 
 
 def refresh_san_returns_log(returns_tree):
     """
     Refreshes the Treeview with the latest data from the SAN_Returns sheet.
     """
-    returns_tree.delete(*returns_tree.get_children())  # Clear current data
-    if 'SAN_Returns' in workbook.sheetnames:
-        san_returns_sheet = workbook['SAN_Returns']
-        for row in san_returns_sheet.iter_rows(min_row=2, values_only=True):
-            returns_tree.insert('', 'end', values=row)
+    def read_returns():
+        # On the I/O worker: it alone touches the workbook, and waits for a background parse
+        if 'SAN_Returns' not in workbook.sheetnames:
+            return []
+        return list(workbook['SAN_Returns'].iter_rows(min_row=2, values_only=True))
+
+    def show_returns(rows):
+        if returns_tree.winfo_exists():
+            returns_tree.delete(*returns_tree.get_children())  # Clear current data
+            for row in rows:
+                returns_tree.insert('', 'end', values=row)
+
+    io_worker.submit(read_returns, description="Reading SAN_Returns", on_done=show_returns)
 
 
 def view_san_returns_log():
@@ -576,11 +833,8 @@ def view_san_returns_log():
     'SAN', 'Returned By', 'Returned To', 'Notes', and 'Timestamp'.
     """
     # Ensure the 'SAN_Returns' sheet exists
-    if 'SAN_Returns' not in workbook.sheetnames:
-        tk.messagebox.showinfo("Info", "'SAN_Returns' sheet not found. Creating it now.")
-        san_returns_sheet = workbook.create_sheet('SAN_Returns')
-        san_returns_sheet.append(["SAN", "Returned By", "Returned To", "Notes", "Timestamp"])
-        workbook.save(workbook_path)
+    ensure_sheet('SAN_Returns', ["SAN", "Returned By", "Returned To", "Notes", "Timestamp"],
+                 on_created=lambda: tk.messagebox.showinfo("Info", "'SAN_Returns' sheet not found. Created it now."))
 
     log_window = tk.Toplevel(root)
     log_window.title("SAN Return List")
@@ -651,8 +905,25 @@ def open_san_return_form_with_tree(returns_tree):
     ).grid(row=len(fields), column=0, columnspan=2, pady=20)
 
 
+WORKBOOK_FILETYPES = (("Excel files", "*.xlsx"), ("SQLite stores", "*.db *.sqlite *.sqlite3"), ("All files", "*.*"))
+
+
+def switch_workbook():
+    """
+    Pick another workbook, remember it in config.py and restart the app on it.
+    """
+    file_path = filedialog.askopenfilename(parent=root, title="Select a spreadsheet file", filetypes=WORKBOOK_FILETYPES)
+    if not file_path or Path(file_path) == Path(workbook_path):
+        return
+    save_config(file_path)
+    on_close()  # Saves the current workbook and closes the window
+    subprocess.Popen([sys.executable, *[arg for arg in sys.argv if arg != '--choose']])
+
+
+APP_TITLE = "EUC Assets - WA"
+
 root = ctk.CTk()
-root.title("EUC Assets - WA")
+root.title(APP_TITLE)
 root.geometry("675x950")
 
 # Unified font settings for the application
@@ -686,13 +957,16 @@ inventory_menu.add_command(label="Build Room Inventory", command=run_build_room_
 inventory_menu.add_command(label="Darwin Inventory", command=run_darwin_inventory)
 inventory_menu.add_command(label="Combined Inventory", command=run_combined_inventory)
 inventory_menu.add_command(label="Save and eMail Plots", command=save_and_email_plots)
+inventory_menu.add_command(label="Report History", command=view_report_history)
 
 # Create the main Options menu
 plots_menu = tk.Menu(menu_bar, tearoff=0)
 plots_menu.add_cascade(label="SANs", menu=sans_menu)  # Add SANs submenu
 plots_menu.add_cascade(label="Inventory", menu=inventory_menu)  # Add Inventory submenu
 plots_menu.add_command(label="Open Spreadsheet", command=open_spreadsheet)
+plots_menu.add_command(label="Switch Workbook...", command=switch_workbook)
 plots_menu.add_command(label="Check Restock Threshold", command=lambda: check_restock_threshold(10))
+plots_menu.add_command(label="Diagnostics", command=lambda: diagnostics.open_diagnostics_window(root, profiler, stats_log))
 # plots_menu.add_command(label="Headsets In Stock", command=view_headsets_log)
 
 menu_bar.add_cascade(label="Options", menu=plots_menu)
@@ -702,24 +976,224 @@ root.config(menu=menu_bar)
 
 script_directory = Path(__file__).parent
 
+# Handler latency statistics, cProfile and tracemalloc dumps go here
+DIAGNOSTICS_DIR = script_directory / "Diagnostics"
+STATS_LOG_INTERVAL_MS = 60 * 1000  # How often new statistics are appended to the stats file
+profiler = diagnostics.Profiler(DIAGNOSTICS_DIR)
+stats_log = diagnostics.StatsLog(DIAGNOSTICS_DIR / "timings.jsonl")
+
+
+def last_workbook_path():
+    """
+    Return the workbook saved to config.py by the last run, or None if there is
+    none or it has gone.
+    """
+    try:
+        from config import workbook_path as last_path
+    except ImportError:
+        return None
+    return last_path if Path(last_path).is_file() else None
+
+
 def get_file_path():
-    # Creating a temporary root window for file dialog
-    temp_root = tk.Tk()
-    temp_root.withdraw()  # Hide the temporary root window
-    file_path = filedialog.askopenfilename(
-        title="Select a spreadsheet file",
-        filetypes=(("Excel files", "*.xlsx"), ("All files", "*.*"))
-    )
-    temp_root.destroy()  # Destroy the temporary root window to clean up
+    """
+    Return the workbook to open: the one used last time, unless it has gone or
+    the app was started with --choose, in which case the user picks one.
+    """
+    if '--choose' not in sys.argv[1:]:
+        last_path = last_workbook_path()
+        if last_path:
+            logging.info(f"Opening {last_path} from config.py (start with --choose to pick another)")
+            return last_path
+    file_path = filedialog.askopenfilename(parent=root, title="Select a spreadsheet file", filetypes=WORKBOOK_FILETYPES)
     if not file_path:
         tk.messagebox.showerror("Error", "No file selected. Exiting application.")
         raise SystemExit  # Exit the application if no file is selected
     return file_path
 
-# Get the workbook path from user
+
+# Get the workbook path from config.py, or from the user
 workbook_path = get_file_path()
 save_config(workbook_path)  # Save the path to the config file immediately after getting it
-workbook = load_workbook(workbook_path)
+
+# A .db path selects the SQLite storage engine, where each change is committed as
+# a row; otherwise the xlsx is used with a journal and periodic checkpoints
+store = SqliteStore(workbook_path) if is_sqlite_path(workbook_path) else None
+
+
+sheets = {
+    'original': ('4.2_Items', '4.2_Timestamps'),
+    'backup': ('BR_Items', 'BR_Timestamps'),
+    'L17': ('L17_Items', 'L17_Timestamps'),
+    'B4.3': ('B4.3_Items', 'B4.3_Timestamps'),
+    'Darwin': ('Darwin_Items', 'Darwin_Timestamps')
+}
+ITEM_SHEETS = [items_sheet for items_sheet, _ in sheets.values()]
+current_sheets = sheets['original']
+
+# An xlsx is opened as a LazyWorkbook: each site's sheets are parsed when the site
+# is first selected, All_SANs on the first SAN operation, and the sheets of sites
+# not used for SITE_IDLE_SECONDS are dropped from memory again (see lazy_workbook.py)
+SITE_SHEETS = [sheet_name for site_sheets in sheets.values() for sheet_name in site_sheets]
+SITE_IDLE_SECONDS = 15 * 60
+SITE_EVICT_CHECK_MS = 60 * 1000  # How often idle sites are looked for
+
+# The counts are derived from the *_Timestamps logs (see inventory_ledger.py). The
+# logs on disk are snapshotted once LEDGER_SNAPSHOT_ROWS rows have been logged
+# since the last snapshot, so verifying or rebuilding the counts only replays those
+LEDGER_SNAPSHOT_ROWS = 5000
+LEDGER_CHECK_MS = 15 * 60 * 1000  # How often the logs are checked for that
+
+
+def load_workbook_data():
+    """
+    Load the openpyxl workbook the app works on, from the xlsx or the SQLite store.
+    """
+    if store is not None:
+        return store.to_workbook()
+    return LazyWorkbook(workbook_path, preload=current_sheets)
+
+startup_started = time.perf_counter()
+
+# Stock movements go to the journal; the xlsx is only rewritten by checkpoints
+CHECKPOINT_INTERVAL = 60  # Seconds between background checkpoints
+journal = SqliteJournal(store) if store is not None else StockJournal(workbook_path)
+
+# Detects saves made outside the app (e.g. from Excel) so we only reload when needed
+workbook_fingerprint = store if store is not None else WorkbookFingerprint(workbook_path)
+workbook_fingerprint.capture()
+
+# The workbook is parsed on the I/O worker while the window comes up. If the xlsx
+# is unchanged since the last checkpoint and nothing is left in the journal, the
+# models start from the warm-start snapshot meanwhile (see warm_start.py);
+# otherwise they start empty and are filled in once the parse is done
+WARM_START_PATH = warm_start_path_for(workbook_path)
+warm_snapshot = None
+if store is None and not (journal.path.exists() and journal.path.stat().st_size):
+    warm_snapshot = warm_start.load(WARM_START_PATH, workbook_fingerprint)
+
+workbook = PendingWorkbook()  # Replaced by the parsed workbook once load_in_background() is done
+last_snapshot = warm_snapshot  # What refresh_warm_start() carries unloaded sheets over from
+# Given the workbook once it is parsed: a checkpoint of the PendingWorkbook would
+# wait for the parse while holding the journal's lock, which the loader needs
+checkpointer = Checkpointer(journal, None, interval=CHECKPOINT_INTERVAL)
+checkpointer.start()
+
+
+def refresh_warm_start():
+    """
+    Snapshot the workbook for the next start. Call it while the workbook matches
+    the file on disk, e.g. after a checkpoint.
+    """
+    if store is not None or isinstance(workbook, PendingWorkbook):
+        return
+    global last_snapshot
+    with journal.lock:
+        last_snapshot = warm_start.capture(workbook, workbook_fingerprint, ITEM_SHEETS, previous=last_snapshot)
+    warm_start.save_in_background(last_snapshot, WARM_START_PATH)
+
+
+journal.checkpoint_listeners.append(workbook_fingerprint.capture)
+journal.checkpoint_listeners.append(refresh_warm_start)
+
+
+def show_io_error(job, error):
+    tk.messagebox.showerror("Error", f"{job.description or 'Saving a change'} failed: {error}")
+
+
+# Workbook reads/writes, journal writes and saves run here, off the Tk thread
+IO_POLL_MS = 50  # How often finished jobs are handed back to the Tk thread
+io_worker = IOWorker(on_error=show_io_error)
+io_worker.finished_listeners.append(
+    lambda job: diagnostics.record(f"io: {job.description or 'journal write'}", job.elapsed)
+)
+io_worker.start()
+
+# Plot scripts and email get a queue of their own: a render can take minutes,
+# and journal writes queued behind it would leave every scan unsaved meanwhile
+report_worker = IOWorker(on_error=show_io_error, name="reports")
+report_worker.finished_listeners.append(
+    lambda job: diagnostics.record(f"reports: {job.description}", job.elapsed)
+)
+report_worker.start()
+
+
+def record_change(op, on_done=None, **fields):
+    """
+    Queue a journal write on the I/O worker. Writes are applied in the order
+    they are queued, so callers update the in-memory models straight away.
+    """
+    # Look the workbook up when the job runs; a reload may have replaced it
+    return io_worker.submit(lambda: journal.record(workbook, op, **fields), on_done=on_done)
+
+
+def ensure_sheet(sheet_name, header, on_created=None):
+    """
+    Create a sheet (with a header row) if the workbook doesn't have one. The
+    check runs on the I/O worker, so the Tk thread never waits for a background
+    parse; on_created() is called back if the sheet had to be created.
+    """
+    def create():
+        if sheet_name in workbook.sheetnames:
+            return False
+        journal.record(workbook, "create_sheet", sheet=sheet_name, header=header)
+        return True
+
+    io_worker.submit(create, description=f"Creating {sheet_name}",
+                     on_done=lambda created: on_created() if created and on_created is not None else None)
+
+
+def load_in_background():
+    """
+    Parse the workbook on the I/O worker. It is the first job queued, so every
+    journal write queued after it sees the real workbook. Without a warm-start
+    snapshot it also builds the models, and returns them like reload_if_modified.
+    """
+    global workbook
+    pending_workbook = workbook
+    models = None
+    try:
+        loaded = load_workbook_data()
+        replayed = journal.replay(loaded)  # Also opens the journal for writing
+        if warm_snapshot is None:
+            # Built after journal replay so they match the sheets
+            loaded_model = ItemModel()
+            loaded_model.load(loaded, ITEM_SHEETS)
+            models = SanIndex.from_workbook(loaded), loaded_model
+    except Exception as e:
+        pending_workbook.fail(e)
+        raise
+    pending_workbook.set(loaded)  # Before taking the lock: anything waiting on the parse can finish
+    with journal.lock:
+        workbook = loaded
+        checkpointer.workbook = loaded
+    if replayed:
+        journal.checkpoint(loaded)  # Fold changes recovered after a crash straight away
+    elif warm_snapshot is None:
+        refresh_warm_start()  # Snapshot this parse for the next start
+    seconds = time.perf_counter() - LAUNCH_STARTED
+    diagnostics.record("startup: workbook loaded", seconds)
+    logging.info(f"Workbook parsed in the background {seconds:.2f}s after launch")
+    return models
+
+
+def on_workbook_loaded(result):
+    """
+    Finish the startup steps that need the parsed workbook.
+    """
+    root.title(APP_TITLE)
+    ensure_log_columns()
+    if result is not None:
+        on_workbook_reloaded(result)  # Swap in the models built after a cold start, and redraw
+    else:
+        update_log_view()  # From the workbook now, rather than the snapshot
+
+
+def on_workbook_load_error(e):
+    logging.error(f"Failed to load {workbook_path}: {e}")
+    tk.messagebox.showerror("Error", f"Failed to load the workbook: {e}")
+    root.destroy()
+
 
 def ensure_threshold_column():
     """
@@ -733,26 +1207,146 @@ def ensure_threshold_column():
                 header_row = [sheet.cell(row=1, column=col).value for col in range(1, max_col + 1)]
 
                 if 'Threshold' not in header_row:
-                    sheet.cell(row=1, column=max_col + 1, value='Threshold')
+                    threshold_cells = [[1, max_col + 1, 'Threshold']]
                     for row in range(2, sheet.max_row + 1):
-                        sheet.cell(row=row, column=max_col + 1, value=10)  # Default threshold value
-                    workbook.save(workbook_path)
+                        threshold_cells.append([row, max_col + 1, 10])  # Default threshold value
+                    record_change("set_cells", sheet=sheet_name, cells=threshold_cells,
+                                  on_done=lambda _, s=sheet_name: item_model.load_sheet(workbook, s))
                     logging.info(f"Added 'Threshold' column to {sheet_name}.")
     except Exception as e:
         logging.error(f"Error ensuring 'Threshold' column: {e}")
         tk.messagebox.showerror("Error", f"Failed to add 'Threshold' column: {e}")
 
 
-all_sans_sheet = workbook['All_SANs']
-sheets = {
-    'original': ('4.2_Items', '4.2_Timestamps'),
-    'backup': ('BR_Items', 'BR_Timestamps'),
-    'L17': ('L17_Items', 'L17_Timestamps'),
-    'B4.3': ('B4.3_Items', 'B4.3_Timestamps'),
-    'Darwin': ('Darwin_Items', 'Darwin_Timestamps')
-}
+def ensure_log_columns():
+    """
+    Name the Op and Qty columns of each timestamp sheet; log rows fill them in.
+    Older rows are converted by migrate_log_columns.py.
+    """
+    try:
+        for sheet_name in [name for name in workbook.sheetnames if name.endswith('_Timestamps')]:
+            header = sheet_values(workbook, sheet_name, max_row=1, max_col=len(LOG_HEADER))[0]
+            header_cells = [[1, column, name] for column, name in enumerate(LOG_HEADER, start=1)
+                            if header[column - 1] is None]
+            if header_cells:
+                record_change("set_cells", sheet=sheet_name, cells=header_cells)
+                logging.info(f"Added {', '.join(name for _, _, name in header_cells)} header to {sheet_name}.")
+    except Exception as e:
+        logging.error(f"Error ensuring the log columns: {e}")
+        tk.messagebox.showerror("Error", f"Failed to add the Op/Qty columns: {e}")
+
+
+# The item tree is drawn from this model; update_count keeps it in step with the sheets
+item_model = ItemModel()
+if warm_snapshot is None:
+    san_index = SanIndex()  # Both are replaced by on_workbook_loaded()
+    root.title(f"{APP_TITLE} (loading {Path(workbook_path).name}...)")
+else:
+    san_index = SanIndex.from_rows(warm_snapshot['sans'], warm_snapshot['san_max_row'])
+    for sheet_name in ITEM_SHEETS:
+        item_model.load_rows(sheet_name, warm_snapshot['headers'].get(sheet_name, ()),
+                             warm_snapshot['items'].get(sheet_name, []))
+io_worker.submit(load_in_background, description="Loading workbook",
+                 on_done=on_workbook_loaded, on_error=on_workbook_load_error)
+logging.info(f"{'Warm' if warm_snapshot is not None else 'Cold'} start: models ready "
+             f"{time.perf_counter() - startup_started:.2f}s after startup")
+LOW_STOCK_NOTICE_MS = 8000  # How long a "fell below threshold" notice stays on the badge
+
+def reload_if_modified():
+    """
+    Reload the workbook if the xlsx was changed by another program, re-applying
+    any journal entries that have not been checkpointed yet. Runs on the I/O
+    worker; returns the rebuilt (SAN index, item model), or None if unchanged.
+    """
+    global workbook, last_snapshot
+    with journal.lock:
+        if not workbook_fingerprint.is_modified():
+            return None
+        logging.info(f"{workbook_path} was modified outside the app; reloading.")
+        reloaded = load_workbook_data()
+        journal.replay(reloaded)
+        # Swapped here so jobs queued after this one write to the new workbook
+        workbook = reloaded
+        checkpointer.workbook = workbook
+        workbook_fingerprint.capture()
+        last_snapshot = None  # Nothing in it is known to match the file any more
+        if not journal.pending:
+            refresh_warm_start()
+        reloaded_index = SanIndex.from_workbook(workbook)
+        reloaded_model = ItemModel()
+        reloaded_model.load(workbook, ITEM_SHEETS)
+        return reloaded_index, reloaded_model
+
+
+def on_workbook_reloaded(result):
+    """
+    Swap in the models rebuilt by reload_if_modified and redraw.
+    """
+    global san_index, item_model
+    if result is None:
+        return
+    san_index, item_model = result
+    item_model.low_stock.listeners.append(on_low_stock_change)
+    update_low_stock_badge()
+    render_treeview()
+    update_log_view()
+
+
+def check_for_external_changes():
+    io_worker.submit(reload_if_modified, on_done=on_workbook_reloaded)
+
+
+def load_site_sheets(site_sheets):
+    """
+    Parse a site's sheets on the I/O worker, if the workbook hasn't already.
+    """
+    if isinstance(workbook, LazyWorkbook):
+        workbook.load(site_sheets)
+
+
+def evict_idle_sites():
+    """
+    Drop the sheets of sites not used for SITE_IDLE_SECONDS from memory. Runs on
+    the I/O worker, after the writes queued before it, and under the journal's
+    lock so that sheets with changes not yet checkpointed are known and kept.
+    """
+    if not isinstance(workbook, LazyWorkbook):
+        return
+    with journal.lock:
+        if journal.dirty_sheets is None:
+            return  # A sheet was added; everything is saved in full at the next checkpoint
+        evicted = workbook.evict_idle(SITE_SHEETS, SITE_IDLE_SECONDS, keep=current_sheets,
+                                      dirty=journal.dirty_sheets)
+    if evicted:
+        logging.info(f"Unloaded idle sheets {', '.join(evicted)}")
+
+
+def schedule_site_eviction():
+    io_worker.submit(evict_idle_sites, description="Unloading idle sites")
+    root.after(SITE_EVICT_CHECK_MS, schedule_site_eviction)
+
+
+def snapshot_ledger():
+    """
+    Snapshot the counts replayed from the logs on disk if enough has been logged
+    since the last snapshot; the first time, adopt the stored counts. Runs on the
+    I/O worker, under the journal's lock so no checkpoint replaces the file mid-read.
+    This only keeps inventory_ledger.py's replays short; the counts shown and
+    edited are still the ones stored in the *_Items sheets.
+    """
+    from inventory_ledger import Ledger, LedgerError  # Pulls in NumPy, so it's imported on first use
+
+    try:
+        with journal.lock:
+            Ledger(workbook_path).snapshot_if_due(LEDGER_SNAPSHOT_ROWS)
+    except LedgerError as e:
+        logging.warning(f"Stock counts not snapshotted: {e}")
+
+
+def schedule_ledger_snapshot():
+    io_worker.submit(snapshot_ledger, description="Snapshotting the stock counts")
+    root.after(LEDGER_CHECK_MS, schedule_ledger_snapshot)
 
-current_sheets = sheets['original']
 
 style = ttk.Style()
 style.configure("Treeview", font=('Helvetica', 12,))
@@ -814,14 +1408,196 @@ class SANInputDialog(tk.Toplevel):
 
 def is_san_unique(san_number):
     # Adjust the search to account for the 'SAN' prefix properly
-    search_string = "SAN" + san_number if not san_number.startswith("SAN") else san_number
-    unique = all(search_string != row[0] for row in all_sans_sheet.iter_rows(min_row=2, values_only=True))
+    search_string = normalize_san(san_number)
+    unique = search_string not in san_index
     print(f"Checking SAN {search_string}: Unique - {unique}")  # Debug print
     return unique
 
 
+# Barcode scans arrive as the SAN's digits, with or without the 'SAN' prefix
+SAN_PATTERN = re.compile(r"^(?:SAN)?(\d{5,6})$", re.IGNORECASE)
+
+
+class BurstScanWindow(tk.Toplevel):
+    """
+    Non-modal window taking a stream of scanned SANs for one item. Each SAN is
+    checked against the SAN index as it arrives and the batch is committed at once.
+    """
+
+    def __init__(self, parent, item, operation, item_sheets, expected=None):
+        super().__init__(parent)
+        self.title(f"Burst Scan - {item}")
+        self.geometry("460x560")
+        self.item = item
+        self.operation = operation
+        self.item_sheets = item_sheets
+        self.expected = expected
+        self.scans = {}  # Treeview iid -> [SAN, problem or None], in scan order
+        self.create_widgets()
+        self.after(10, self.entry.focus_force)
+
+    def create_widgets(self):
+        verb = "Receiving" if self.operation == 'add' else "Removing"
+        tk.Label(self, text=f"{verb} {self.item}\nScan each SAN, then Commit.",
+                 font=("Helvetica", 12, "bold")).pack(pady=5)
+
+        self.entry = ttk.Entry(self, font=("Helvetica", 14))
+        self.entry.pack(fill='x', padx=10, pady=5)
+        self.entry.bind("<Return>", self.on_scan)  # Barcode wedges end each scan with Enter
+        self.entry.bind("<KP_Enter>", self.on_scan)
+
+        columns = ("SAN", "Status")
+        self.scan_tree = ttk.Treeview(self, columns=columns, show="headings", height=15)
+        for col in columns:
+            self.scan_tree.heading(col, text=col, anchor='w')
+        self.scan_tree.column("SAN", anchor='w', width=140, stretch=False)
+        self.scan_tree.tag_configure('rejected', foreground='#c00000')
+        self.scan_tree.pack(expand=True, fill='both', padx=10, pady=5)
+
+        self.count_label = tk.Label(self, text="", font=("Helvetica", 12))
+        self.count_label.pack(pady=2)
+
+        button_frame = tk.Frame(self)
+        button_frame.pack(pady=5)
+        ttk.Button(button_frame, text="Remove Selected", command=self.on_remove).pack(side='left', padx=5)
+        ttk.Button(button_frame, text="Commit", command=self.on_commit).pack(side='left', padx=5)
+        ttk.Button(button_frame, text="Cancel", command=self.on_cancel).pack(side='left', padx=5)
+        self.protocol("WM_DELETE_WINDOW", self.on_cancel)
+        self.update_count_label()
+
+    def check_san(self, san_number, accepted):
+        """
+        Return None if the SAN can go into the batch, otherwise why it can't.
+        """
+        if san_number in accepted:
+            return "Duplicate in this batch"
+        if self.operation == 'add':
+            if san_number in san_index:
+                return "Already in stock"
+        else:
+            san_record = san_index.get(san_number)
+            if san_record is None:
+                return "Not in stock"
+            if san_record.item != self.item:
+                return f"Belongs to {san_record.item}"
+        return None
+
+    def accepted(self):
+        return [san_number for san_number, problem in self.scans.values() if problem is None]
+
+    def on_scan(self, event=None):
+        text = self.entry.get().strip()
+        self.entry.delete(0, 'end')
+        if not text:
+            return "break"
+        match = SAN_PATTERN.match(text)
+        if match is None:
+            san_number, problem = text, "Invalid SAN"
+        else:
+            san_number = normalize_san(match.group(1))
+            problem = self.check_san(san_number, set(self.accepted()))
+        iid = self.scan_tree.insert('', 'end', values=(san_number, problem or "OK"),
+                                    tags=('rejected',) if problem else ())
+        self.scans[iid] = [san_number, problem]
+        self.scan_tree.see(iid)
+        if problem:
+            self.bell()
+        self.update_count_label()
+        return "break"
+
+    def revalidate(self):
+        """
+        Re-check every scan, e.g. after a removal or before committing.
+        """
+        accepted = set()
+        for iid, scan in self.scans.items():
+            san_number, problem = scan
+            if problem != "Invalid SAN":
+                problem = self.check_san(san_number, accepted)
+            if problem is None:
+                accepted.add(san_number)
+            scan[1] = problem
+            self.scan_tree.item(iid, values=(san_number, problem or "OK"), tags=('rejected',) if problem else ())
+        self.update_count_label()
+
+    def update_count_label(self):
+        ready = len(self.accepted())
+        text = f"{ready} ready" + (f" of {self.expected}" if self.expected else "")
+        rejected = len(self.scans) - ready
+        if rejected:
+            text += f", {rejected} rejected"
+        self.count_label.config(text=text)
+
+    def on_remove(self):
+        for iid in self.scan_tree.selection():
+            self.scan_tree.delete(iid)
+            del self.scans[iid]
+        self.revalidate()
+        self.entry.focus_set()
+
+    def on_commit(self):
+        self.revalidate()  # The index may have changed while scanning
+        san_numbers = self.accepted()
+        if not san_numbers:
+            tk.messagebox.showinfo("Info", "There are no valid SANs to commit.", parent=self)
+            return
+        commit_san_batch(self.item, self.operation, self.item_sheets, san_numbers)
+        self.destroy()
+
+    def on_cancel(self):
+        if self.accepted() and not tk.messagebox.askyesno(
+                "Discard Scans", "Discard the scanned SANs without saving them?", parent=self):
+            return
+        self.destroy()
+
+
+@timed
+def commit_san_batch(item, operation, item_sheets, san_numbers):
+    """
+    Apply a burst scan: every All_SANs row, log row and the count change go into
+    one journal entry (one write, replayed all or nothing), followed by one save.
+    """
+    items_sheet, timestamps_sheet = item_sheets
+    location = SAN_LOCATIONS.get(timestamps_sheet)
+    entries = []
+    log_rows = []
+    for san_number in san_numbers:
+        if operation == 'add':
+            san_timestamp = timestamp_now()
+            entries.append({"op": "append", "sheet": 'All_SANs', "row": [san_number, item, san_timestamp, location]})
+            san_index.add(san_number, item, san_timestamp, location)
+        else:
+            # Row hints are taken one at a time, so each reflects the deletions before it
+            entries.append({"op": "delete_san", "san": san_number, "row": san_index.get(san_number).row})
+            san_index.remove(san_number)
+        log_rows.append(make_log_row(item, operation, san_number))
+        entries.append({"op": "append", "sheet": timestamps_sheet, "row": log_rows[-1]})
+
+    item_row = item_model.get(items_sheet, item)
+    if item_row is not None:
+        last_count = item_row[2] or 0
+        if operation == 'add':
+            new_count = last_count + len(san_numbers)
+        else:
+            new_count = max(last_count - len(san_numbers), 0)
+        entries.append({"op": "set_count", "sheet": items_sheet, "item": item, "last": last_count, "new": new_count})
+        item_model.set_count(items_sheet, item, last_count, new_count)
+
+    log_rows.append(make_log_row(item, operation, volume=len(san_numbers)))
+    entries.append({"op": "append", "sheet": timestamps_sheet, "row": log_rows[-1]})
+
+    record_change("batch", entries=entries)
+    io_worker.submit(lambda: journal.checkpoint(workbook), description=f"Saving {len(san_numbers)} SANs")
+
+    for log_row in log_rows:
+        show_logged_row(timestamps_sheet, log_row)
+    logging.info(f"Committed burst scan: {operation} {len(san_numbers)} x {item}")
+    update_treeview()
+
+
 def show_san_input():
-    dialog = SANInputDialog(root, "Enter SAN Number")
+    with untimed():  # Waiting for the scan isn't handler latency
+        dialog = SANInputDialog(root, "Enter SAN Number")
     return dialog.result
 
 frame = ctk.CTkFrame(root)
@@ -909,12 +1685,18 @@ def sort_treeview_column(tree, col, descending=False):
     :param col: The column to sort.
     :param descending: If True, sort in descending order; otherwise, ascending.
     """
+    if isinstance(tree, VirtualTreeview):
+        # Sort the full row list; only the visible rows exist as Tk items
+        tree.sort_column(col, descending)
+        tree.heading(col, command=lambda: sort_treeview_column(tree, col, not descending))
+        return
+
     data = [(tree.set(child, col), child) for child in tree.get_children('')]
     
-    # Try converting to datetime or number for proper sorting
-    try:
-        data.sort(key=lambda t: datetime.strptime(t[0], "%Y-%m-%d %H:%M:%S"), reverse=descending)
-    except ValueError:
+    # Try converting to datetime or number for proper sorting (parsed timestamps are cached)
+    if data and all(to_datetime(value) is not None for value, _ in data):
+        data.sort(key=lambda t: to_datetime(t[0]), reverse=descending)
+    else:
         try:
             data.sort(key=lambda t: float(t[0]), reverse=descending)
         except ValueError:
@@ -929,37 +1711,47 @@ def sort_treeview_column(tree, col, descending=False):
 
 
 
+@timed
 def update_treeview():
+    render_treeview()
+    check_for_external_changes()
+
+
+def render_treeview():
     tree.delete(*tree.get_children())
-    workbook = load_workbook(workbook_path)
-    item_sheet = workbook[current_sheets[0]]
-    row_count = 0
-    for row in item_sheet.iter_rows(min_row=2, values_only=True):
-        if row[0] is not None:
-            if row_count % 2 == 0:
-                bg_color = 'white'
-            else:
-                bg_color = '#f0f0f0'
-            tree.insert('', 'end', values=row, tags=('oddrow' if row_count % 2 == 1 else 'evenrow'))
-            tree.tag_configure('oddrow', background='#f0f0f0')
-            tree.tag_configure('evenrow', background='white')
-            row_count += 1
+    for row_count, row in enumerate(item_model.rows(current_sheets[0])):
+        tree.insert('', 'end', values=row, tags=('oddrow' if row_count % 2 == 1 else 'evenrow'))
+    tree.tag_configure('oddrow', background='#f0f0f0')
+    tree.tag_configure('evenrow', background='white')
 
+def make_log_row(item, action, san_number="", volume=1):
+    """
+    Build a timestamp sheet row: [Timestamp, Item, Action, SAN #, Op, Qty].
+    """
+    timestamp = timestamp_now()  # Stored as a datetime cell, not text
+    san_number = f"SAN{san_number}" if san_number and not san_number.startswith('SAN') else san_number
+
+    # Conditionally modify the action string to include volume for non-SAN items
+    if san_number == "":
+        action_text = f"{action} {volume}"
+    else:
+        action_text = action
+    # Op/Qty repeat the action as numbers (+1/-1 and the units moved) for reports to sum
+    op = 1 if action == 'add' else -1
+    qty = volume if san_number == "" else 1
+    return [timestamp, item, action_text, san_number, op, qty]  # Use action_text instead of action
+
+
+@timed
 def log_change(item, action, san_number="", timestamp_sheet=None, volume=1):  # Added volume parameter with default value of 1
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    # timestamp_sheet is the sheet's name: the worker looks the sheet up when it
+    # applies the row, so the Tk thread never waits for it to be parsed
     try:
         if timestamp_sheet is not None:
-            san_number = f"SAN{san_number}" if san_number and not san_number.startswith('SAN') else san_number
-            
-            # Conditionally modify the action string to include volume for non-SAN items
-            if san_number == "":
-                action_text = f"{action} {volume}"
-            else:
-                action_text = action
-            
-            timestamp_sheet.append([timestamp, item, action_text, san_number])  # Use action_text instead of action
-            workbook.save(workbook_path)
-            update_log_view()
+            log_row = make_log_row(item, action, san_number, volume)
+            record_change("append", sheet=timestamp_sheet, row=log_row)
+            show_logged_row(timestamp_sheet, log_row)
+            timestamp, _, action_text, san_number = log_row[:4]
             logging.info(f"Logged change: Time: {timestamp}, Item: {item}, Action: {action_text}, SAN: {san_number}")  # Use action_text
         else:
             logging.error("No timestamp sheet provided for logging.")
@@ -971,25 +1763,75 @@ def switch_sheets(sheet_type):
     global current_sheets
     current_sheets = sheets[sheet_type]
     update_treeview()
-    update_log_view()
+    if isinstance(workbook, LazyWorkbook) and not all(workbook.is_loaded(name) for name in current_sheets):
+        # First visit to this site: parse its sheets off the Tk thread, then show its log
+        io_worker.submit(lambda site_sheets=current_sheets: load_site_sheets(site_sheets),
+                         description="Loading site sheets", on_done=lambda _: update_log_view())
+    else:
+        update_log_view()
 
+def log_view_rows(log_rows):
+    """
+    Return a log's rows as the log view shows them, newest first.
+    """
+    # Rows keep their timestamp as a datetime so sorting never goes back to the text;
+    # cells not yet migrated by migrate_timestamps.py are parsed once here
+    all_rows = [(to_datetime(row[0]) or row[0],) + tuple(row[1:]) for row in log_rows if row[0] is not None]
+    all_rows.sort(key=lambda r: r[0] if isinstance(r[0], datetime) else datetime.min, reverse=True)
+    return all_rows
+
+
+log_view_read = None  # Rows logged since update_log_view() queued its read, until it is shown
+
+
+def show_logged_row(sheet_name, log_row):
+    """
+    Add a row just logged to the log view, if it is showing that sheet.
+    """
+    if sheet_name == current_sheets[1] and 'log_view' in globals():
+        log_view.insert_top(tuple(log_row))  # Newest first, no rebuild
+        if log_view_read is not None:
+            # Queued after the read, so not in the rows it returns
+            log_view_read.append(tuple(log_row))
+
+
+@timed
 def update_log_view():
-    if 'log_view' in globals():
-        log_view.delete(*log_view.get_children())
-        log_sheet = workbook[current_sheets[1]]
-        all_rows = list(log_sheet.iter_rows(min_row=2, values_only=True))
-        # Adjust the sorting to use the first column (timestamp)
-        sorted_rows = sorted(all_rows, key=lambda r: datetime.strptime(r[0], "%Y-%m-%d %H:%M:%S") if r[0] else datetime.min, reverse=True)
-        row_count = 0
-        for row in sorted_rows:
-            if row[0] is not None:
-                log_view.insert('', 'end', values=row, tags=('oddrow' if row_count % 2 == 1 else 'evenrow'))
-                log_view.tag_configure('oddrow', background='#f0f0f0')
-                log_view.tag_configure('evenrow', background='white')
-                row_count += 1
+    """
+    Rebuild the log view from the current timestamp sheet, newest first. Only
+    needed when the sheet changes; new entries are added by log_change. The
+    sheet is read on the I/O worker, which applies journal writes to it.
+    """
+    global log_view_read
+    if 'log_view' not in globals():
+        return
+    if isinstance(workbook, PendingWorkbook):
+        # Still parsing: show the log as it was snapshotted, if there is a snapshot
+        log_view_read = None
+        log_view.set_rows(log_view_rows(warm_snapshot['logs'].get(current_sheets[1], [])
+                                        if warm_snapshot is not None else []))
+        return
+
+    sheet_name = current_sheets[1]
+    read = log_view_read = []
+
+    def read_log():
+        return log_view_rows(workbook[sheet_name].iter_rows(min_row=2, values_only=True))
 
+    def show_log(all_rows):
+        global log_view_read
+        if read is not log_view_read:
+            return  # Another site was picked meanwhile; its own read follows
+        log_view_read = None
+        log_view.set_rows(all_rows)
+        for log_row in read:
+            log_view.insert_top(log_row)
 
+    io_worker.submit(read_log, description=f"Reading {sheet_name}", on_done=show_log)
 
+
+
+@timed
 def update_count(operation):
     """
     Updates the inventory count and handles SAN addition/removal, including logging
@@ -1000,10 +1842,14 @@ def update_count(operation):
         input_value = entry_value.get()
         if input_value.isdigit():
             input_value = int(input_value)
-            item_sheet = workbook[current_sheets[0]]
-            timestamp_sheet = workbook[current_sheets[1]]
+            timestamp_sheet = current_sheets[1]
             san_required = any(g in selected_item for g in ["G8", "G9", "G10"])
 
+            if san_required and burst_scan_var.get():
+                # Scan the whole delivery into one window and commit it as a single batch
+                BurstScanWindow(root, selected_item, operation, current_sheets, expected=input_value)
+                return
+
             entered_sans_count = 0  # To keep track of successfully entered SAN numbers if needed
 
             if san_required:
@@ -1016,58 +1862,52 @@ def update_count(operation):
                         break  # Keep the already entered SANs
 
                     # Ensure SAN number has the 'SAN' prefix
-                    san_number = "SAN" + san_number if not san_number.startswith("SAN") else san_number
+                    san_number = normalize_san(san_number)
                     
                     # Determine the location of the SAN based on the current sheet
-                    location_mapping = {
-                        '4.2_Timestamps': '4.2',
-                        'BR_Timestamps': 'BR',
-                        'Darwin_Timestamps': 'Darwin'
-                    }
-                    current_location = None
-                    for sheet_name, loc in location_mapping.items():
-                        if current_sheets[1] == sheet_name:
-                            current_location = loc
-                            break
+                    current_location = SAN_LOCATIONS.get(current_sheets[1])
 
                     if operation == 'add':
                         if is_san_unique(san_number):
                             # Append the SAN, Item, Timestamp, and Location to the "All_SANs" sheet
-                            all_sans_sheet.append([san_number, selected_item, datetime.now().strftime("%Y-%m-%d %H:%M:%S"), current_location])
+                            san_timestamp = timestamp_now()
+                            record_change("append", sheet='All_SANs',
+                                          row=[san_number, selected_item, san_timestamp, current_location])
+                            # Indexed now, so the next scan sees it even before the write lands
+                            san_index.add(san_number, selected_item, san_timestamp, current_location)
                             # Log each SAN unique number immediately
                             log_change(selected_item, operation, san_number, timestamp_sheet, volume=1)
-                            workbook.save(workbook_path)
                             entered_sans_count += 1
                         else:
                             tk.messagebox.showerror("Error", "Duplicate or already used SAN number.", parent=root)
                     elif operation == 'subtract':
-                        # Search for the SAN in all_sans_sheet and remove if found and matches the item
-                        for row in all_sans_sheet.iter_rows(min_row=2):
-                            if row[0].value == san_number and row[1].value == selected_item:
-                                all_sans_sheet.delete_rows(row[0].row)
-                                log_change(selected_item, operation, san_number, timestamp_sheet, volume=1)
-                                workbook.save(workbook_path)
-                                entered_sans_count += 1
-                                break
-                        else:  # Executed if the loop completes without breaking (SAN not found or doesn't match item)
+                        # Look the SAN up in the index and remove it if it matches the item
+                        san_record = san_index.get(san_number)
+                        if san_record is not None and san_record.item == selected_item:
+                            record_change("delete_san", san=san_number, row=san_record.row)
+                            san_index.remove(san_number)
+                            log_change(selected_item, operation, san_number, timestamp_sheet, volume=1)
+                            entered_sans_count += 1
+                        else:  # SAN not found or doesn't match the item
                             tk.messagebox.showerror("Error", f"SAN number {san_number} does not match the selected item.", parent=root)
 
-            for row in item_sheet.iter_rows(min_row=2):
-                if row[0].value == selected_item:
-                    row[1].value = row[2].value or 0  # Update LastCount to the current NewCount
-                    if operation == 'add':
-                        row[2].value = (row[2].value or 0) + (input_value if not san_required else entered_sans_count)
-                    elif operation == 'subtract':
-                        row[2].value = max((row[2].value or 0) - (input_value if not san_required else entered_sans_count), 0)
+            item_row = item_model.get(current_sheets[0], selected_item)
+            if item_row is not None:
+                last_count = item_row[2] or 0  # Update LastCount to the current NewCount
+                if operation == 'add':
+                    new_count = last_count + (input_value if not san_required else entered_sans_count)
+                else:
+                    new_count = max(last_count - (input_value if not san_required else entered_sans_count), 0)
+                record_change("set_count", sheet=current_sheets[0],
+                              item=selected_item, last=last_count, new=new_count)
+                item_model.set_count(current_sheets[0], selected_item, last_count, new_count)
 
             # Log volume for non-SAN items or after all entered SANs
             if (san_required and entered_sans_count > 0) or not san_required:
                 volume_to_log = input_value if not san_required else entered_sans_count
                 log_change(selected_item, operation, "", timestamp_sheet, volume=volume_to_log)
 
-            workbook.save(workbook_path)
             update_treeview()
-            update_log_view()
 
         # **Add this line to refocus on the entry field after processing**
         entry_value.focus_set()
@@ -1077,16 +1917,8 @@ def check_restock_threshold(threshold=10):
     Display items that need restocking based on individual thresholds.
     """
     try:
-        low_stock_items = []
-
-        # Iterate through sheets to check against thresholds
-        for sheet_name in ['4.2_Items', 'BR_Items', 'Darwin_Items']:
-            if sheet_name in workbook.sheetnames:
-                sheet = workbook[sheet_name]
-                for row in sheet.iter_rows(min_row=2, values_only=True):
-                    item, _, new_count, item_threshold = row[:4]  # Adjust columns as necessary
-                    if new_count is not None and item_threshold is not None and new_count < item_threshold:
-                        low_stock_items.append((sheet_name, item, new_count, item_threshold))
+        # Kept current by the item model as counts change; covers every site
+        low_stock_items = item_model.low_stock.items()
 
         # Display results
         if low_stock_items:
@@ -1167,13 +1999,72 @@ button_add = ctk.CTkButton(
 )
 button_add.pack(side="left", padx=2)  # Minimal horizontal padding
 
+# Low stock badge: number of items under their threshold, opens the Low Stock window
+low_stock_button = ctk.CTkButton(
+    controls_frame,
+    text="",
+    width=140,
+    font=("Helvetica", 12),
+    corner_radius=3,
+    command=lambda: check_restock_threshold(10)
+)
+low_stock_button.pack(pady=1)
+low_stock_notice = None  # Pending after() id that restores the badge text
+
+
+def update_low_stock_badge():
+    count = len(item_model.low_stock)
+    low_stock_button.configure(text=f"Low stock: {count}", fg_color="#c0392b" if count else "#2e7d32")
+
+
+def on_low_stock_change(sheet_name, item, count, threshold, is_low):
+    """
+    Called by the item model when an item crosses its threshold.
+    """
+    global low_stock_notice
+    update_low_stock_badge()
+    if is_low:
+        logging.info(f"{item} in {sheet_name} fell below its threshold ({count} < {threshold})")
+        low_stock_button.configure(text=f"Low: {item} ({count}/{threshold})")
+        if low_stock_notice is not None:
+            root.after_cancel(low_stock_notice)
+        low_stock_notice = root.after(LOW_STOCK_NOTICE_MS, update_low_stock_badge)
+
+
+item_model.low_stock.listeners.append(on_low_stock_change)
+update_low_stock_badge()
+
+# SAN-tracked items are scanned in one non-modal window instead of a dialog per SAN
+burst_scan_var = tk.BooleanVar(value=True)
+burst_scan_checkbox = ctk.CTkCheckBox(
+    entry_controls_frame,
+    text="Burst scan",
+    variable=burst_scan_var,
+    font=("Helvetica", 12)
+)
+burst_scan_checkbox.pack(side="left", padx=6)
+
+# Shows what the workers are doing (saving, plotting, emailing)
+busy_label = ctk.CTkLabel(controls_frame, text="", font=("Helvetica", 12))
+busy_label.pack(pady=1)
+busy_descriptions = {}
+
+
+def show_busy(worker, description):
+    busy_descriptions[worker] = description
+    busy_label.configure(text=", ".join(f"{description}..." for description in busy_descriptions.values() if description))
+
+
+io_worker.busy_listeners.append(lambda description: show_busy(io_worker, description))
+report_worker.busy_listeners.append(lambda description: show_busy(report_worker, description))
+
 # Log view frame
 log_view_frame = ctk.CTkFrame(root)
 log_view_frame.pack(side=tk.BOTTOM, fill='both', expand=True, padx=2, pady=2)  # Minimal margins
 
 # Log Treeview
 log_view_columns = ("Timestamp", "Item", "Action", "SAN Number")
-log_view = ttk.Treeview(log_view_frame, columns=log_view_columns, show="headings", style="Treeview", height=15)
+log_view = VirtualTreeview(log_view_frame, columns=log_view_columns, show="headings", style="Treeview", height=15)
 for col in log_view_columns:
     log_view.heading(col, text=col, anchor='w',
                      command=lambda c=col: sort_treeview_column(log_view, c))  # Add sorting
@@ -1213,7 +2104,53 @@ def add_copy_option(tree):
 add_copy_option(tree)
 add_copy_option(log_view)
 
+def on_close():
+    """
+    Finish queued I/O, stop the background checkpointer (saving outstanding
+    changes), then exit.
+    """
+    try:
+        report_worker.stop()
+        io_worker.stop()
+        checkpointer.stop()
+        stats_log.write()
+    except Exception as e:
+        logging.error(f"Final checkpoint failed: {e}")
+        tk.messagebox.showerror("Error", f"Failed to save the workbook: {e}\nChanges are kept in {journal.path}.")
+    root.destroy()
+
+
+def poll_io_worker():
+    io_worker.poll()
+    report_worker.poll()
+    root.after(IO_POLL_MS, poll_io_worker)
+
+
+def write_stats_log():
+    try:
+        stats_log.write()
+    except OSError as e:
+        logging.error(f"Failed to write diagnostics: {e}")
+    root.after(STATS_LOG_INTERVAL_MS, write_stats_log)
+
+
+def report_first_interaction():
+    """
+    Log how long after launch the window was ready for input.
+    """
+    seconds = time.perf_counter() - LAUNCH_STARTED
+    diagnostics.record("startup: first interaction", seconds)
+    loading = " (workbook still loading)" if isinstance(workbook, PendingWorkbook) else ""
+    logging.info(f"Ready for input {seconds:.2f}s after launch{loading}")
+
+
+root.protocol("WM_DELETE_WINDOW", on_close)
 root.after(100, update_treeview)
+root.after(IO_POLL_MS, poll_io_worker)
+root.after(STATS_LOG_INTERVAL_MS, write_stats_log)
+root.after(SITE_EVICT_CHECK_MS, schedule_site_eviction)
+root.after(LEDGER_CHECK_MS, schedule_ledger_snapshot)
 update_log_view()
+root.after_idle(report_first_interaction)  # Runs once the window has been drawn
 
 root.mainloop()
\ No newline at end of file
@@ -9,11 +9,11 @@ import os
 import tkinter as tk
 from tkinter import ttk
 from openpyxl import load_workbook, Workbook
-from datetime import datetime
+from datetime import datetime, timedelta
 import subprocess
 from tkinter import filedialog
 from tkinter import messagebox
-import pandas as pd  # Ensure pandas is imported for date operations
+from workbook_reader import iter_rows, parse_action, to_datetime  # Streaming, read-only access for the report windows
 
 # Function to save the workbook path to config.py
 def save_config(workbook_path):
@@ -158,31 +158,11 @@ def load_week_data(weeks_ago=0):
     """
     Populate Treeview with data for the selected week offset.
     """
+    import pandas as pd  # Imported on first use rather than at startup
+
     log_tree.delete(*log_tree.get_children())  # Clear current data
 
     if 'All_SANs' in workbook.sheetnames:
-        all_sans_sheet = workbook['All_SANs']
-
-        # Create a DataFrame for easier date filtering
-        data = [
-            {
-                "Date": row[2],
-                "SAN Number": row[0],
-                "Item": row[1],
-                "Volume": 1,  # Volume handling logic can be added here
-            }
-            for row in all_sans_sheet.iter_rows(min_row=2, values_only=True)
-            if row[2]  # Ensure the timestamp column is not empty
-        ]
-        df = pd.DataFrame(data)
-
-        # Debug: Print loaded data
-        print("Loaded DataFrame:", df)
-
-        # Convert date strings to datetime for filtering
-        df["Date"] = pd.to_datetime(df["Date"], errors="coerce")
-        print("Dates Converted to Datetime:", df["Date"])
-
         current_date = pd.Timestamp.now()
         print("Current Date:", current_date)
 
@@ -192,8 +172,19 @@ def load_week_data(weeks_ago=0):
 
         print(f"Filtering dates from {start_of_week} to {end_of_week}")
 
-        # Filter data for the selected week
-        weekly_data = df[(df["Date"] >= start_of_week) & (df["Date"] <= end_of_week)]
+        # Stream the SAN, Item and Time columns from the saved workbook and keep
+        # only the selected week, so memory doesn't grow with the sheet
+        data = [
+            {
+                "Date": row.time,
+                "SAN Number": row.san,
+                "Item": row.item,
+                "Volume": 1,  # Volume handling logic can be added here
+            }
+            for row in iter_rows(workbook_path, 'All_SANs', fields=('san', 'item', 'time'))
+            if row.time and start_of_week <= row.time <= end_of_week  # Timestamps come back as datetimes
+        ]
+        weekly_data = pd.DataFrame(data, columns=["Date", "SAN Number", "Item", "Volume"])
 
         # Debug: Print weekly data
         print("Filtered Weekly Data:", weekly_data)
@@ -211,15 +202,45 @@ def load_week_data(weeks_ago=0):
 
 
 
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-import pandas as pd  # For date filtering
+# Daily stock levels per site and item, built from the logs on first use
+inventory_snapshots = None
+
+
+def get_inventory_snapshots():
+    """
+    Return the daily snapshots, loading them from the cache or replaying the logs once.
+    """
+    global inventory_snapshots
+    if inventory_snapshots is None:
+        from inventory_snapshots import DailySnapshots  # Pulls in NumPy; only load it when a diagram asks
+        inventory_snapshots = DailySnapshots.open(workbook, workbook_path)
+    return inventory_snapshots
+
+
+def save_inventory_snapshots():
+    """
+    Write the snapshots back to their cache if log_change has extended them.
+    """
+    if inventory_snapshots is not None and inventory_snapshots.dirty:
+        from inventory_snapshots import snapshot_path_for, workbook_stamp
+        try:
+            inventory_snapshots.save(snapshot_path_for(workbook_path), workbook_stamp(workbook))
+        except OSError as e:
+            logging.warning(f"Could not cache inventory snapshots: {e}")
+
 
 def plot_inventory_with_slider():
     """
-    Displays a dynamic diagram with a slider to navigate weekly inventory levels
-    for selected inventories (BR, 4.2, Darwin, All).
+    Displays a dynamic diagram with a slider to scrub back through the daily stock
+    levels of each item for the selected inventory (or all of them).
     """
+    # matplotlib takes longer to import than the rest of the app; only load it when asked for a diagram
+    import matplotlib.pyplot as plt
+    from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+
+    snapshots = get_inventory_snapshots()
+    history_days = (snapshots.end - snapshots.start).days
+
     # Create a new window
     plot_window = tk.Toplevel(root)
     plot_window.title("Inventory Levels Over Time")
@@ -230,16 +251,16 @@ def plot_inventory_with_slider():
     slider_frame.pack(fill="x", padx=10, pady=5)
 
     # Label for slider
-    slider_label = tk.Label(slider_frame, text="Weeks Ago:")
+    slider_label = tk.Label(slider_frame, text="Days Ago:")
     slider_label.pack(side="left", padx=5)
 
-    # Create slider
-    week_slider = ttk.Scale(slider_frame, from_=0, to=12, orient="horizontal", length=300)
-    week_slider.pack(side="left", padx=10)
-    week_slider.set(0)  # Default to current week
+    # Create slider; every day of the history is one lookup in the snapshots
+    day_slider = ttk.Scale(slider_frame, from_=history_days, to=0, orient="horizontal", length=400)
+    day_slider.pack(side="left", padx=10)
+    day_slider.set(0)  # Default to today
 
-    week_display = tk.Label(slider_frame, text="Current Week")
-    week_display.pack(side="left", padx=5)
+    day_display = tk.Label(slider_frame, text="Today", width=24, anchor="w")
+    day_display.pack(side="left", padx=5)
 
     # Dropdown to select inventory
     inventory_label = tk.Label(slider_frame, text="Select Inventory:")
@@ -247,7 +268,7 @@ def plot_inventory_with_slider():
 
     inventory_var = tk.StringVar(value="BR")  # Default to 'BR'
     inventory_dropdown = ttk.Combobox(
-        slider_frame, textvariable=inventory_var, values=["BR", "4.2", "Darwin", "All"]
+        slider_frame, textvariable=inventory_var, values=snapshots.sites() + ["All"]
     )
     inventory_dropdown.pack(side="left", padx=5)
 
@@ -259,89 +280,69 @@ def plot_inventory_with_slider():
     canvas = FigureCanvasTkAgg(fig, master=plot_frame)
     canvas.get_tk_widget().pack(fill="both", expand=True)
 
-    def load_plot_data(inventory, weeks_ago):
+    chart = {'inventory': None, 'items': [], 'bars': None}
+    pending_draw = None
+
+    def draw_chart(inventory):
         """
-        Load and plot inventory data based on selected inventory and week offset.
+        Lay out the bars for an inventory; scrubbing only changes their heights.
         """
+        site = None if inventory == "All" else inventory
+        items = snapshots.items(site)
         ax.clear()
-
-        # Collect data for selected inventory
-        data = []
-        if inventory == "All":
-            # Combine data from all timestamp sheets
-            for sheet_name in ["BR_Timestamps", "4.2_Timestamps", "Darwin_Timestamps"]:
-                if sheet_name in workbook.sheetnames:
-                    sheet_data = [
-                        {"Date": row[0], "Item": row[1], "Volume": row[2]}
-                        for row in workbook[sheet_name].iter_rows(min_row=2, values_only=True)
-                        if row[0]
-                    ]
-                    data.extend(sheet_data)
-        else:
-            # Load data from the selected sheet
-            sheet_name = f"{inventory}_Timestamps"
-            if sheet_name not in workbook.sheetnames:
-                ax.set_title(f"No data available for {inventory}")
-                canvas.draw()
-                return
-
-            data = [
-                {"Date": row[0], "Item": row[1], "Volume": row[2]}
-                for row in workbook[sheet_name].iter_rows(min_row=2, values_only=True)
-                if row[0]
-            ]
-
-        if not data:
+        chart.update(inventory=inventory, items=items, bars=None)
+        if not items:
             ax.set_title(f"No data available for {inventory}")
-            canvas.draw()
-            return
-
-        # Convert data to DataFrame
-        df = pd.DataFrame(data)
-
-        # Convert date strings to datetime for filtering
-        df["Date"] = pd.to_datetime(df["Date"], errors="coerce")
-        current_date = pd.Timestamp.now()
-
-        # Calculate the start and end of the week
-        end_of_week = current_date - pd.Timedelta(weeks=weeks_ago * 7)
-        start_of_week = end_of_week - pd.Timedelta(days=6)
-
-        # Filter data for the selected week
-        weekly_data = df[(df["Date"] >= start_of_week) & (df["Date"] <= end_of_week)]
-
-        if weekly_data.empty:
-            ax.set_title(f"No data for {inventory} during {start_of_week.strftime('%Y-%m-%d')} to {end_of_week.strftime('%Y-%m-%d')}")
-            canvas.draw()
             return
-
-        # Aggregate inventory levels by item
-        inventory_summary = weekly_data.groupby("Item")["Volume"].sum()
-
-
-        # Plot the data
-        inventory_summary.plot(kind="bar", ax=ax)
-        ax.set_title(f"Inventory Levels for {inventory} ({start_of_week.strftime('%Y-%m-%d')} to {end_of_week.strftime('%Y-%m-%d')})")
+        peak = max(int(snapshots.history(site, items).max()), 1)
+        chart['bars'] = ax.bar(range(len(items)), [0] * len(items))
+        ax.set_xticks(range(len(items)))
+        ax.set_xticklabels(items, rotation=45, ha="right", fontsize=8)
+        ax.set_ylim(0, peak * 1.1)  # Fixed scale so bars can be compared while scrubbing
         ax.set_xlabel("Item")
-        ax.set_ylabel("Volume")
-        ax.grid(True)
+        ax.set_ylabel("Stock")
+        ax.grid(True, axis="y")
+        fig.tight_layout()
 
-        # Redraw the canvas
-        canvas.draw()
+    def load_plot_data(inventory, days_ago):
+        """
+        Show the stock levels of the selected inventory at the end of a day.
+        """
+        if inventory != chart['inventory']:
+            draw_chart(inventory)
+        day = snapshots.end - timedelta(days=days_ago)
+        day_display.config(text=f"{day.strftime('%Y-%m-%d')} ({days_ago} days ago)" if days_ago else "Today")
+        if chart['bars'] is not None:
+            levels = snapshots.levels_on(day, None if inventory == "All" else inventory, chart['items'])
+            for bar, level in zip(chart['bars'], levels):
+                bar.set_height(level)
+            ax.set_title(f"Inventory Levels for {inventory} on {day.strftime('%Y-%m-%d')}")
+        canvas.draw_idle()
 
     def on_slider_or_inventory_change(*args):
         """
-        Callback for slider or inventory dropdown changes.
+        Callback for slider or inventory dropdown changes; redraws at most once per idle.
         """
-        weeks_ago = int(week_slider.get())
-        inventory = inventory_var.get()
-        week_display.config(text=f"Week Offset: {weeks_ago}")
-        load_plot_data(inventory, weeks_ago)
+        nonlocal pending_draw
+        if pending_draw is None:
+            pending_draw = plot_window.after_idle(redraw)
+
+    def redraw():
+        nonlocal pending_draw
+        pending_draw = None
+        load_plot_data(inventory_var.get(), int(round(float(day_slider.get()))))
 
     # Bind events for the slider and dropdown
-    week_slider.bind("<Motion>", on_slider_or_inventory_change)
+    day_slider.configure(command=on_slider_or_inventory_change)
     inventory_dropdown.bind("<<ComboboxSelected>>", on_slider_or_inventory_change)
 
+    def on_close():
+        save_inventory_snapshots()
+        plt.close(fig)
+        plot_window.destroy()
+
+    plot_window.protocol("WM_DELETE_WINDOW", on_close)
+
     # Load the initial plot
     load_plot_data(inventory_var.get(), 0)
 
@@ -539,8 +540,16 @@ def log_change(item, action, san_number="", timestamp_sheet=None, volume=1):  #
             else:
                 action_text = action
             
-            timestamp_sheet.append([timestamp, item, action_text, san_number])  # Use action_text instead of action
+            op, qty = parse_action(action_text)  # Numeric copy of the action for reports
+            timestamp_sheet.append([timestamp, item, action_text, san_number, op, qty])  # Use action_text instead of action
             workbook.save(workbook_path)
+            if inventory_snapshots is not None:
+                # Keep the daily levels current without replaying the log (the
+                # module is already imported once there are snapshots to update)
+                from inventory_snapshots import action_delta
+                delta = action_delta(action_text, san_number, op, qty)
+                if delta is not None:
+                    inventory_snapshots.record(timestamp_sheet.title[:-len('_Timestamps')], item, timestamp, delta)
             update_log_view()
             logging.info(f"Logged change: Time: {timestamp}, Item: {item}, Action: {action_text}, SAN: {san_number}")  # Use action_text
         else:
@@ -561,7 +570,7 @@ def update_log_view():
         log_sheet = workbook[current_sheets[1]]
         all_rows = list(log_sheet.iter_rows(min_row=2, values_only=True))
         # Adjust the sorting to use the first column (timestamp)
-        sorted_rows = sorted(all_rows, key=lambda r: datetime.strptime(r[0], "%Y-%m-%d %H:%M:%S") if r[0] else datetime.min, reverse=True)
+        sorted_rows = sorted(all_rows, key=lambda r: to_datetime(r[0]) or datetime.min, reverse=True)
         row_count = 0
         for row in sorted_rows:
             if row[0] is not None:
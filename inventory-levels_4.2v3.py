@@ -4,10 +4,12 @@ import pandas as pd
 import matplotlib.pyplot as plt
 from datetime import datetime
 import argparse
+from inventory_plots import read_items_sheet  # Reads xlsx or the SQLite store
 
 # Argument parsing for output file path
 parser = argparse.ArgumentParser(description="Generate inventory level plot for Basement 4.2.")
 parser.add_argument("--output", required=True, help="Path to save the output plot")
+parser.add_argument("--workbook", default=None, help="Workbook (.xlsx) or SQLite store (.db) to read")
 args = parser.parse_args()
 
 # Check if the application is "frozen"
@@ -19,13 +21,12 @@ else:
     application_path = os.path.dirname(__file__)
 
 # Construct the path to the file
-file_path = os.path.join(application_path, 'EUC_Perth_Assets.xlsx')
+file_path = args.workbook or os.path.join(application_path, 'EUC_Perth_Assets.xlsx')
 
 # Load the spreadsheet
 try:
     print(f"Loading spreadsheet from {file_path}")
-    xl = pd.ExcelFile(file_path)
-    df_items = xl.parse('4.2_Items')  # Changed from 'BR_Items' to '4.2_Items'
+    df_items = read_items_sheet(file_path, '4.2_Items')  # Changed from 'BR_Items' to '4.2_Items'
     print("Spreadsheet loaded successfully.")
 except FileNotFoundError:
     print(f"Error: File not found at {file_path}. Please ensure the file exists.")
@@ -4,22 +4,24 @@ import matplotlib.pyplot as plt
 from datetime import datetime
 import argparse
 from config import workbook_path  # Import the path from the config file
+from inventory_plots import read_items_sheets  # Reads xlsx or the SQLite store
 
 # Argument parsing for output file path
 parser = argparse.ArgumentParser(description="Generate combined inventory level plot.")
 parser.add_argument("--output", required=True, help="Path to save the output plot")
+parser.add_argument("--workbook", default=None, help="Workbook (.xlsx) or SQLite store (.db) to read")
 args = parser.parse_args()
 
-# Use the imported workbook_path directly
-file_path = workbook_path
+# Use the imported workbook_path unless one was passed in
+file_path = args.workbook or workbook_path
 
 # Load the spreadsheet
 try:
     print(f"Loading spreadsheet from {file_path}")
-    xl = pd.ExcelFile(file_path)
-    df_42_items = xl.parse('4.2_Items')
-    df_br_items = xl.parse('BR_Items')
-    df_darwin_items = xl.parse('Darwin_Items')  # Load the Darwin_Items sheet
+    item_sheets = read_items_sheets(file_path, ['4.2_Items', 'BR_Items', 'Darwin_Items'])
+    df_42_items = item_sheets['4.2_Items']
+    df_br_items = item_sheets['BR_Items']
+    df_darwin_items = item_sheets['Darwin_Items']  # Load the Darwin_Items sheet
     print("Spreadsheet loaded successfully.")
 except FileNotFoundError:
     print(f"Error: File not found at {file_path}. Please ensure the file exists.")
@@ -4,19 +4,20 @@ import pandas as pd
 import matplotlib.pyplot as plt
 from datetime import datetime
 import argparse
+from inventory_plots import read_items_sheet  # Reads xlsx or the SQLite store
 
 # Argument parsing for output file path
 parser = argparse.ArgumentParser(description="Generate inventory level plot.")
 parser.add_argument("--output", required=True, help="Path to save the output plot")
+parser.add_argument("--workbook", default=None, help="Workbook (.xlsx) or SQLite store (.db) to read")
 args = parser.parse_args()
 
 # Construct the path to the file
-file_path = os.path.join(os.path.dirname(__file__), 'EUC_Perth_Assets.xlsx')
+file_path = args.workbook or os.path.join(os.path.dirname(__file__), 'EUC_Perth_Assets.xlsx')
 
 # Load the spreadsheet
 try:
-    xl = pd.ExcelFile(file_path)
-    df_items = xl.parse('Darwin_Items')
+    df_items = read_items_sheet(file_path, 'Darwin_Items')
 except FileNotFoundError:
     print(f"Error: File not found at {file_path}. Please ensure the file exists.")
     sys.exit(1)
@@ -0,0 +1,752 @@
+# Stock counts derived from the *_Timestamps logs
+#
+# update_count() changes LastCount/NewCount in the *_Items sheets in place and
+# appends the same movement to the site's *_Timestamps log, but nothing ties the
+# two together afterwards: a count typed over in Excel, or a row lost to a failed
+# save, and they disagree for good with no way to tell which is right. The ledger
+# replays the logs to check and repair the stored counts. A site's counts are what
+# replaying its log gives, applied the way update_count() applies them: adds add,
+# subtracts stop at zero, and SAN rows are skipped because the total is logged
+# again after them.
+#
+# The ledger is an audit and rebuild tool, not the source of truth: the app still
+# reads and edits NewCount in the *_Items sheets, and never loads counts from a
+# replay. verify reports where the two disagree; rebuild writes the replayed
+# counts back over the stored ones, and only when it is run.
+#
+# Replays start from a snapshot rather than the first log row. A snapshot holds
+# every site's counts as of a given log row, plus that row's contents, so a log
+# edited above it (rows deleted or changed in Excel) is noticed and an earlier
+# snapshot used instead. Snapshots are kept next to the workbook
+# ("<workbook>.ledger.json"); the app adds one whenever enough rows have been
+# logged since the last, so a replay only reads the rows logged after it. The
+# logs were started after the stockrooms were, so the first snapshot adopts the
+# stored counts as they stand (the app does this itself the first time it runs).
+#
+# The log columns are read straight from the sheet XML and replayed with NumPy,
+# which rebuilds all five sites from a million log rows in a few seconds. Works
+# on .xlsx workbooks and SQLite stores (.db). Close the app before a rebuild.
+#
+#   python inventory_ledger.py verify EUC_Perth_Assets.xlsx      # Replayed vs stored counts
+#   python inventory_ledger.py rebuild EUC_Perth_Assets.xlsx --dry-run
+#   python inventory_ledger.py snapshot EUC_Perth_Assets.xlsx [--adopt]
+
+import argparse
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from functools import lru_cache
+import html
+from io import BytesIO
+import json
+import logging
+from operator import itemgetter
+import os
+from pathlib import Path
+import re
+import sys
+import time
+
+import numpy as np
+from openpyxl.reader.excel import ExcelReader
+from openpyxl.utils import column_index_from_string, get_column_letter
+from openpyxl.utils.datetime import from_excel
+from openpyxl.worksheet._reader import WorkSheetParser
+
+from migrate_timestamps import migrate_file
+from sqlite_store import SqliteStore, column_map, is_sqlite_path
+from workbook_reader import parse_action, to_datetime, to_number
+from xlsx_partial import read_sheet_parts
+
+LEDGER_VERSION = 1  # Bump when the ledger file layout changes
+KEEP_SNAPSHOTS = 10  # Older snapshots are dropped as new ones are added
+
+LOG_FIELDS = ('item', 'action', 'san', 'op', 'qty')
+ANCHOR_FIELDS = ('timestamp', 'item', 'action', 'san')
+COUNT_FIELDS = ('item', 'last_count', 'new_count')
+
+
+class LedgerError(Exception):
+    """
+    The logs no longer match any snapshot, so counts can't be replayed from one.
+    """
+
+
+def ledger_path_for(workbook_path):
+    """
+    Return the snapshot file that belongs to the given workbook.
+    """
+    return Path(f"{workbook_path}.ledger.json")
+
+
+def log_sites(sheet_names):
+    """
+    Return the sites that have both a *_Items and a *_Timestamps sheet.
+    """
+    return [name[:-len('_Timestamps')] for name in sheet_names
+            if name.endswith('_Timestamps') and f"{name[:-len('_Timestamps')]}_Items" in sheet_names]
+
+
+# Reading the logs
+
+# What follows a cell's reference: attributes, then <v> or inline text (the usual
+# forms, matched first), or an empty cell, or anything else (formulas, rich text)
+_BODY = rb'(?:[^>]*>(?:<is><t>[^<]*</t></is>|<v>[^<]*</v>)</c>|[^>]*/>|[^>]*>.*?</c>)'
+_CELLS = re.compile(rb'<c r="([A-Z]+)(\d+)"(' + _BODY + rb')', re.S)
+_CELL_BODY = re.compile(rb'([^>]*?)(?:/>|><v>([^<]*)</v></c>|><is><t[^>]*>([^<]*)</t></is></c>|>(.*?)</c>)', re.S)
+_CELL_TYPE = re.compile(rb'\bt="(\w+)"')
+_VALUE = re.compile(rb'<v>([^<]*)</v>')
+_TEXT = re.compile(rb'<t[^>]*>([^<]*)</t>')
+_ROW = re.compile(rb'<row r="(\d+)"')
+
+
+@lru_cache(maxsize=None)
+def _row_pattern(positions):
+    """
+    Return a pattern matching one row of the sheet XML as (row number, then what
+    follows the reference of each cell at the given 0-based positions, or b'').
+    Cells are written in column order, so each column is matched in turn: its
+    cell if the row has one there, and nothing only if it hasn't.
+    """
+    cells = []
+    for position in range(max(positions) + 1):
+        reference = b'<c r="' + get_column_letter(position + 1).encode() + rb'(?=\d)'
+        body = b'(' + _BODY + b')' if position in positions else _BODY
+        cells.append(b'(?:' + reference + rb'\d+"' + body + b'|(?!' + reference + b'))')
+    # Anything left in the row must be a cell further right; otherwise the row
+    # isn't matched at all, which _scan() notices
+    return re.compile(rb'<row r="(\d+)"[^>]*>' + b''.join(cells) + rb'(?=</row>|<c r="|<row |</sheetData>)', re.S)
+
+
+def _row_offset(xml, row_idx, low=0):
+    """
+    Return where the first row numbered row_idx or higher starts in a sheet's
+    XML (its length if there is none). Rows are written in order, so a row that
+    isn't there (empty, or not logged yet) is found by bisection.
+    """
+    found = xml.find(b'<row r="%d"' % row_idx, low)
+    if found >= 0:
+        return found
+    high = len(xml)
+    while low < high:
+        middle = (low + high) // 2
+        row = _ROW.search(xml, middle)
+        if row is None or int(row.group(1)) >= row_idx:
+            high = middle
+        else:
+            low = middle + 1
+    row = _ROW.search(xml, low)
+    return row.start() if row else len(xml)
+
+
+def _text(raw):
+    text = raw.decode('utf-8')
+    return html.unescape(text) if '&' in text else text
+
+
+def _decode_cell(body, shared_strings):
+    """
+    Return a cell's value from what follows its reference, as openpyxl would read
+    it (dates stay Excel serial numbers; the timestamp column is converted by _anchor()).
+    """
+    attrs, value, inline, other = _CELL_BODY.fullmatch(body).groups()
+    kind = _CELL_TYPE.search(attrs)
+    kind = kind.group(1) if kind else b'n'
+    if other is not None:
+        found = _VALUE.search(other)
+        value = found.group(1) if found else None
+        inline = b''.join(_TEXT.findall(other))
+    if kind == b'inlineStr':
+        return _text(inline) if inline else None
+    if not value:
+        return None
+    if kind == b's':
+        return shared_strings[int(value)]
+    if kind in (b'str', b'd'):
+        return _text(value)
+    if kind == b'b':
+        return value == b'1'
+    if kind == b'e':
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        number = float(value)
+        return int(number) if number.is_integer() else number
+
+
+class _XlsxSource:
+    """
+    The sheets of an xlsx, read column by column from the sheet XML. Much faster
+    than openpyxl for the few columns of a long log, and able to start at a row.
+    """
+
+    def __init__(self, path):
+        reader = ExcelReader(str(path), read_only=True)
+        reader.read_manifest()
+        reader.read_strings()
+        self.archive = reader.archive
+        self.shared_strings = reader.shared_strings
+        self.parts = read_sheet_parts(self.archive)
+        self._xml = {}  # Sheet name -> its inflated XML, read once per source
+
+    @property
+    def sheetnames(self):
+        return list(self.parts)
+
+    def close(self):
+        self.archive.close()
+
+    def _sheet_xml(self, sheet_name):
+        if sheet_name not in self._xml:
+            self._xml[sheet_name] = self.archive.read(self.parts[sheet_name])
+        return self._xml[sheet_name]
+
+    def _header(self, sheet_name):
+        xml = self._sheet_xml(sheet_name)
+        start = xml.find(b'<row r="1"')
+        if start < 0:
+            return []
+        cells = {column_index_from_string(letters.decode()) - 1: _decode_cell(body, self.shared_strings)
+                 for letters, row, body in _CELLS.findall(xml, start, xml.find(b'</row>', start)) if row == b'1'}
+        return [cells.get(position) for position in range(max(cells, default=-1) + 1)]
+
+    def _scan(self, sheet_name, positions, min_row, max_row=None):
+        """
+        Return {position: list of values}, one entry per row from min_row to the
+        last row with any of the given 0-based columns filled in (or max_row).
+        """
+        positions = sorted(positions)
+        if not positions or (max_row is not None and max_row < min_row):
+            return {position: [] for position in positions}
+        xml = self._sheet_xml(sheet_name)
+        start = _row_offset(xml, min_row)
+        end = _row_offset(xml, max_row + 1, start) if max_row is not None else len(xml)
+
+        matches = _row_pattern(tuple(positions)).findall(xml, start, end)
+        if len(matches) != xml.count(b'<row ', start, end):
+            logging.info(f"{sheet_name} has rows laid out unusually; reading it with openpyxl")
+            return self._scan_with_openpyxl(sheet_name, positions, min_row, max_row)
+        columns = {}
+        decoded = {b'': None}  # Item names and actions repeat on every other row; decode each once
+        for group, position in enumerate(positions, start=1):
+            bodies = list(map(itemgetter(group), matches))
+            for body in set(bodies).difference(decoded):
+                decoded[body] = _decode_cell(body, self.shared_strings)
+            columns[position] = list(map(decoded.__getitem__, bodies))
+
+        # Rows past the last one with any of the columns filled in aren't part of
+        # the log, e.g. the empty but formatted row 1048576 Excel often leaves
+        filled = len(matches)
+        while filled and all(columns[position][filled - 1] is None for position in positions):
+            filled -= 1
+        indexes = [int(row) - min_row for row in map(itemgetter(0), matches[:filled])]
+        count = indexes[-1] + 1 if indexes else 0
+        for position in positions:
+            values = columns[position][:filled]
+            if count != filled:  # Empty rows left out of the XML
+                placed = [None] * count
+                for index, value in zip(indexes, values):
+                    placed[index] = value
+                values = placed
+            columns[position] = values
+        return columns
+
+    def _scan_with_openpyxl(self, sheet_name, positions, min_row, max_row=None):
+        rows = {}  # Index from min_row -> {position: value} of the rows with any filled in
+        wanted = set(positions)
+        parser = WorkSheetParser(BytesIO(self._sheet_xml(sheet_name)), self.shared_strings, data_only=True)
+        for row_idx, cells in parser.parse():
+            if max_row is not None and row_idx > max_row:
+                break
+            values = {cell['column'] - 1: cell['value'] for cell in cells
+                      if cell['column'] - 1 in wanted and cell['value'] is not None}
+            if row_idx >= min_row and values:
+                rows[row_idx - min_row] = values
+        count = max(rows, default=-1) + 1
+        return {position: [rows[index].get(position) if index in rows else None for index in range(count)]
+                for position in positions}
+
+    def read_fields(self, sheet_name, kind, fields, min_row=2, max_row=None):
+        """
+        Return (first row, {field: list of values}) for rows min_row onwards, up
+        to the last row that has any of the fields.
+        """
+        positions = column_map(kind, self._header(sheet_name))
+        wanted = {positions[field] for field in fields if field in positions}
+        columns = self._scan(sheet_name, wanted, min_row, max_row)
+        count = max(map(len, columns.values()), default=0)
+        return min_row, {field: columns[positions[field]] if field in positions else [None] * count
+                         for field in fields}
+
+
+class _SqliteSource:
+    """
+    The sheets of a SQLite store, read with the same interface as _XlsxSource.
+    """
+
+    def __init__(self, path):
+        self.store = SqliteStore(str(path))
+
+    @property
+    def sheetnames(self):
+        return self.store.sheetnames()
+
+    def close(self):
+        self.store.close()
+
+    def read_fields(self, sheet_name, kind, fields, min_row=2, max_row=None):
+        if 'timestamp' in fields:
+            # Few rows (the anchors); read_rows() turns the ISO text back into datetimes
+            positions = column_map(kind, self.store.header(sheet_name))
+            positions = [positions.get(field) for field in fields]
+            rows = [(row_idx, *[values[position] if position is not None and position < len(values) else None
+                                for position in positions])
+                    for row_idx, values in self.store.read_rows(sheet_name, min_row, max_row)]
+        else:
+            rows = self.store.read_fields(sheet_name, fields, min_row)
+        filled = len(rows)  # Rows after the last with any of the fields aren't part of the log
+        while filled and all(value is None for value in rows[filled - 1][1:]):
+            filled -= 1
+        last_row = rows[filled - 1][0] if filled else min_row - 1
+        if max_row is not None:
+            last_row = min(last_row, max_row)
+        count = max(last_row - min_row + 1, 0)
+        values = {field: [None] * count for field in fields}
+        for row_idx, *row in rows:
+            if row_idx - min_row < count:
+                for field, value in zip(fields, row):
+                    values[field][row_idx - min_row] = value
+        return min_row, values
+
+
+@contextmanager
+def open_source(path):
+    """
+    Open a workbook or SQLite store for the ledger's reads; closed again on exit.
+    """
+    source = _SqliteSource(path) if is_sqlite_path(path) else _XlsxSource(path)
+    try:
+        yield source
+    finally:
+        source.close()
+
+
+def _anchor(timestamp, item, action, san):
+    """
+    Return what a snapshot remembers of its last log row, in a form that survives
+    JSON and reads the same from an xlsx (serial dates) or a SQLite store.
+    """
+    if isinstance(timestamp, (int, float)) and not isinstance(timestamp, bool):
+        when = from_excel(timestamp)
+    else:
+        when = to_datetime(timestamp)
+    if when is not None:
+        when = (when + timedelta(microseconds=500000)).replace(microsecond=0).isoformat(sep=' ')
+    elif timestamp is not None:
+        when = str(timestamp)
+    return [when, item, action, san or None]
+
+
+def read_anchor(source, log_sheet, row_idx):
+    """
+    Return the anchor of one log row, or None if the log is shorter than that.
+    """
+    _, values = source.read_fields(log_sheet, 'timestamps', ANCHOR_FIELDS, row_idx, row_idx)
+    if not values['timestamp']:
+        return None
+    return _anchor(*(values[field][0] for field in ANCHOR_FIELDS))
+
+
+def _numbers(values):
+    try:
+        return np.array(values, dtype=float)  # None becomes NaN
+    except (TypeError, ValueError):
+        return np.array([np.nan if to_number(value) is None else to_number(value) for value in values], dtype=float)
+
+
+def log_movements(items, actions, sans, ops, qtys):
+    """
+    Return (item, change) of each stock movement in a log's columns, as arrays.
+
+    The same rule as inventory_snapshots.action_delta(), a column at a time: Op
+    times Qty, the Action parsed where those are blank, and rows with a SAN #
+    (or without an item or a recognisable action) left out.
+    """
+    count = len(items)
+    op, qty = _numbers(ops), _numbers(qtys)
+    has_san = np.fromiter((bool(san) for san in sans), bool, count)
+    for index in np.flatnonzero((np.isnan(op) | np.isnan(qty)) & ~has_san):
+        parsed_op, parsed_qty = parse_action(actions[index])
+        op[index], qty[index] = (np.nan, np.nan) if parsed_op is None else (parsed_op, parsed_qty)
+    deltas = op * qty
+    keep = ~has_san & ~np.isnan(deltas) & np.fromiter((item is not None for item in items), bool, count)
+    kept = np.flatnonzero(keep)
+    return [items[index] for index in kept], np.rint(deltas[kept]).astype(np.int64)
+
+
+# Replaying
+
+def clamped_counts(codes, deltas, opening, opening_last):
+    """
+    Replay movements onto opening counts the way update_count() applies them.
+
+    :param codes: Which count each movement applies to (int array, in log order).
+    :param deltas: The movements (int array).
+    :param opening: Each count before the first movement (int array, not negative).
+    :param opening_last: Each LastCount before the first movement.
+    :return: (LastCount, NewCount, subtracts stopped at zero) per count, as arrays.
+    """
+    last, new = opening_last.copy(), opening.copy()
+    clamps = np.zeros(len(opening), dtype=np.int64)
+    if not len(codes):
+        return last, new, clamps
+    order = np.argsort(codes, kind='stable')  # Each count's movements together, still in log order
+    keys, steps = codes[order], deltas[order]
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    lengths = np.diff(np.r_[starts, len(keys)])
+    group = np.repeat(np.arange(len(starts)), lengths)
+
+    # Unclamped, a count is its opening plus the running sum of its movements.
+    # Each time a subtract would take it below zero, everything after is lifted
+    # by the shortfall, so the clamped count is the running sum less its lowest
+    # point so far, wherever that lowest point is below zero.
+    running = np.cumsum(steps)
+    sums = running - np.r_[0, running][starts][group] + opening[keys]
+    # Running minimum per count: shift each count's sums below the previous
+    # count's so that np.minimum.accumulate can't carry a minimum across
+    span = int(sums.max() - sums.min()) + 1
+    offsets = group.astype(np.int64) * span
+    floor = np.minimum(np.minimum.accumulate(sums - offsets) + offsets, 0)
+    counts = sums - floor
+
+    previous_floor = np.r_[0, floor[:-1]]
+    previous_floor[starts] = 0
+    np.add.at(clamps, keys, floor < previous_floor)
+    ends = starts + lengths - 1
+    new[keys[ends]] = counts[ends]
+    last[keys[ends]] = np.where(lengths > 1, counts[ends - 1], opening[keys[ends]])
+    return last, new, clamps
+
+
+def _as_count(value):
+    return max(int(to_number(value) or 0), 0)
+
+
+class LedgerState:
+    """
+    Every site's counts as of a given row of its log.
+
+    sites maps each site to {'row': last log row replayed, 'anchor': that row's
+    contents, 'counts': [[item, LastCount, NewCount], ...]}, the layout snapshots
+    are stored in.
+    """
+
+    def __init__(self, sites, replayed_rows=None, clamped=None, based_on=None):
+        self.sites = sites
+        self.replayed_rows = replayed_rows or {}  # Site -> log rows read since based_on
+        self.clamped = clamped or {}  # Site -> {item: subtracts stopped at zero}
+        self.based_on = based_on  # The snapshot replayed from, or None
+
+    def counts(self, site):
+        """
+        Return {item: (LastCount, NewCount)} for a site.
+        """
+        return {item: (last, new) for item, last, new in self.sites.get(site, {}).get('counts', [])}
+
+
+def replay(opening, tails):
+    """
+    Replay each site's log tail onto its opening counts.
+
+    :param opening: Site -> the snapshot layout of LedgerState.sites.
+    :param tails: Site -> (first row replayed, items, deltas, last row, anchor).
+    :return: A LedgerState.
+    """
+    keys, codes, deltas = [], [], []
+    for site, (_, items, site_deltas, _, _) in tails.items():
+        index = {item: position for position, (item, _, _) in enumerate(opening.get(site, {}).get('counts', []))}
+        site_codes = [index.setdefault(item, len(index)) for item in items]
+        codes.append(np.array(site_codes, dtype=np.int64) + len(keys))
+        deltas.append(site_deltas)
+        keys.extend((site, item) for item in index)
+    opened = {site: {item: (last, new) for item, last, new in snapshot.get('counts', [])}
+              for site, snapshot in opening.items()}
+    opening_new = np.array([_as_count(opened.get(site, {}).get(item, (0, 0))[1]) for site, item in keys],
+                           dtype=np.int64)
+    opening_last = np.array([_as_count(opened.get(site, {}).get(item, (0, 0))[0]) for site, item in keys],
+                            dtype=np.int64)
+    last, new, clamps = clamped_counts(np.concatenate(codes or [np.zeros(0, np.int64)]),
+                                       np.concatenate(deltas or [np.zeros(0, np.int64)]), opening_new, opening_last)
+
+    sites, clamped, replayed_rows = {}, {}, {}
+    for (site, item), last_count, new_count, clamp_count in zip(keys, last.tolist(), new.tolist(), clamps.tolist()):
+        sites.setdefault(site, {'counts': []})['counts'].append([item, last_count, new_count])
+        if clamp_count:
+            clamped.setdefault(site, {})[item] = clamp_count
+    for site, (first_row, _, _, last_row, anchor) in tails.items():
+        sites.setdefault(site, {'counts': []}).update(row=last_row, anchor=anchor)
+        replayed_rows[site] = last_row - first_row + 1
+    return LedgerState(sites, replayed_rows, clamped)
+
+
+def read_tail(source, site, row, anchor):
+    """
+    Read a site's log after the given row, checking that row still holds anchor.
+
+    :return: (first row, items, deltas, last row, anchor of the last row), or None
+             if the log no longer matches.
+    """
+    log_sheet = f"{site}_Timestamps"
+    if row > 1 and read_anchor(source, log_sheet, row) != anchor:
+        return None
+    first_row, values = source.read_fields(log_sheet, 'timestamps', LOG_FIELDS, min_row=row + 1)
+    last_row = first_row + len(values['item']) - 1
+    if last_row <= row:
+        return row + 1, [], np.zeros(0, np.int64), row, anchor
+    items, deltas = log_movements(*(values[field] for field in LOG_FIELDS))
+    return first_row, items, deltas, last_row, read_anchor(source, log_sheet, last_row)
+
+
+def stored_counts(source, site):
+    """
+    Return {item: (LastCount, NewCount)} as stored in a site's *_Items sheet.
+    """
+    _, values = source.read_fields(f"{site}_Items", 'items', COUNT_FIELDS)
+    counts = {}
+    for item, last, new in zip(*(values[field] for field in COUNT_FIELDS)):
+        if item is not None and item not in counts:
+            counts[item] = (to_number(last), to_number(new))
+    return counts
+
+
+def drift(state, stored):
+    """
+    Compare replayed counts with stored ones.
+
+    :param stored: Site -> stored_counts().
+    :return: List of (site, item, stored NewCount, replayed NewCount) that differ.
+             The stored count is None for items logged but missing from the sheet.
+    """
+    differences = []
+    for site in sorted(set(stored) | set(state.sites)):
+        replayed = state.counts(site)
+        for item, (_, stored_new) in stored.get(site, {}).items():
+            replayed_new = replayed.get(item, (0, 0))[1]
+            if (stored_new or 0) != replayed_new:
+                differences.append((site, item, stored_new, replayed_new))
+        for item, (_, replayed_new) in replayed.items():
+            if item not in stored.get(site, {}) and replayed_new:
+                differences.append((site, item, None, replayed_new))
+    return differences
+
+
+class Ledger:
+    """
+    The snapshots taken of a workbook's counts, and replays of its logs from them.
+    """
+
+    def __init__(self, workbook_path):
+        self.workbook_path = Path(workbook_path)
+        self.path = ledger_path_for(workbook_path)
+        self.snapshots = self._load()  # Oldest first
+
+    def _load(self):
+        try:
+            with open(self.path, encoding="utf-8") as ledger_file:
+                ledger = json.load(ledger_file)
+        except FileNotFoundError:
+            return []
+        if ledger.get('version') != LEDGER_VERSION:
+            raise LedgerError(f"{self.path} was written by a different version of the ledger")
+        return ledger['snapshots']
+
+    def save(self):
+        """
+        Write the snapshots atomically.
+        """
+        temp_path = self.path.with_name(self.path.name + ".tmp")
+        with open(temp_path, "w", encoding="utf-8") as ledger_file:
+            json.dump({'version': LEDGER_VERSION, 'snapshots': self.snapshots}, ledger_file)
+        os.replace(temp_path, self.path)
+
+    def replay(self, source=None, full=False):
+        """
+        Replay the logs from the latest snapshot they still match.
+
+        :param source: From open_source(); the workbook is opened if not given.
+        :param full: Replay from the oldest snapshot they still match instead.
+        :return: A LedgerState.
+        """
+        if source is None:
+            with open_source(self.workbook_path) as source:
+                return self.replay(source, full)
+        started = time.perf_counter()
+        sites = log_sites(source.sheetnames)
+        candidates = self.snapshots if full else self.snapshots[::-1]
+        for snapshot in candidates or [None]:
+            opening = snapshot['sites'] if snapshot is not None else {}
+            tails = {}
+            for site in sites:
+                site_opening = opening.get(site, {})
+                tail = read_tail(source, site, site_opening.get('row', 1), site_opening.get('anchor'))
+                if tail is None:
+                    logging.info(f"{site}_Timestamps was edited above the snapshot of {snapshot['taken']}")
+                    break
+                tails[site] = tail
+            else:
+                state = replay({site: opening.get(site, {}) for site in sites}, tails)
+                state.based_on = snapshot
+                origin = f"the snapshot of {snapshot['taken']}" if snapshot is not None else "the start"
+                logging.info(f"Replayed {sum(state.replayed_rows.values())} log rows from {origin} "
+                             f"in {time.perf_counter() - started:.2f}s")
+                return state
+        raise LedgerError(f"The logs of {self.workbook_path.name} were edited above every snapshot. "
+                          f"Check the counts, then adopt them again with: snapshot --adopt")
+
+    def adopt(self, source):
+        """
+        Return a state holding the stored counts as of the current end of each log.
+        """
+        sites = {}
+        for site in log_sites(source.sheetnames):
+            log_sheet = f"{site}_Timestamps"
+            first_row, values = source.read_fields(log_sheet, 'timestamps', ('item',), min_row=2)
+            last_row = first_row + len(values['item']) - 1
+            sites[site] = {
+                'row': max(last_row, 1),
+                'anchor': read_anchor(source, log_sheet, last_row) if last_row > 1 else None,
+                'counts': [[item, _as_count(last), _as_count(new)]
+                           for item, (last, new) in stored_counts(source, site).items()],
+            }
+        return LedgerState(sites)
+
+    def take_snapshot(self, source=None, state=None, adopt=False):
+        """
+        Add a snapshot of the replayed counts (or with adopt, the stored ones).
+        """
+        if source is None:
+            with open_source(self.workbook_path) as source:
+                return self.take_snapshot(source, state, adopt)
+        if state is None:
+            state = self.adopt(source) if adopt else self.replay(source)
+        snapshot = {
+            'taken': datetime.now().replace(microsecond=0).isoformat(sep=' '),
+            'adopted': adopt,
+            'sites': state.sites,
+        }
+        self.snapshots = (self.snapshots + [snapshot])[-KEEP_SNAPSHOTS:]
+        self.save()
+        logging.info(f"Snapshot of the stock counts taken{' (stored counts adopted)' if adopt else ''}")
+        return snapshot
+
+    def snapshot_if_due(self, min_rows):
+        """
+        Snapshot the counts if at least min_rows have been logged since the last
+        snapshot. Without any snapshot, the stored counts are adopted.
+
+        :return: True if a snapshot was taken.
+        """
+        with open_source(self.workbook_path) as source:
+            if not self.snapshots:
+                self.take_snapshot(source, adopt=True)
+                return True
+            state = self.replay(source)
+            if sum(state.replayed_rows.values()) < min_rows:
+                return False
+            self.take_snapshot(source, state)
+            return True
+
+
+def rebuild_entries(state, differences):
+    """
+    Return the "set_count" journal entries that put the replayed counts into
+    the *_Items sheets, for the differences found by drift().
+    """
+    entries = []
+    for site, item, stored_new, _ in differences:
+        if stored_new is None:
+            continue  # Logged, but the sheet has no row to put it in
+        last, new = state.counts(site).get(item, (0, 0))
+        entries.append({"op": "set_count", "sheet": f"{site}_Items", "item": item, "last": last, "new": new})
+    return entries
+
+
+def _format_count(value):
+    return "-" if value is None else str(value)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rebuild the stock counts from the transaction logs.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    verify_parser = subparsers.add_parser("verify", help="Compare the replayed counts with the stored ones")
+    verify_parser.add_argument("workbook", help="The .xlsx workbook or SQLite store (.db)")
+    verify_parser.add_argument("--full", action="store_true", help="Replay from the oldest snapshot still valid")
+    rebuild_parser = subparsers.add_parser("rebuild", help="Overwrite the stored counts with the replayed ones")
+    rebuild_parser.add_argument("workbook", help="The .xlsx workbook or SQLite store (.db)")
+    rebuild_parser.add_argument("--full", action="store_true", help="Replay from the oldest snapshot still valid")
+    rebuild_parser.add_argument("--dry-run", action="store_true", help="Report what would change without writing")
+    rebuild_parser.add_argument("--no-backup", action="store_true", help="Don't keep a copy of the original file")
+    snapshot_parser = subparsers.add_parser("snapshot", help="Snapshot the replayed counts now")
+    snapshot_parser.add_argument("workbook", help="The .xlsx workbook or SQLite store (.db)")
+    snapshot_parser.add_argument("--adopt", action="store_true",
+                                 help="Snapshot the stored counts instead, e.g. after checking them by hand")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    try:
+        ledger = Ledger(args.workbook)
+        if args.command == "snapshot":
+            snapshot = ledger.take_snapshot(adopt=args.adopt)
+            for site, site_snapshot in snapshot['sites'].items():
+                logging.info(f"{site}: {len(site_snapshot['counts'])} counts as of log row {site_snapshot['row']}")
+            return 0
+        with open_source(args.workbook) as source:
+            state = ledger.replay(source, full=args.full)
+            stored = {site: stored_counts(source, site) for site in state.sites}
+    except LedgerError as e:
+        logging.error(str(e))
+        return 1
+
+    if state.based_on is None:
+        logging.warning("No snapshot yet, so the logs were replayed from empty stockrooms; stock from before "
+                        "logging started shows up as drift. Adopt the current counts with: snapshot --adopt")
+    differences = drift(state, stored)
+    for site in state.sites:
+        clamped = sum(state.clamped.get(site, {}).values())
+        site_drift = sum(1 for drifted_site, *_ in differences if drifted_site == site)
+        logging.info(f"{site}: {state.replayed_rows.get(site, 0)} log rows replayed, {site_drift} counts drifted"
+                     + (f", {clamped} subtracts stopped at zero" if clamped else ""))
+    for site, item, stored_new, replayed_new in differences:
+        note = " (not in the items sheet)" if stored_new is None else f" ({replayed_new - (stored_new or 0):+d})"
+        logging.warning(f"  {site} / {item}: stored {_format_count(stored_new)}, logs say {replayed_new}{note}")
+
+    if args.command == "verify":
+        return 1 if differences else 0
+
+    entries = rebuild_entries(state, differences)
+    if not entries:
+        logging.info("The stored counts already match the logs; nothing to do.")
+        return 0
+
+    def migrate(source, apply_change):
+        report = {}
+        for entry in entries:
+            apply_change(entry)
+            report[entry["sheet"]] = report.get(entry["sheet"], 0) + 1
+        return report
+
+    try:
+        report = migrate_file(args.workbook, dry_run=args.dry_run, backup=not args.no_backup,
+                              migrate=migrate, label="ledger_rebuild")
+    except RuntimeError as e:
+        logging.error(str(e))
+        return 1
+    for sheet_name, count in report.items():
+        logging.info(f"{sheet_name}: {count} counts {'to set' if args.dry_run else 'set'} from the logs")
+    if args.dry_run:
+        logging.info(f"{len(entries)} counts would be set (dry run, nothing written)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
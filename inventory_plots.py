@@ -0,0 +1,332 @@
+# In-process inventory plotting engine
+#
+# Replaces running the four inventory-levels_* scripts one after another: the
+# *_Items sheets are parsed once into a single frame, and every per-site chart
+# plus the combined chart is rendered from it with the Agg backend. Used by the
+# "Save and eMail Plots" menu item and runnable on its own:
+#
+#   python inventory_plots.py --output-dir Plots/All_20241119_020602
+#
+# With --jobs N the charts are rendered in a pool of N worker processes, so the
+# whole report takes about as long as the slowest chart. --json prints the status
+# and timing of every chart for the app to read. With --cache-dir, charts whose
+# rows and date haven't changed are taken from the plot cache (see plot_cache.py)
+# instead of being drawn again; --archive does the same with the Plots archive
+# (see plot_archive.py), and the charts are added to its report history as one
+# report named after the output directory (--no-history leaves that to the caller,
+# as the app does). matplotlib is only imported once a chart has to be drawn.
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import json
+import os
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+import pandas as pd
+
+from plot_archive import PlotArchive
+from plot_cache import PlotCache, chart_digest, renderer_id
+from workbook_reader import read_sheets
+
+# Site name -> (items sheet, output file prefix, chart title)
+SITE_CHARTS = {
+    '4.2': ('4.2_Items', 'Basement_4.2_inventory', 'Basement 4.2 - Inventory Levels (Perth)'),
+    'BR': ('BR_Items', 'Build_Room_inventory', 'Build Room - Inventory Levels (Perth)'),
+    'Darwin': ('Darwin_Items', 'Darwin_inventory', 'Darwin - Inventory Levels'),
+}
+COMBINED_CHART = ('Combined_inventory', 'Combined: B4.2, Build Room & Darwin')
+TITLE_DATE_FORMAT = '%d-%m-%Y'  # Date shown in chart titles, part of each chart's cache key
+
+
+def default_workbook_path():
+    """
+    Return the workbook saved in config.py, or the one next to this script.
+    """
+    try:
+        from config import workbook_path
+        return workbook_path
+    except ImportError:
+        return os.path.join(os.path.dirname(os.path.abspath(__file__)), 'EUC_Perth_Assets.xlsx')
+
+
+# Items sheet field -> frame column
+ITEM_COLUMNS = {'item': 'Item', 'last_count': 'LastCount', 'new_count': 'NewCount', 'threshold': 'Threshold'}
+
+
+def read_items_sheets(workbook_path, sheet_names, fields=tuple(ITEM_COLUMNS)):
+    """
+    Stream *_Items sheets from an xlsx workbook or SQLite store (one open of the file).
+
+    Returns a dict of sheet name -> frame with the requested columns.
+    """
+    sheets = read_sheets(workbook_path, sheet_names, fields)
+    return {
+        sheet_name: pd.DataFrame(rows, columns=[ITEM_COLUMNS[field] for field in fields])
+        for sheet_name, rows in sheets.items()
+    }
+
+
+def read_items_sheet(workbook_path, sheet_name):
+    return read_items_sheets(workbook_path, [sheet_name])[sheet_name]
+
+
+def load_items_frame(workbook_path, sites=None):
+    """
+    Read the *_Items sheets of the given sites in a single pass over the workbook.
+
+    Returns one frame with 'Site', 'Item' and 'NewCount' columns, in sheet order.
+    """
+    sites = list(sites or SITE_CHARTS)
+    sheets = read_items_sheets(workbook_path, [SITE_CHARTS[site][0] for site in sites], fields=('item', 'new_count'))
+    frames = []
+    for site in sites:
+        df = sheets[SITE_CHARTS[site][0]]
+        df = df.loc[df['Item'].notna(), ['Item', 'NewCount']].assign(Site=site)
+        frames.append(df)
+    items = pd.concat(frames, ignore_index=True)
+    items['NewCount'] = items['NewCount'].fillna(0)
+    return items[['Site', 'Item', 'NewCount']]
+
+
+def items_frame_from_model(item_model, sites=None):
+    """
+    Build the frame load_items_frame() would read, from the app's in-memory ItemModel.
+    """
+    sites = list(sites or SITE_CHARTS)
+    rows = [(site, row[0], row[2] if len(row) > 2 else None)
+            for site in sites for row in item_model.rows(SITE_CHARTS[site][0])]
+    items = pd.DataFrame(rows, columns=['Site', 'Item', 'NewCount'])
+    items['NewCount'] = items['NewCount'].fillna(0)
+    return items
+
+
+def render_bar_chart(items, counts, title, output_path, current_date=None):
+    """
+    Render a horizontal bar chart of stock levels to output_path.
+    """
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    current_date = current_date or datetime.now().strftime(TITLE_DATE_FORMAT)
+    fig = Figure(figsize=(14 * 0.60, 10 * 0.60))
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    bars = ax.barh(list(items), list(counts), color='#006aff', label='Volume')
+
+    # Add the text with the count at the end of each bar
+    for bar in bars:
+        width = bar.get_width()
+        ax.text(width + 1, bar.get_y() + bar.get_height() / 2, int(width), ha='left', va='center', color='black')
+
+    ax.set_ylabel('Item', fontsize=12)
+    ax.set_xlabel('Volume', fontsize=12)
+    ax.set_xlim(0, (max(counts) if len(counts) else 0) + 20)  # Dynamically adjust x-axis limit
+    ax.set_title(f'{title} - {current_date}', fontsize=14)
+    fig.tight_layout()
+
+    output_path = Path(output_path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    fig.savefig(output_path)
+    return output_path
+
+
+def render_site_chart(items_frame, site, output_path, current_date=None):
+    site_items = items_frame[items_frame['Site'] == site]
+    title = SITE_CHARTS[site][2]
+    return render_bar_chart(site_items['Item'], site_items['NewCount'], title, output_path, current_date)
+
+
+def render_combined_chart(items_frame, output_path, current_date=None):
+    grouped = items_frame.groupby('Item', as_index=False)['NewCount'].sum()
+    return render_bar_chart(grouped['Item'], grouped['NewCount'], COMBINED_CHART[1], output_path, current_date)
+
+
+def plot_jobs(items_frame, output_dir, sites, combined=True):
+    """
+    List the charts to render as (name, rows needed, output path) tuples.
+    """
+    output_dir = Path(output_dir)
+    jobs = [(site, items_frame[items_frame['Site'] == site], output_dir / f"{SITE_CHARTS[site][1]}.png")
+            for site in sites]
+    if combined:
+        jobs.append(('Combined', items_frame, output_dir / f"{COMBINED_CHART[0]}.png"))
+    return jobs
+
+
+def render_job(name, items_frame, output_path, current_date):
+    """
+    Render one chart from plot_jobs(). Returns (saved path, seconds taken).
+    """
+    started = time.perf_counter()
+    if name == 'Combined':
+        saved = render_combined_chart(items_frame, output_path, current_date)
+    else:
+        saved = render_site_chart(items_frame, name, output_path, current_date)
+    return saved, time.perf_counter() - started
+
+
+def job_digest(name, job_frame, current_date):
+    """
+    Return the plot cache key of a chart from plot_jobs().
+    """
+    rows = job_frame[['Site', 'Item', 'NewCount']].itertuples(index=False, name=None)
+    return chart_digest(renderer_id(__file__, name), rows, current_date)
+
+
+def fetch_cached(jobs, current_date, cache):
+    """
+    Take every chart that is already in the cache from it.
+
+    Returns (results, pending): results maps a job's index to its result dict,
+    pending lists (index, job, digest) for the charts that still need drawing.
+    """
+    results, pending = {}, []
+    for index, (name, job_frame, output_path) in enumerate(jobs):
+        digest = job_digest(name, job_frame, current_date) if cache is not None else None
+        if cache is not None and cache.fetch(digest, output_path, name):
+            results[index] = {'name': name, 'path': str(output_path), 'ok': True, 'error': None,
+                              'seconds': 0.0, 'cached': True, 'digest': digest}
+        else:
+            pending.append((index, (name, job_frame, output_path), digest))
+    return results, pending
+
+
+def open_cache(cache_dir=None, archive_dir=None):
+    """
+    Return the PlotArchive or PlotCache to reuse charts from, or None.
+    """
+    if archive_dir:
+        return PlotArchive(archive_dir)
+    return PlotCache(cache_dir) if cache_dir else None
+
+
+def render_all(workbook_path, output_dir, sites=None, combined=True, cache_dir=None, archive_dir=None):
+    """
+    Parse the workbook once and render every requested chart into output_dir.
+
+    Returns a dict of chart name (site, or 'Combined') -> saved file path.
+    """
+    sites = list(sites or SITE_CHARTS)
+    items_frame = load_items_frame(workbook_path, sites)
+    current_date = datetime.now().strftime(TITLE_DATE_FORMAT)
+    jobs = plot_jobs(items_frame, output_dir, sites, combined)
+    cache = open_cache(cache_dir, archive_dir)
+
+    results, pending = fetch_cached(jobs, current_date, cache)
+    saved = {jobs[index][0]: Path(result['path']) for index, result in results.items()}
+    for _, (name, job_frame, output_path), digest in pending:
+        saved[name], _ = render_job(name, job_frame, output_path, current_date)
+        if cache is not None:
+            cache.store(digest, saved[name])
+    return {name: saved[name] for name, _, _ in jobs}
+
+
+def render_all_parallel(workbook_path, output_dir, sites=None, combined=True, max_workers=None, cache_dir=None,
+                        archive_dir=None):
+    """
+    Parse the workbook once, then render each chart in a pool of worker processes.
+
+    Waits for every chart and returns one dict per chart with 'name', 'path',
+    'ok', 'error', 'seconds', 'cached' and 'digest' (the chart's cache key, or
+    None without a cache), in the same order as render_all().
+    No pool is started if every chart comes from the cache.
+    """
+    sites = list(sites or SITE_CHARTS)
+    items_frame = load_items_frame(workbook_path, sites)
+    current_date = datetime.now().strftime(TITLE_DATE_FORMAT)
+    jobs = plot_jobs(items_frame, output_dir, sites, combined)
+    cache = open_cache(cache_dir, archive_dir)
+
+    results, pending = fetch_cached(jobs, current_date, cache)
+    if pending:
+        max_workers = max_workers or min(len(pending), os.cpu_count() or 1)
+        with ProcessPoolExecutor(max_workers=min(max_workers, len(pending))) as pool:
+            # Each worker only gets the rows its chart needs
+            futures = [(index, name, output_path, digest,
+                        pool.submit(render_job, name, job_frame, output_path, current_date))
+                       for index, (name, job_frame, output_path), digest in pending]
+            for index, name, output_path, digest, future in futures:
+                try:
+                    saved, seconds = future.result()
+                    if cache is not None:
+                        cache.store(digest, saved)
+                    results[index] = {'name': name, 'path': str(saved), 'ok': True, 'error': None,
+                                      'seconds': seconds, 'cached': False, 'digest': digest}
+                except Exception as e:
+                    results[index] = {'name': name, 'path': str(output_path), 'ok': False, 'error': str(e),
+                                      'seconds': None, 'cached': False, 'digest': digest}
+    return [results[index] for index in range(len(jobs))]
+
+
+def record_history(archive_dir, results, report):
+    """
+    Add the charts of a run to the Plots archive's report history as one report,
+    so prune() treats them like the app's own reports.
+    """
+    archive = PlotArchive(archive_dir)
+    try:
+        for result in results:
+            if result['ok']:
+                chart = SITE_CHARTS[result['name']][1] if result['name'] in SITE_CHARTS else COMBINED_CHART[0]
+                content_hash = archive.add_file(result['path'], result.get('digest'))
+                archive.record(chart, content_hash, result.get('digest'), report=report,
+                               cached=result.get('cached', False), site=result['name'])
+    finally:
+        archive.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate all inventory level plots from one parse of the workbook.")
+    parser.add_argument("--output-dir", required=True, help="Directory to save the plots in")
+    parser.add_argument("--workbook", default=None, help="Path to the workbook (defaults to config.py)")
+    parser.add_argument("--site", action="append", choices=list(SITE_CHARTS),
+                        help="Only plot this site (repeatable; defaults to all sites)")
+    parser.add_argument("--no-combined", action="store_true", help="Skip the combined chart")
+    parser.add_argument("--jobs", type=int, default=1,
+                        help="Render the charts in this many worker processes (default: 1, in-process)")
+    parser.add_argument("--json", action="store_true", help="Print the status and timing of each chart as JSON")
+    parser.add_argument("--cache-dir", default=None,
+                        help="Reuse unchanged charts from this plot cache directory (e.g. Plots/.cache)")
+    parser.add_argument("--archive", default=None,
+                        help="Reuse unchanged charts from, and add new ones to, this Plots archive (e.g. Plots)")
+    parser.add_argument("--no-history", action="store_true",
+                        help="Don't add the charts to the archive's report history (the caller records them)")
+    args = parser.parse_args(argv)
+
+    workbook_path = args.workbook or default_workbook_path()
+    started = time.perf_counter()
+    try:
+        if args.jobs > 1:
+            results = render_all_parallel(workbook_path, args.output_dir, sites=args.site,
+                                          combined=not args.no_combined, max_workers=args.jobs,
+                                          cache_dir=args.cache_dir, archive_dir=args.archive)
+        else:
+            saved = render_all(workbook_path, args.output_dir, sites=args.site, combined=not args.no_combined,
+                               cache_dir=args.cache_dir, archive_dir=args.archive)
+            results = [{'name': name, 'path': str(path), 'ok': True, 'error': None, 'seconds': None}
+                       for name, path in saved.items()]
+    except FileNotFoundError:
+        print(f"Error: File not found at {workbook_path}. Please ensure the file exists.")
+        return 1
+    except Exception as e:
+        print(f"Error generating charts: {e}")
+        return 1
+    if args.archive and not args.no_history:
+        record_history(args.archive, results, Path(args.output_dir).name)
+
+    if args.json:
+        print(json.dumps({'seconds': time.perf_counter() - started, 'jobs': results}))
+    else:
+        for result in results:
+            if result['ok']:
+                print(f"{result['name']} plot saved at {result['path']}")
+            else:
+                print(f"{result['name']} plot failed: {result['error']}")
+    return 0 if all(result['ok'] for result in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,273 @@
+# Day-by-day stock levels rebuilt from the *_Timestamps logs
+#
+# The logs only record movements ("add 3", "subtract 1"), so answering "how many
+# of item X were at site Y on date D" used to mean re-reading and re-filtering
+# whole sheets. DailySnapshots replays the logs once into a NumPy array with one
+# row per day and one column per (site, item): the stock at the end of that day.
+# Levels are anchored on the current NewCount of each *_Items sheet and worked
+# backwards through the log, so a lookup is a single array index. New log rows
+# extend the array in place with record(), and the array is cached next to the
+# workbook ("<workbook>.snapshots.npz") so the replay only happens when the
+# workbook has changed behind the cache's back.
+#
+#   snapshots = DailySnapshots.from_workbook(workbook)
+#   snapshots.level('BR', 'Laptop Bag', date(2024, 6, 30))
+
+from datetime import date, datetime, timedelta
+import hashlib
+import json
+import logging
+from pathlib import Path
+
+import numpy as np
+
+from workbook_reader import iter_sheet, parse_action, to_datetime
+
+
+def action_delta(action, san_number=None, op=None, qty=None):
+    """
+    Return the change in stock recorded by a log row, or None if it has none.
+
+    Uses the Op and Qty columns, falling back to parsing the Action for rows
+    written before they existed. Rows with a SAN # are skipped: each SAN is
+    logged on its own row and then the total again as "add N", so counting
+    both would count the SANs twice.
+    """
+    if san_number:
+        return None
+    if op is None or qty is None:
+        op, qty = parse_action(action)
+        if op is None:
+            return None
+    return op * qty
+
+
+def snapshot_path_for(workbook_path):
+    """
+    Return the snapshot cache file that belongs to the given workbook.
+    """
+    return Path(f"{workbook_path}.snapshots.npz")
+
+
+def timestamp_sites(workbook):
+    """
+    Return the sites that have both a *_Timestamps and a *_Items sheet.
+    """
+    return [name[:-len('_Timestamps')] for name in workbook.sheetnames
+            if name.endswith('_Timestamps') and f"{name[:-len('_Timestamps')]}_Items" in workbook.sheetnames]
+
+
+def workbook_stamp(workbook):
+    """
+    Fingerprint the parts of an open workbook the snapshots are built from.
+
+    Uses each log's length and last row plus the current counts, so it is cheap
+    to compute on a loaded workbook and changes whenever a rebuild is needed.
+    """
+    digest = hashlib.sha1()
+    for site in timestamp_sites(workbook):
+        log_sheet = workbook[f"{site}_Timestamps"]
+        last_row = next(log_sheet.iter_rows(min_row=log_sheet.max_row, max_row=log_sheet.max_row,
+                                            max_col=4, values_only=True), ())
+        digest.update(repr((site, log_sheet.max_row, last_row)).encode())
+        for row in iter_sheet(workbook, f"{site}_Items", fields=('item', 'new_count')):
+            digest.update(repr((row.item, row.new_count)).encode())
+    return digest.hexdigest()
+
+
+class DailySnapshots:
+    """
+    Stock level of every (site, item) at the end of every day.
+
+    Row 0 holds the opening levels (before the first logged movement) and stands
+    in for every earlier day; days after the last row repeat the last row.
+    """
+
+    def __init__(self, start, keys, levels):
+        self.start = start  # Date of row 0
+        self.keys = list(keys)  # (site, item) for each column
+        self.columns = {key: column for column, key in enumerate(self.keys)}
+        self.levels = levels  # int64 array, shape (days, len(keys))
+        self.dirty = False  # Changed since it was loaded or saved
+
+    @classmethod
+    def build(cls, movements, current_counts, today=None):
+        """
+        Replay movements into daily levels.
+
+        :param movements: Iterable of (site, item, datetime, delta).
+        :param current_counts: Dict of (site, item) -> the count now.
+        :param today: Last day to cover; defaults to today.
+        """
+        keys = list(current_counts)
+        columns = {key: column for column, key in enumerate(keys)}
+        days, cols, deltas = [], [], []
+        for site, item, when, delta in movements:
+            if (site, item) not in columns:
+                columns[(site, item)] = len(keys)
+                keys.append((site, item))
+            days.append(when.toordinal())
+            cols.append(columns[(site, item)])
+            deltas.append(delta)
+
+        today = (today or date.today()).toordinal()
+        days = np.array(days, dtype=np.int64)
+        first = int(days.min()) if len(days) else today
+        last = max(int(days.max()) if len(days) else today, today)
+        start = first - 1  # Row 0: opening levels
+
+        daily = np.zeros((last - start + 1, len(keys)), dtype=np.int64)
+        np.add.at(daily, (days - start, np.array(cols, dtype=np.int64)), np.array(deltas, dtype=np.int64))
+        cumulative = daily.cumsum(axis=0)
+        current = np.array([current_counts.get(key, 0) or 0 for key in keys], dtype=np.int64)
+        # Work back from today's counts: the level on day d is today's minus everything logged after d
+        levels = cumulative + (current - cumulative[-1])
+        return cls(date.fromordinal(start), keys, levels)
+
+    @classmethod
+    def from_workbook(cls, workbook, today=None):
+        """
+        Build the snapshots from a loaded openpyxl workbook.
+        """
+        movements, current_counts = [], {}
+        for site in timestamp_sites(workbook):
+            for row in iter_sheet(workbook, f"{site}_Items", fields=('item', 'new_count')):
+                if row.item is not None:
+                    current_counts[(site, row.item)] = row.new_count or 0
+            for row in iter_sheet(workbook, f"{site}_Timestamps",
+                                  fields=('timestamp', 'item', 'action', 'san', 'op', 'qty')):
+                delta = action_delta(row.action, row.san, row.op, row.qty)
+                if delta is not None and row.timestamp is not None and row.item is not None:
+                    movements.append((site, row.item, row.timestamp, delta))
+        return cls.build(movements, current_counts, today)
+
+    # Lookups
+
+    @property
+    def end(self):
+        return self.start + timedelta(days=len(self.levels) - 1)
+
+    def row_for(self, day):
+        """
+        Return the array row holding the levels at the end of the given day.
+        """
+        if isinstance(day, datetime):
+            day = day.date()
+        return min(max((day - self.start).days, 0), len(self.levels) - 1)
+
+    def level(self, site, item, day):
+        """
+        Return the stock of an item at a site at the end of a day (0 if never stocked).
+        """
+        column = self.columns.get((site, item))
+        return 0 if column is None else int(self.levels[self.row_for(day), column])
+
+    def sites(self):
+        return sorted({site for site, _ in self.keys})
+
+    def items(self, site=None):
+        """
+        Return the item names for one site, or across all sites, sorted.
+        """
+        return sorted({item for key_site, item in self.keys if site is None or key_site == site})
+
+    def _selection(self, site, items):
+        # (columns x items) 0/1 matrix summing each item's columns for the site (or every site)
+        positions = {item: position for position, item in enumerate(items)}
+        selection = np.zeros((len(self.keys), len(items)), dtype=self.levels.dtype)
+        for (key_site, item), column in self.columns.items():
+            if (site is None or key_site == site) and item in positions:
+                selection[column, positions[item]] = 1
+        return selection
+
+    def levels_on(self, day, site=None, items=None):
+        """
+        Return the levels of the given items (default: self.items(site)) at the end
+        of a day as an array; with site=None each item is summed over every site.
+        """
+        items = self.items(site) if items is None else items
+        return self.levels[self.row_for(day)] @ self._selection(site, items)
+
+    def history(self, site=None, items=None):
+        """
+        Return the levels of the given items for every day, shape (days, items).
+        """
+        items = self.items(site) if items is None else items
+        return self.levels @ self._selection(site, items)
+
+    # Updates
+
+    def record(self, site, item, when, delta):
+        """
+        Add a movement that was just logged (and applied to the current counts).
+        """
+        when = to_datetime(when)
+        if when is None or not delta:
+            return
+        self.extend_to(when.date())
+        row = (when.date() - self.start).days
+        if (site, item) not in self.columns:
+            self.columns[(site, item)] = len(self.keys)
+            self.keys.append((site, item))
+            self.levels = np.hstack([self.levels, np.zeros((len(self.levels), 1), dtype=self.levels.dtype)])
+        self.levels[max(row, 0):, self.columns[(site, item)]] += delta
+        self.dirty = True
+
+    def extend_to(self, day):
+        """
+        Extend the array (carrying the last levels forward) so it covers day.
+        """
+        row = (day - self.start).days
+        if row >= len(self.levels):
+            # Nothing moved on the new days: carry the last levels forward
+            extra = np.repeat(self.levels[-1:], row - len(self.levels) + 1, axis=0)
+            self.levels = np.vstack([self.levels, extra])
+            self.dirty = True
+
+    # Cache file
+
+    def save(self, path, stamp):
+        """
+        Write the snapshots to path, tagged with the workbook_stamp() they match.
+        """
+        path = Path(path)
+        temp_path = path.with_name(path.name + ".tmp.npz")
+        np.savez_compressed(temp_path, levels=self.levels, start=np.array(self.start.toordinal()),
+                            keys=np.array(json.dumps(self.keys)), stamp=np.array(stamp))
+        temp_path.replace(path)
+        self.dirty = False
+
+    @classmethod
+    def load(cls, path, stamp):
+        """
+        Return the cached snapshots at path, or None if missing or built from a different workbook state.
+        """
+        try:
+            with np.load(path) as cache:
+                if str(cache['stamp']) != stamp:
+                    return None
+                keys = [tuple(key) for key in json.loads(str(cache['keys']))]
+                return cls(date.fromordinal(int(cache['start'])), keys, cache['levels'])
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logging.warning(f"Ignoring unreadable snapshot cache {path}: {e}")
+            return None
+
+    @classmethod
+    def open(cls, workbook, workbook_path, today=None):
+        """
+        Load the cached snapshots for a workbook, rebuilding (and re-caching) them if stale.
+        """
+        path = snapshot_path_for(workbook_path)
+        stamp = workbook_stamp(workbook)
+        snapshots = cls.load(path, stamp)
+        if snapshots is not None:
+            snapshots.extend_to(today or date.today())
+            return snapshots
+        snapshots = cls.from_workbook(workbook, today)
+        try:
+            snapshots.save(path, stamp)
+        except OSError as e:
+            logging.warning(f"Could not cache inventory snapshots in {path}: {e}")
+        return snapshots
@@ -0,0 +1,122 @@
+# Background thread for the workbook I/O done by euc_stock_wa.v2.py
+#
+# Tk runs every handler on its one thread, so a handler that saves the workbook,
+# fsyncs the journal, runs a plot script or talks to the mail server freezes the
+# window until it returns. Handlers submit that work to IOWorker instead. Jobs
+# run one at a time in the order they were submitted, so writes reach the
+# workbook in the same order the user made them. Results come back to the Tk
+# thread through poll(), which the app calls from root.after.
+
+from collections import deque
+import logging
+import queue
+import threading
+import time
+
+
+class IOJob:
+    """
+    A function queued on the IOWorker, with the callbacks to run when it finishes.
+    """
+
+    def __init__(self, func, args, kwargs, description, on_done, on_error):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.description = description
+        self.on_done = on_done
+        self.on_error = on_error
+        self.result = None
+        self.error = None
+        self.elapsed = None  # Seconds spent running, set once finished
+
+
+class IOWorker(threading.Thread):
+    """
+    Single background thread that runs submitted jobs in FIFO order.
+
+    submit() and poll() must only be called from the Tk thread.
+
+    :param on_error: Called as on_error(job, error) for failed jobs that have no
+                     on_error callback of their own.
+    :param name: Thread name; an app can run several workers for unrelated queues.
+    """
+
+    def __init__(self, on_error=None, name="workbook-io"):
+        super().__init__(name=name, daemon=True)
+        self._jobs = queue.Queue()
+        self._finished = queue.Queue()
+        self._queued = deque()  # Jobs submitted but not yet handed back by poll()
+        self.default_on_error = on_error
+        self.busy_listeners = []  # Called with the current job's description, or None when idle
+        self.finished_listeners = []  # Called with each finished job, before its callbacks
+
+    def submit(self, func, *args, description=None, on_done=None, on_error=None, **kwargs):
+        """
+        Queue func(*args, **kwargs) to run after every job submitted before it.
+
+        on_done(result) or on_error(error) is called on the Tk thread by poll().
+        Jobs without a description don't show up in the busy indicator.
+        """
+        job = IOJob(func, args, kwargs, description, on_done, on_error)
+        self._queued.append(job)
+        self._jobs.put(job)
+        self._notify_busy()
+        return job
+
+    def run(self):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                break
+            started = time.perf_counter()
+            try:
+                job.result = job.func(*job.args, **job.kwargs)
+            except Exception as e:
+                job.error = e
+                logging.error(f"Background job '{job.description or job.func.__name__}' failed: {e}", exc_info=True)
+            job.elapsed = time.perf_counter() - started
+            self._finished.put(job)
+
+    def poll(self):
+        """
+        Run the callbacks of jobs that have finished since the last poll.
+        """
+        while True:
+            try:
+                job = self._finished.get_nowait()
+            except queue.Empty:
+                break
+            self._queued.remove(job)
+            for listener in self.finished_listeners:
+                listener(job)
+            try:
+                if job.error is None:
+                    if job.on_done is not None:
+                        job.on_done(job.result)
+                elif job.on_error is not None:
+                    job.on_error(job.error)
+                elif self.default_on_error is not None:
+                    self.default_on_error(job, job.error)
+            except Exception as e:
+                logging.error(f"Callback for '{job.description or job.func.__name__}' failed: {e}", exc_info=True)
+            self._notify_busy()
+
+    @property
+    def busy(self):
+        return bool(self._queued)
+
+    def _notify_busy(self):
+        # Report the oldest described job; it is the one running or next to run
+        description = next((job.description for job in self._queued if job.description), None)
+        for listener in self.busy_listeners:
+            listener(description)
+
+    def stop(self):
+        """
+        Let the queued jobs finish, stop the thread and run their callbacks.
+        """
+        self._jobs.put(None)
+        if self.is_alive():
+            self.join()
+        self.poll()
@@ -0,0 +1,233 @@
+# Per-site lazy loading of the stock workbook
+#
+# load_workbook() parses all 13 sheets up front, although an operator working
+# the Darwin stockroom all day only ever touches Darwin_Items, Darwin_Timestamps
+# and All_SANs. LazyWorkbook reads the workbook's structure (sheet list, styles,
+# properties, names) straight away but leaves each worksheet as an empty
+# placeholder until it is first looked up with workbook[name]; only then is its
+# XML parsed, from the file on disk, into the placeholder. A site's pair of
+# sheets can be evicted again (emptied back to a placeholder) once it hasn't been
+# used for a while, provided none of its changes are still waiting for a
+# checkpoint: the file on disk then holds exactly what was in memory.
+#
+# Everything else behaves like the openpyxl workbook it wraps. Saving parses
+# whatever is still unloaded first, so a full save never writes a placeholder;
+# partial checkpoints (xlsx_partial.py) copy unloaded sheets across unchanged.
+# sheet_values() reads a sheet's values without keeping it, streaming it from
+# the file if it isn't loaded, for the few places (the SAN index, the items
+# model, the warm-start snapshot) that need to look at every site.
+#
+#   workbook = LazyWorkbook("EUC_Perth_Assets.xlsx", preload=('Darwin_Items', 'Darwin_Timestamps'))
+#   workbook['BR_Items']                  # Parsed now
+#   workbook.evict_idle(['BR_Items', 'BR_Timestamps'], idle_seconds=600)
+
+import logging
+import threading
+import time
+from zipfile import ZipFile
+
+from openpyxl.packaging.relationship import get_rels_path
+from openpyxl.reader.excel import ExcelReader
+from openpyxl.worksheet._reader import WorkSheetParser, WorksheetReader
+from openpyxl.worksheet.worksheet import Worksheet
+
+from xlsx_partial import _file_state, read_sheet_parts
+
+
+class _LazyReader(ExcelReader):
+    """
+    openpyxl's reader, except that worksheets not in preload are left as
+    placeholders (unless they have parts of their own, e.g. tables or comments).
+    """
+
+    def __init__(self, path, preload):
+        super().__init__(path)
+        self.preload = set(preload)
+        self.deferred = set()  # Names of the placeholder sheets
+        self.sheet_parts = {}  # Sheet name -> zip member holding it
+
+    def read_worksheets(self):
+        sheets = list(self.parser.find_sheets())
+        self.sheet_parts = {sheet.name: rel.target for sheet, rel in sheets}
+        deferred = [(position, sheet) for position, (sheet, rel) in enumerate(sheets)
+                    if sheet.name not in self.preload
+                    and rel.target in self.valid_files
+                    and "chartsheet" not in rel.Type
+                    and get_rels_path(rel.target) not in self.valid_files]
+        self.deferred = {sheet.name for _, sheet in deferred}
+        # Let openpyxl read the rest, then slot the placeholders in where they belong
+        self.parser.find_sheets = lambda: [(sheet, rel) for sheet, rel in sheets if sheet.name not in self.deferred]
+        super().read_worksheets()
+        for position, sheet in deferred:
+            placeholder = Worksheet(self.wb, sheet.name)
+            placeholder.sheet_state = sheet.state
+            self.wb._sheets.insert(position, placeholder)
+
+
+class LazyWorkbook:
+    """
+    An openpyxl workbook whose worksheets are parsed the first time they're used.
+    """
+
+    def __init__(self, path, preload=()):
+        self.path = path
+        self.lock = threading.RLock()
+        reader = _LazyReader(path, preload)
+        reader.read()
+        self.workbook = reader.wb
+        self._unloaded = set(reader.deferred)
+        self._last_used = {}  # Sheet name -> time.monotonic() it was last looked up
+        # What the file looked like when the sheet parts and shared strings were read
+        self._file_state = _file_state(path)
+        self._sheet_parts = reader.sheet_parts
+        self._shared_strings = reader.shared_strings
+
+    def __getitem__(self, sheet_name):
+        if sheet_name in self._unloaded:
+            with self.lock:
+                if sheet_name in self._unloaded:  # Unless another thread just loaded it
+                    self._load(sheet_name)
+        self._last_used[sheet_name] = time.monotonic()
+        return self.workbook[sheet_name]
+
+    def __contains__(self, sheet_name):
+        return sheet_name in self.workbook.sheetnames
+
+    def __iter__(self):
+        return iter(self.worksheets)
+
+    def __getattr__(self, name):
+        return getattr(self.workbook, name)
+
+    @property
+    def worksheets(self):
+        self.load_all()
+        return self.workbook.worksheets
+
+    def is_loaded(self, sheet_name):
+        return sheet_name not in self._unloaded
+
+    @property
+    def loaded_sheets(self):
+        return [name for name in self.workbook.sheetnames if name not in self._unloaded]
+
+    def load(self, sheet_names):
+        """
+        Parse the given sheets now, e.g. on the I/O worker ahead of their first use.
+        """
+        for sheet_name in sheet_names:
+            if sheet_name in self.workbook.sheetnames:
+                self[sheet_name]
+
+    def load_all(self):
+        self.load(list(self._unloaded))
+
+    def save(self, filename):
+        self.load_all()  # A placeholder would be saved as an empty sheet
+        self.workbook.save(filename)
+
+    def _open(self):
+        """
+        Open the xlsx and return (archive, sheet parts, shared strings). Where the
+        sheets are and the shared strings are read again if the file has been
+        rewritten since they were last read.
+        """
+        with self.lock:
+            state = _file_state(self.path)
+            if state == self._file_state:
+                return ZipFile(self.path), self._sheet_parts, self._shared_strings
+            reader = ExcelReader(self.path)
+            reader.read_manifest()
+            reader.read_strings()
+            self._sheet_parts = read_sheet_parts(reader.archive)
+            self._shared_strings = reader.shared_strings
+            self._file_state = state
+            return reader.archive, self._sheet_parts, self._shared_strings
+
+    def _load(self, sheet_name):
+        started = time.perf_counter()
+        sheet = self.workbook[sheet_name]
+        archive, sheet_parts, shared_strings = self._open()
+        with archive, archive.open(sheet_parts[sheet_name]) as source:
+            WorksheetReader(sheet, source, shared_strings, False, False).bind_all()
+        self._unloaded.discard(sheet_name)
+        logging.info(f"Loaded {sheet_name} ({sheet.max_row} rows) in {time.perf_counter() - started:.2f}s")
+
+    def evict(self, sheet_name):
+        """
+        Empty a loaded sheet back to a placeholder. Only call it while none of the
+        sheet's changes are waiting for a checkpoint.
+        """
+        with self.lock:
+            if sheet_name in self._unloaded or sheet_name not in self.workbook.sheetnames:
+                return False
+            sheet = self.workbook[sheet_name]
+            if sheet.tables or sheet._images or sheet._charts or sheet._comments:
+                return False  # Those aren't read back into a placeholder
+            # Workbook-level definitions that the sheet XML doesn't hold
+            kept = (sheet.sheet_state, sheet.defined_names, sheet._print_rows, sheet._print_cols, sheet._print_area)
+            sheet._setup()
+            (sheet.sheet_state, sheet.defined_names, sheet._print_rows, sheet._print_cols,
+             sheet._print_area) = kept
+            self._unloaded.add(sheet_name)
+            self._last_used.pop(sheet_name, None)
+            return True
+
+    def evict_idle(self, sheet_names, idle_seconds, keep=(), dirty=()):
+        """
+        Evict those of sheet_names that haven't been looked up for idle_seconds.
+
+        :param keep: Sheets to leave loaded however long they've been idle.
+        :param dirty: Sheets with changes not yet checkpointed, which stay loaded.
+        :return: The names of the sheets evicted.
+        """
+        now = time.monotonic()
+        with self.lock:
+            idle = [name for name in sheet_names
+                    if name not in keep and name not in dirty and name not in self._unloaded
+                    and now - self._last_used.get(name, now) >= idle_seconds]
+            return [name for name in idle if self.evict(name)]
+
+    def stream_values(self, sheet_name, min_row=1, max_row=None, max_col=None):
+        """
+        Return a sheet's values as row tuples, like iter_rows(values_only=True)
+        on the loaded sheet, but parsed from the file without loading it. With
+        max_row, parsing stops there and rows are only as wide as those read.
+        """
+        archive, sheet_parts, shared_strings = self._open()
+        cells = {}  # Row -> [(column, value)] of the cells in the sheet XML
+        with archive, archive.open(sheet_parts[sheet_name]) as source:
+            parser = WorkSheetParser(source, shared_strings, epoch=self.workbook.epoch,
+                                     date_formats=self.workbook._date_formats,
+                                     timedelta_formats=self.workbook._timedelta_formats)
+            for row_idx, row in parser.parse():
+                if max_row is not None and row_idx > max_row:
+                    break
+                if row:
+                    cells[row_idx] = [(cell['column'], cell['value']) for cell in row]
+        # The sheet's extent, as openpyxl works out max_row and max_column once it's loaded
+        max_row = max_row or max(cells, default=1)
+        max_col = max_col or max((column for row in cells.values() for column, _ in row), default=1)
+        rows = []
+        for row_idx in range(min_row, max_row + 1):
+            values = [None] * max_col
+            for column, value in cells.get(row_idx, ()):
+                if column <= max_col:
+                    values[column - 1] = value
+            rows.append(tuple(values))
+        return rows
+
+
+def sheet_values(workbook, sheet_name, min_row=1, max_row=None, max_col=None):
+    """
+    Return the values of a sheet's rows as tuples, from an openpyxl workbook or
+    a LazyWorkbook, without making the LazyWorkbook load the sheet or count it
+    as used.
+    """
+    if isinstance(workbook, LazyWorkbook):
+        if not workbook.is_loaded(sheet_name):
+            return workbook.stream_values(sheet_name, min_row, max_row, max_col)
+        sheet = workbook.workbook[sheet_name]
+    else:
+        sheet = workbook[sheet_name]
+    return list(sheet.iter_rows(min_row=min_row, max_row=max_row, max_col=max_col, values_only=True))
@@ -0,0 +1,109 @@
+# One-time fill of the Op and Qty columns of the *_Timestamps logs
+#
+# The app used to record movements only as Action text ("add 5", "subtract 1"),
+# so every report had to parse the text row by row. Log rows now also carry Op
+# (+1 add, -1 subtract) and Qty (units moved) as numbers. This script names the
+# two columns and fills them in for the rows written before they existed,
+# parsing each Action once. Rows whose Action doesn't parse are left blank and
+# reported. Works on .xlsx workbooks and SQLite stores (.db); close the app first.
+#
+#   python migrate_log_columns.py EUC_Perth_Assets.xlsx --dry-run
+#   python migrate_log_columns.py EUC_Perth_Assets.xlsx
+
+import argparse
+import logging
+import sys
+
+from migrate_timestamps import migrate_file, sheet_rows
+from sqlite_store import SqliteStore, column_map
+from workbook_reader import LOG_HEADER, parse_action
+
+
+def log_columns(header):
+    """
+    Return the 0-based (Action, Op, Qty) columns of a log sheet, or None if the
+    Op/Qty places are taken by other headers.
+    """
+    columns = column_map('timestamps', header)
+    positions = []
+    for field, name in (('op', 'Op'), ('qty', 'Qty')):
+        position = columns.get(field, LOG_HEADER.index(name))
+        if position < len(header) and header[position] not in (None, name):
+            return None
+        positions.append(position)
+    return columns.get('action', LOG_HEADER.index('Action')), positions[0], positions[1]
+
+
+def migrate(source, apply_change):
+    """
+    Fill Op/Qty for every log row that lacks them in an open workbook or store.
+
+    :param apply_change: Called with one "set_cells" entry per sheet that changes.
+    :return: Dict of sheet name -> (rows filled in, list of unparsed cells).
+    """
+    sheet_names = source.sheetnames() if isinstance(source, SqliteStore) else source.sheetnames
+    report = {}
+    for sheet_name in sheet_names:
+        if not sheet_name.endswith('_Timestamps'):
+            continue
+        header, rows = sheet_rows(source, sheet_name)
+        header = list(header)
+        positions = log_columns(header)
+        if positions is None:
+            logging.warning(f"{sheet_name}: the Op/Qty columns are used for something else; skipped")
+            continue
+        action_col, op_col, qty_col = positions
+
+        cells = [[1, position + 1, name] for position, name in ((op_col, 'Op'), (qty_col, 'Qty'))
+                 if position >= len(header) or header[position] is None]
+        filled, unparsed = 0, []
+        for row_idx, values in rows:
+            def value_at(position):
+                return values[position] if position < len(values) else None
+
+            action = value_at(action_col)
+            if action is None or (value_at(op_col) is not None and value_at(qty_col) is not None):
+                continue
+            op, qty = parse_action(action)
+            if op is None:
+                unparsed.append((row_idx, action_col + 1, action))
+                continue
+            cells += [[row_idx, op_col + 1, op], [row_idx, qty_col + 1, qty]]
+            filled += 1
+        if cells:
+            apply_change({"op": "set_cells", "sheet": sheet_name, "cells": cells})
+        if filled or unparsed:
+            report[sheet_name] = (filled, unparsed)
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fill in the Op and Qty columns of the stock workbook's logs.")
+    parser.add_argument("workbook", help="The .xlsx workbook or SQLite store (.db) to migrate")
+    parser.add_argument("--dry-run", action="store_true", help="Report what would change without writing")
+    parser.add_argument("--no-backup", action="store_true", help="Don't keep a copy of the original file")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    try:
+        report = migrate_file(args.workbook, dry_run=args.dry_run, backup=not args.no_backup,
+                              migrate=migrate, label="log_columns")
+    except RuntimeError as e:
+        logging.error(str(e))
+        return 1
+
+    total = 0
+    for sheet_name, (filled, unparsed) in report.items():
+        total += filled
+        logging.info(f"{sheet_name}: {filled} rows {'to fill in' if args.dry_run else 'filled in'}")
+        for row_idx, column, value in unparsed:
+            logging.warning(f"  {sheet_name} row {row_idx}, column {column}: unrecognised action {value!r}")
+    if not total:
+        logging.info("Every log row already has Op and Qty; nothing to do.")
+    elif args.dry_run:
+        logging.info(f"{total} rows would be filled in (dry run, nothing written)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,161 @@
+# One-time conversion of text timestamps to datetime cells
+#
+# Older versions of the app wrote every timestamp (the *_Timestamps logs, the
+# Time column of All_SANs, SAN_Returns) as "YYYY-MM-DD HH:MM:SS" text, which had
+# to be parsed again on every log refresh and column sort. The app now writes
+# real datetime cells. This script converts the existing text cells in place so
+# the whole workbook is consistent; cells that don't parse are left alone and
+# reported. Works on .xlsx workbooks and SQLite stores (.db). Close the app
+# first: the workbook is rewritten.
+#
+#   python migrate_timestamps.py EUC_Perth_Assets.xlsx --dry-run
+#   python migrate_timestamps.py EUC_Perth_Assets.xlsx
+
+import argparse
+from datetime import datetime
+import logging
+import os
+from pathlib import Path
+import shutil
+import sys
+
+from openpyxl import load_workbook
+
+from sqlite_store import SqliteStore, column_map, is_sqlite_path, sheet_kind
+from stock_journal import apply_entry, journal_path_for
+from workbook_reader import to_datetime
+
+# Fields holding timestamps, by the names used in sqlite_store.SHEET_KINDS
+TIMESTAMP_FIELDS = ('timestamp', 'time')
+
+
+def timestamp_columns(sheet_name, header):
+    """
+    Return the 0-based columns of a sheet that hold timestamps.
+    """
+    kind, _ = sheet_kind(sheet_name)
+    columns = column_map(kind, header)
+    return sorted(columns[field] for field in TIMESTAMP_FIELDS if field in columns)
+
+
+def find_text_timestamps(rows, columns):
+    """
+    Scan (row number, values) pairs for text timestamps.
+
+    Returns (cells, unparsed): cells is a list of [row, column, datetime] ready for
+    a "set_cells" journal entry (1-based column), unparsed the text that didn't parse.
+    """
+    cells, unparsed = [], []
+    for row_idx, values in rows:
+        for position in columns:
+            value = values[position] if position < len(values) else None
+            if not isinstance(value, str) or not value.strip():
+                continue
+            parsed = to_datetime(value)
+            if parsed is None:
+                unparsed.append((row_idx, position + 1, value))
+            else:
+                cells.append([row_idx, position + 1, parsed])
+    return cells, unparsed
+
+
+def sheet_rows(source, sheet_name):
+    """
+    Return (header, iterable of (row number, values)) for a sheet of a workbook or store.
+    """
+    if isinstance(source, SqliteStore):
+        return source.header(sheet_name), source.read_rows(sheet_name)
+    sheet = source[sheet_name]
+    header = next(sheet.iter_rows(min_row=1, max_row=1, values_only=True), ())
+    return header, enumerate(sheet.iter_rows(min_row=2, values_only=True), start=2)
+
+
+def migrate(source, apply_change):
+    """
+    Convert the text timestamps of every sheet in an open workbook or store.
+
+    :param apply_change: Called with one "set_cells" entry per sheet that has cells to convert.
+    :return: Dict of sheet name -> (cells converted, list of unparsed cells).
+    """
+    sheet_names = source.sheetnames() if isinstance(source, SqliteStore) else source.sheetnames
+    report = {}
+    for sheet_name in sheet_names:
+        header, rows = sheet_rows(source, sheet_name)
+        columns = timestamp_columns(sheet_name, header)
+        if not columns:
+            continue
+        cells, unparsed = find_text_timestamps(rows, columns)
+        if cells:
+            apply_change({"op": "set_cells", "sheet": sheet_name, "cells": cells})
+        if cells or unparsed:
+            report[sheet_name] = (len(cells), unparsed)
+    return report
+
+
+def backup_path_for(path, label="timestamps"):
+    path = Path(path)
+    return path.with_name(f"{path.stem}_before_{label}_{datetime.now().strftime('%Y%m%d_%H%M%S')}{path.suffix}")
+
+
+def migrate_file(path, dry_run=False, backup=True, migrate=migrate, label="timestamps"):
+    """
+    Migrate the workbook or SQLite store at path. Returns the per-sheet report.
+
+    :param migrate: Called as migrate(source, apply_change) like migrate() above;
+                    other one-off conversions reuse the backup and save logic here.
+    :param label: Names the backup copy ("<name>_before_<label>_<time>").
+    """
+    path = Path(path)
+    if is_sqlite_path(path):
+        if backup and not dry_run:
+            shutil.copy2(path, backup_path_for(path, label))
+        store = SqliteStore(str(path))
+        try:
+            return migrate(store, (lambda entry: None) if dry_run else store.apply)
+        finally:
+            store.close()
+
+    journal_path = journal_path_for(path)
+    if journal_path.exists() and journal_path.stat().st_size:
+        raise RuntimeError(f"{journal_path} holds changes not yet saved into the workbook. "
+                           "Open and close the app once so they are checkpointed, then run this again.")
+    workbook = load_workbook(path)
+    report = migrate(workbook, lambda entry: apply_entry(workbook, entry))
+    if not dry_run and report:
+        if backup:
+            shutil.copy2(path, backup_path_for(path, label))
+        temp_path = path.with_name(path.name + ".tmp")
+        workbook.save(temp_path)
+        os.replace(temp_path, path)
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert text timestamps in the stock workbook to datetime cells.")
+    parser.add_argument("workbook", help="The .xlsx workbook or SQLite store (.db) to migrate")
+    parser.add_argument("--dry-run", action="store_true", help="Report what would change without writing")
+    parser.add_argument("--no-backup", action="store_true", help="Don't keep a copy of the original file")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    try:
+        report = migrate_file(args.workbook, dry_run=args.dry_run, backup=not args.no_backup)
+    except RuntimeError as e:
+        logging.error(str(e))
+        return 1
+
+    total = 0
+    for sheet_name, (converted, unparsed) in report.items():
+        total += converted
+        logging.info(f"{sheet_name}: {converted} timestamps {'to convert' if args.dry_run else 'converted'}")
+        for row_idx, column, value in unparsed:
+            logging.warning(f"  {sheet_name} row {row_idx}, column {column}: left as text: {value!r}")
+    if not total:
+        logging.info("No text timestamps found; nothing to do.")
+    elif args.dry_run:
+        logging.info(f"{total} timestamps would be converted (dry run, nothing written)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
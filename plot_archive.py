@@ -0,0 +1,421 @@
+# Content-addressed archive and catalog of the inventory charts
+#
+# Every chart used to be written to Plots/ under a new timestamped name (and the
+# emailed reports to a new All_<timestamp> folder), so the folder grew forever
+# with mostly identical PNGs. Charts are now stored once per distinct image:
+#
+#   Plots/objects/ab/ab12...ef.png   one file per SHA-256 of the PNG bytes
+#   Plots/catalog.db                 SQLite index of what was generated when
+#
+# The catalog's `reports` table has a row per generated chart (time, site, chart,
+# the report it was part of, the digest of the data it was drawn from and the
+# image it points to), so the Report History window is a query instead of a walk
+# over the filesystem. `digests` maps a chart's data digest (plot_cache.chart_digest)
+# to its image, which makes the archive a drop-in plot cache: fetch()/store()
+# work like PlotCache's. prune() applies the retention policy and deletes images
+# no longer referenced; compact() folds the old timestamped files and folders
+# into the archive (and drops Plots/.cache, which it replaces).
+#
+#   python plot_archive.py compact Plots --dry-run
+#   python plot_archive.py prune Plots --keep-days 90 --keep-last 20 --max-mb 200
+#   python plot_archive.py list Plots --site BR
+
+import argparse
+from datetime import datetime, timedelta
+import hashlib
+import logging
+import os
+from pathlib import Path
+import re
+import shutil
+import sqlite3
+import sys
+import threading
+import uuid
+
+from plot_cache import CACHE_DIR_NAME, _link_or_copy
+
+CATALOG_NAME = "catalog.db"
+OBJECTS_DIR_NAME = "objects"
+INCOMING_DIR_NAME = ".incoming"  # Charts being rendered, before they are archived
+# Images no generation has ever referenced (e.g. stored by a render whose report
+# isn't recorded yet) are only pruned once they are this old
+ORPHAN_GRACE_DAYS = 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    content_hash TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    added TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS digests (
+    data_digest TEXT PRIMARY KEY,
+    content_hash TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS reports (
+    id INTEGER PRIMARY KEY,
+    generated_at TEXT NOT NULL,
+    site TEXT,
+    chart TEXT NOT NULL,
+    report TEXT,
+    data_digest TEXT,
+    content_hash TEXT NOT NULL,
+    cached INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS reports_generated ON reports(generated_at);
+CREATE INDEX IF NOT EXISTS reports_site ON reports(site, generated_at);
+CREATE INDEX IF NOT EXISTS reports_blob ON reports(content_hash);
+"""
+
+# Old file names: "<chart>_17.11.24-12.56.23.png", "<chart>_20241119_233300.png",
+# "<dd-mm-yyyy>/<chart>_12.17.10.png", "All_20241119_020602/<chart>.png"
+LEGACY_STAMPS = (
+    (re.compile(r"^(?P<chart>.+)_(?P<stamp>\d{2}\.\d{2}\.\d{2}-\d{2}\.\d{2}\.\d{2})$"), "%d.%m.%y-%H.%M.%S"),
+    (re.compile(r"^(?P<chart>.+)_(?P<stamp>\d{8}_\d{6})$"), "%Y%m%d_%H%M%S"),
+)
+DAY_FOLDER = re.compile(r"^\d{2}-\d{2}-\d{4}$")
+DAY_FOLDER_FILE = re.compile(r"^(?P<chart>.+)_(?P<stamp>\d{2}\.\d{2}\.\d{2})$")
+REPORT_FOLDER = re.compile(r"^All_(?P<stamp>\d{8}_\d{6})$")
+
+
+def site_for_chart(chart):
+    """
+    Return the site a chart belongs to ('4.2', 'BR', 'Darwin' or 'Combined'), or None.
+    """
+    name = chart.lower()
+    if name.startswith('4.2') or name.startswith('basement'):
+        return '4.2'
+    if name.startswith('br_') or name.startswith('build_room'):
+        return 'BR'
+    if name.startswith('darwin'):
+        return 'Darwin'
+    if name.startswith('combined'):
+        return 'Combined'
+    return None
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 16), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def legacy_entry(path, plots_dir):
+    """
+    Work out (chart, generated_at, report) for an old-style file under plots_dir.
+    Falls back to the file's modification time when the name has no timestamp.
+    """
+    path = Path(path)
+    folder = path.parent.name if path.parent != Path(plots_dir) else None
+    stem = path.stem
+
+    if folder and REPORT_FOLDER.match(folder):
+        stamp = REPORT_FOLDER.match(folder).group('stamp')
+        return stem, datetime.strptime(stamp, "%Y%m%d_%H%M%S"), folder
+    if folder and DAY_FOLDER.match(folder):
+        match = DAY_FOLDER_FILE.match(stem)
+        if match:
+            generated_at = datetime.strptime(f"{folder} {match.group('stamp')}", "%d-%m-%Y %H.%M.%S")
+            return match.group('chart'), generated_at, None
+    for pattern, time_format in LEGACY_STAMPS:
+        match = pattern.match(stem)
+        if match:
+            return match.group('chart'), datetime.strptime(match.group('stamp'), time_format), None
+    return stem, datetime.fromtimestamp(path.stat().st_mtime).replace(microsecond=0), None
+
+
+class PlotArchive:
+    """
+    Charts stored once by content hash, with a SQLite catalog of every generation.
+
+    Safe to share between the Tk thread and the I/O worker.
+    """
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.objects_dir = self.root / OBJECTS_DIR_NAME
+        self.incoming_dir = self.root / INCOMING_DIR_NAME
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(self.root / CATALOG_NAME, check_same_thread=False, timeout=30)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def blob_path(self, content_hash):
+        return self.objects_dir / content_hash[:2] / f"{content_hash}.png"
+
+    def incoming_path(self, name):
+        """
+        Return a fresh path to render a chart to before archiving it.
+        """
+        self.incoming_dir.mkdir(parents=True, exist_ok=True)
+        return self.incoming_dir / f"{name}_{uuid.uuid4().hex[:8]}.png"
+
+    # Storing charts
+
+    def add_file(self, path, data_digest=None, move=False):
+        """
+        Store the PNG at path, once per distinct content. Returns its content hash.
+
+        :param data_digest: The chart_digest() it was drawn from, for later find()/fetch().
+        :param move: Remove path afterwards (it is moved into the archive if new).
+        """
+        path = Path(path)
+        content_hash = file_hash(path)
+        target = self.blob_path(content_hash)
+        with self.lock:
+            if not target.exists():
+                target.parent.mkdir(parents=True, exist_ok=True)
+                if move:
+                    os.replace(path, target)
+                else:
+                    _link_or_copy(path, target)
+            elif move:
+                path.unlink()
+            with self.conn:
+                self.conn.execute("INSERT OR IGNORE INTO blobs (content_hash, size, added) VALUES (?, ?, ?)",
+                                  (content_hash, target.stat().st_size, datetime.now().isoformat(timespec='seconds')))
+                if data_digest:
+                    self.conn.execute("INSERT OR REPLACE INTO digests (data_digest, content_hash) VALUES (?, ?)",
+                                      (data_digest, content_hash))
+        return content_hash
+
+    def find(self, data_digest):
+        """
+        Return the content hash of the chart drawn from data_digest, or None.
+        """
+        with self.lock:
+            row = self.conn.execute("SELECT content_hash FROM digests WHERE data_digest = ?",
+                                    (data_digest,)).fetchone()
+        if row is None or not self.blob_path(row['content_hash']).exists():
+            return None
+        return row['content_hash']
+
+    def record(self, chart, content_hash, data_digest=None, report=None, generated_at=None, cached=False, site=None):
+        """
+        Add a row to the report history for a chart that was just generated.
+        """
+        generated_at = generated_at or datetime.now().replace(microsecond=0)
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO reports (generated_at, site, chart, report, data_digest, content_hash, cached) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (generated_at.isoformat(sep=' ', timespec='seconds'), site or site_for_chart(chart), chart,
+                 report, data_digest, content_hash, int(cached)))
+
+    # Plot cache protocol (see plot_cache.PlotCache)
+
+    def fetch(self, digest, output_path, name=None):
+        """
+        Place the archived chart for digest at output_path. Returns False on a miss.
+        """
+        content_hash = self.find(digest)
+        if content_hash is None:
+            logging.info(f"Plot archive miss for {name or output_path} ({digest[:12]})")
+            return False
+        _link_or_copy(self.blob_path(content_hash), output_path)
+        logging.info(f"Plot archive hit for {name or output_path} ({digest[:12]}), reused {content_hash[:12]}")
+        return True
+
+    def store(self, digest, rendered_path):
+        """
+        Add a freshly rendered chart to the archive, leaving rendered_path in place.
+        """
+        return self.blob_path(self.add_file(rendered_path, digest))
+
+    # History
+
+    def history(self, site=None, report=None, since=None, limit=500):
+        """
+        Return the most recent generations as dicts, newest first, with the
+        archived file under 'path'.
+        """
+        clauses, params = [], []
+        if site:
+            clauses.append("site = ?")
+            params.append(site)
+        if report:
+            clauses.append("report = ?")
+            params.append(report)
+        if since:
+            clauses.append("generated_at >= ?")
+            params.append(since.isoformat(sep=' ', timespec='seconds'))
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT r.*, b.size FROM reports r LEFT JOIN blobs b USING (content_hash) {where} "
+                f"ORDER BY generated_at DESC, id DESC LIMIT ?", (*params, limit)).fetchall()
+        return [dict(row, path=self.blob_path(row['content_hash'])) for row in rows]
+
+    def sites(self):
+        with self.lock:
+            return [row[0] for row in self.conn.execute(
+                "SELECT DISTINCT site FROM reports WHERE site IS NOT NULL ORDER BY site")]
+
+    def stats(self):
+        """
+        Return (generations recorded, distinct images stored, bytes stored).
+        """
+        with self.lock:
+            (reports,) = self.conn.execute("SELECT COUNT(*) FROM reports").fetchone()
+            blobs, size = self.conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs").fetchone()
+        return reports, blobs, size
+
+    # Retention
+
+    def prune(self, keep_days=None, keep_last=0, max_bytes=None, now=None, grace_days=ORPHAN_GRACE_DAYS):
+        """
+        Apply the retention policy and delete images no generation refers to.
+
+        :param keep_days: Forget generations older than this many days...
+        :param keep_last: ...except the newest keep_last of each chart, which are always kept.
+        :param max_bytes: Then forget the oldest remaining generations until the
+                          stored images fit, still keeping the newest of each chart.
+        :param grace_days: Images that were never in the report history are kept
+                           until they were added this many days ago.
+        :return: (generations forgotten, images deleted, bytes freed).
+        """
+        now = now or datetime.now()
+        with self.lock:
+            with self.conn:
+                # Rank each chart's generations, newest first
+                ranked = self.conn.execute(
+                    "SELECT id, generated_at, content_hash, ROW_NUMBER() OVER "
+                    "(PARTITION BY chart ORDER BY generated_at DESC, id DESC) AS position FROM reports "
+                    "ORDER BY generated_at, id").fetchall()
+                forget = set()
+                if keep_days is not None:
+                    cutoff = (now - timedelta(days=keep_days)).isoformat(sep=' ', timespec='seconds')
+                    forget = {row['id'] for row in ranked if row['generated_at'] < cutoff and row['position'] > keep_last}
+                if max_bytes is not None:
+                    sizes = dict(self.conn.execute("SELECT content_hash, size FROM blobs").fetchall())
+                    references = {}
+                    for row in ranked:
+                        if row['id'] not in forget:
+                            references[row['content_hash']] = references.get(row['content_hash'], 0) + 1
+                    total = sum(sizes.get(content_hash, 0) for content_hash in references)
+                    for row in ranked:  # Oldest first
+                        if total <= max_bytes:
+                            break
+                        if row['id'] in forget or row['position'] == 1:
+                            continue
+                        forget.add(row['id'])
+                        references[row['content_hash']] -= 1
+                        if not references[row['content_hash']]:
+                            total -= sizes.get(row['content_hash'], 0)
+                self.conn.executemany("DELETE FROM reports WHERE id = ?", [(row_id,) for row_id in forget])
+
+                forgotten = {row['content_hash'] for row in ranked if row['id'] in forget}
+                added_cutoff = (now - timedelta(days=grace_days)).isoformat(timespec='seconds')
+                orphans = [row for row in self.conn.execute(
+                    "SELECT content_hash, size, added FROM blobs WHERE content_hash NOT IN "
+                    "(SELECT content_hash FROM reports)").fetchall()
+                    if row['content_hash'] in forgotten or row['added'] < added_cutoff]
+                self.conn.executemany("DELETE FROM digests WHERE content_hash = ?",
+                                      [(row['content_hash'],) for row in orphans])
+                self.conn.executemany("DELETE FROM blobs WHERE content_hash = ?",
+                                      [(row['content_hash'],) for row in orphans])
+            for row in orphans:
+                path = self.blob_path(row['content_hash'])
+                if path.exists():
+                    path.unlink()
+        freed = sum(row['size'] for row in orphans)
+        if forget or orphans:
+            logging.info(f"Plot archive pruned: {len(forget)} generations forgotten, "
+                         f"{len(orphans)} images deleted, {freed / 1024:.0f} KB freed")
+        return len(forget), len(orphans), freed
+
+    # Compaction of the old layout
+
+    def legacy_files(self):
+        """
+        Return the charts under root saved in the old timestamped layout.
+        """
+        skip = {self.objects_dir, self.incoming_dir, self.root / CACHE_DIR_NAME}
+        files = []
+        for path in sorted(self.root.rglob("*.png")):
+            if not any(parent in skip for parent in path.parents):
+                files.append(path)
+        return files
+
+    def compact(self, dry_run=False):
+        """
+        Move the old timestamped charts and All_* folders into the archive,
+        recording each as a generation, and remove the emptied folders.
+
+        :return: (files imported, distinct images among them).
+        """
+        files = self.legacy_files()
+        seen = set()
+        for path in files:
+            chart, generated_at, report = legacy_entry(path, self.root)
+            if dry_run:
+                seen.add(file_hash(path))
+                continue
+            content_hash = self.add_file(path, move=True)
+            seen.add(content_hash)
+            self.record(chart, content_hash, report=report, generated_at=generated_at)
+
+        cache_dir = self.root / CACHE_DIR_NAME
+        if cache_dir.is_dir() and not dry_run:
+            # The old plot cache only holds copies of charts; the archive takes its place
+            shutil.rmtree(cache_dir)
+
+        if not dry_run:
+            for folder in sorted({path.parent for path in files}, reverse=True):
+                if folder != self.root and folder.is_dir() and not any(folder.iterdir()):
+                    folder.rmdir()
+        return len(files), len(seen)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage the content-addressed archive of inventory plots.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    compact_parser = commands.add_parser("compact", help="Fold old timestamped plots and folders into the archive")
+    compact_parser.add_argument("plots_dir", help="The Plots directory")
+    compact_parser.add_argument("--dry-run", action="store_true", help="Report what would be archived")
+
+    prune_parser = commands.add_parser("prune", help="Apply a retention policy")
+    prune_parser.add_argument("plots_dir", help="The Plots directory")
+    prune_parser.add_argument("--keep-days", type=int, default=None, help="Forget generations older than this")
+    prune_parser.add_argument("--keep-last", type=int, default=0,
+                              help="Always keep this many of the newest generations of each chart")
+    prune_parser.add_argument("--max-mb", type=float, default=None, help="Keep the stored images under this size")
+
+    list_parser = commands.add_parser("list", help="Show the report history")
+    list_parser.add_argument("plots_dir", help="The Plots directory")
+    list_parser.add_argument("--site", default=None, help="Only show this site")
+    list_parser.add_argument("--limit", type=int, default=50)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    archive = PlotArchive(args.plots_dir)
+    try:
+        if args.command == "compact":
+            imported, distinct = archive.compact(dry_run=args.dry_run)
+            verb = "would be" if args.dry_run else "were"
+            logging.info(f"{imported} plots {verb} archived as {distinct} distinct images")
+        elif args.command == "prune":
+            max_bytes = int(args.max_mb * 1024 * 1024) if args.max_mb is not None else None
+            archive.prune(keep_days=args.keep_days, keep_last=args.keep_last, max_bytes=max_bytes)
+        else:
+            for entry in archive.history(site=args.site, limit=args.limit):
+                print(f"{entry['generated_at']}  {entry['site'] or '-':8}  {entry['chart']:28}  "
+                      f"{entry['report'] or '':20}  {entry['path']}")
+        reports, blobs, size = archive.stats()
+        logging.info(f"Archive: {reports} generations, {blobs} images, {size / 1024 / 1024:.1f} MB")
+    finally:
+        archive.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
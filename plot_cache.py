@@ -0,0 +1,104 @@
+# Content-addressed cache of rendered inventory charts
+#
+# A chart is a pure function of the rows it plots, the date in its title and the
+# code that draws it, yet every menu click used to launch matplotlib again and
+# leave another identical PNG in Plots/. Each chart is now keyed by a SHA-256
+# digest of exactly those inputs. If Plots/.cache already holds a PNG for the
+# digest, it is hard-linked (or copied, where links aren't possible) to the
+# requested output path instead of being rendered; new renders are added to the
+# cache the same way.
+#
+#   cache = PlotCache(Path("Plots") / ".cache")
+#   digest = chart_digest(renderer_id("inventory_plots.py", "BR"), rows, "19-11-2024")
+#   if not cache.fetch(digest, output_path, "BR"):
+#       render(...)
+#       cache.store(digest, output_path)
+
+import hashlib
+import logging
+import os
+from pathlib import Path
+import shutil
+
+from workbook_reader import to_number
+
+CACHE_DIR_NAME = ".cache"
+
+
+def renderer_id(script_path, chart=None):
+    """
+    Identify the code drawing a chart: script name, chart name and a hash of the
+    script's source, so editing the script invalidates its cached charts.
+    """
+    script_path = Path(script_path)
+    source_hash = hashlib.sha256(script_path.read_bytes()).hexdigest()[:16]
+    return f"{script_path.name}:{chart or ''}:{source_hash}"
+
+
+def chart_digest(renderer, rows, title_date):
+    """
+    Return the cache key of a chart.
+
+    :param renderer: From renderer_id().
+    :param rows: The (site, item, count) rows plotted, in sheet order.
+    :param title_date: The date shown in the chart title.
+    """
+    digest = hashlib.sha256()
+    digest.update(f"{renderer}\n{title_date}\n".encode())
+    for site, item, count in rows:
+        # Counts are normalised so 5, 5.0 and a blank vs 0 hash the same
+        digest.update(f"{site}\t{item}\t{to_number(count) or 0}\n".encode())
+    return digest.hexdigest()
+
+
+def model_rows(item_model, sheet_names):
+    """
+    Build the (sheet, item, count) rows of a chart from the app's ItemModel.
+    """
+    return [(sheet_name, row[0], row[2] if len(row) > 2 else None)
+            for sheet_name in sheet_names for row in item_model.rows(sheet_name)]
+
+
+def _link_or_copy(source, target):
+    target = Path(target)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    if target.exists():
+        target.unlink()
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copy2(source, target)  # Different drive, or no hard links on this filesystem
+
+
+class PlotCache:
+    """
+    Directory of rendered charts named by their digest.
+    """
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+
+    def path_for(self, digest):
+        return self.directory / f"{digest}.png"
+
+    def fetch(self, digest, output_path, name=None):
+        """
+        Place the cached chart for digest at output_path. Returns False on a miss.
+        """
+        cached = self.path_for(digest)
+        if not cached.exists():
+            logging.info(f"Plot cache miss for {name or output_path} ({digest[:12]})")
+            return False
+        _link_or_copy(cached, output_path)
+        logging.info(f"Plot cache hit for {name or output_path} ({digest[:12]}), reused {cached.name}")
+        return True
+
+    def store(self, digest, rendered_path):
+        """
+        Add a freshly rendered chart to the cache.
+        """
+        cached = self.path_for(digest)
+        if not cached.exists():
+            self.directory.mkdir(parents=True, exist_ok=True)
+            _link_or_copy(rendered_path, cached)
+        return cached
@@ -0,0 +1,147 @@
+# In-memory index of the All_SANs sheet
+#
+# Maps each SAN to its row, item, timestamp and location so uniqueness checks and
+# removals don't have to scan the sheet. Row numbers stay correct after
+# delete_rows() without renumbering every entry: rows are stored relative to the
+# last compaction, and a sorted list of deleted rows gives the shift for any row
+# with a bisect. Once enough deletions pile up the index is renumbered in one pass.
+
+from bisect import bisect_left, insort
+from collections import namedtuple
+from datetime import datetime
+import logging
+
+from lazy_workbook import sheet_values
+from workbook_reader import to_datetime
+
+SanRecord = namedtuple('SanRecord', ['row', 'item', 'timestamp', 'location'])
+
+# Renumber stored rows once this many deletions are pending
+COMPACT_AFTER = 1024
+
+
+def normalize_san(san_number):
+    """
+    Return the SAN with its 'SAN' prefix, as stored in the All_SANs sheet.
+    """
+    san_number = str(san_number)
+    return san_number if san_number.startswith("SAN") else "SAN" + san_number
+
+
+class SanIndex:
+    """
+    SAN -> (row, item, timestamp, location) for the All_SANs sheet.
+    """
+
+    def __init__(self):
+        self._records = {}  # SAN -> [stored_row, item, timestamp, location]
+        self._deleted = []  # Sorted stored rows removed since the last compaction
+        self.max_row = 1  # Last row of the sheet once every add/remove has been applied
+
+    @classmethod
+    def from_sheet(cls, sheet):
+        """
+        Build the index with a single pass over an All_SANs worksheet.
+        """
+        return cls.from_rows(sheet.iter_rows(min_row=2, max_col=4, values_only=True), sheet.max_row)
+
+    @classmethod
+    def from_workbook(cls, workbook):
+        """
+        Build the index from a workbook's All_SANs sheet. A LazyWorkbook that
+        hasn't loaded the sheet yet streams it from the file instead.
+        """
+        rows = sheet_values(workbook, 'All_SANs', min_row=2, max_col=4)
+        return cls.from_rows(rows, len(rows) + 1)  # The rows run to the sheet's last row
+
+    @classmethod
+    def from_rows(cls, rows, max_row):
+        """
+        Build the index from the values of All_SANs rows 2 onwards (e.g. from a
+        warm-start snapshot); max_row is the sheet's last row.
+        """
+        index = cls()
+        for row_idx, row in enumerate(rows, start=2):
+            san_number = row[0]
+            if san_number is None:
+                continue
+            if san_number in index._records:
+                logging.warning(f"Duplicate SAN {san_number} in All_SANs at row {row_idx}; keeping the first")
+                continue
+            row = tuple(row) + (None,) * (4 - len(row))
+            index._records[san_number] = [row_idx, row[1], row[2], row[3]]
+        index.max_row = max_row
+        return index
+
+    def __contains__(self, san_number):
+        return san_number in self._records
+
+    def __len__(self):
+        return len(self._records)
+
+    def __iter__(self):
+        return iter(self._records)
+
+    def _actual_row(self, stored_row):
+        return stored_row - bisect_left(self._deleted, stored_row)
+
+    def get(self, san_number):
+        """
+        Return the SanRecord for a SAN, or None if it isn't in the sheet.
+        """
+        record = self._records.get(san_number)
+        if record is None:
+            return None
+        return SanRecord(self._actual_row(record[0]), record[1], record[2], record[3])
+
+    def add(self, san_number, item, timestamp, location, row=None):
+        """
+        Register a SAN appended to the sheet at the given (actual) row. Without a
+        row, the SAN is placed after the last row, so the index can run ahead of
+        appends that are still queued for the sheet.
+        """
+        row = self.max_row + 1 if row is None else row
+        self.max_row = max(self.max_row, row)
+        # Every pending deletion sits above a freshly appended row
+        self._records[san_number] = [row + len(self._deleted), item, timestamp, location]
+
+    def remove(self, san_number):
+        """
+        Forget a SAN whose row was deleted from the sheet; later rows shift up by one.
+        """
+        record = self._records.pop(san_number)
+        insort(self._deleted, record[0])
+        self.max_row -= 1
+        if len(self._deleted) >= COMPACT_AFTER:
+            self._compact()
+        return record
+
+    def set_location(self, san_number, location):
+        self._records[san_number][3] = location
+
+    def _compact(self):
+        for record in self._records.values():
+            record[0] = self._actual_row(record[0])
+        self._deleted = []
+
+
+def latest_san_locations(workbook, sheet_locations):
+    """
+    Build SAN -> location from the timestamp sheets in one pass over each sheet.
+
+    :param workbook: The openpyxl workbook (sheets a LazyWorkbook hasn't loaded are streamed).
+    :param sheet_locations: Mapping of timestamp sheet name to short location.
+    :return: Dict of SAN to the location of its most recent movement.
+    """
+    latest = {}  # SAN -> (timestamp, location)
+    for sheet_name, location in sheet_locations.items():
+        if sheet_name not in workbook.sheetnames:
+            continue
+        for row in sheet_values(workbook, sheet_name, min_row=2, max_col=4):
+            if len(row) < 4 or not row[3]:
+                continue
+            timestamp = to_datetime(row[0]) or datetime.min  # Text or datetime cells
+            seen = latest.get(row[3])
+            if seen is None or timestamp >= seen[0]:
+                latest[row[3]] = (timestamp, location)
+    return {san_number: location for san_number, (_, location) in latest.items()}
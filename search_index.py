@@ -0,0 +1,52 @@
+# Incremental substring search for the "SANs In Stock" window
+#
+# Each row's searchable text (SAN number and item name) is broken into trigrams
+# and indexed once. A query looks up the rows holding all of its trigrams and
+# only checks those. While the user keeps typing, each new query contains the
+# previous one, so it just filters the previous result instead of starting over.
+
+NGRAM = 3
+
+
+def ngrams(text):
+    return {text[i:i + NGRAM] for i in range(len(text) - NGRAM + 1)}
+
+
+class SearchIndex:
+    """
+    Trigram index over a fixed list of rows.
+
+    :param rows: Rows to search, returned in this order.
+    :param fields: Positions within each row that are searched.
+    """
+
+    def __init__(self, rows, fields=(0,)):
+        self.rows = list(rows)
+        self._text = []
+        self._postings = {}  # trigram -> set of row ids
+        for row_id, row in enumerate(self.rows):
+            text = " ".join(str(row[field]) for field in fields if row[field] is not None).lower()
+            self._text.append(text)
+            for gram in ngrams(text):
+                self._postings.setdefault(gram, set()).add(row_id)
+        self._last_query = ""
+        self._last_ids = range(len(self.rows))
+
+    def search(self, query):
+        """
+        Return the rows whose text contains query (case-insensitive).
+        """
+        query = query.strip().lower()
+        if not query:
+            ids = range(len(self.rows))
+        else:
+            if self._last_query and self._last_query in query:
+                candidates = self._last_ids  # Narrowing: only re-check the previous hits
+            elif len(query) >= NGRAM:
+                postings = sorted((self._postings.get(gram, set()) for gram in ngrams(query)), key=len)
+                candidates = sorted(set.intersection(*postings)) if postings[0] else []
+            else:
+                candidates = range(len(self.rows))
+            ids = [row_id for row_id in candidates if query in self._text[row_id]]
+        self._last_query, self._last_ids = query, ids
+        return [self.rows[row_id] for row_id in ids]
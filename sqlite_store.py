@@ -0,0 +1,512 @@
+# Optional SQLite storage engine for the EUC stock workbook
+#
+# Holds the same data as EUC_Perth_Assets.xlsx in typed, indexed tables:
+#
+#   items        one row per item per site (*_Items sheets)
+#   timestamps   the transaction logs (*_Timestamps sheets)
+#   all_sans     All_SANs
+#   san_returns  SAN_Returns
+#   headsets     Headsets
+#   sheet_rows   any other sheet, one JSON row per sheet row
+#
+# Every table keeps the sheet name and row number of each row, and the `sheets`
+# table keeps the sheet order, header row and which column holds which field,
+# so an import followed by an export gives back the same sheets and values.
+# Cells outside the known columns are kept in each row's `extra` JSON.
+#
+# When the app is pointed at a .db file, SqliteJournal takes the place of the
+# xlsx journal: each change is a single committed insert/update instead of a
+# checkpoint that rewrites the workbook.
+#
+#   python sqlite_store.py import EUC_Perth_Assets.xlsx EUC_Perth_Assets.db
+#   python sqlite_store.py export EUC_Perth_Assets.db EUC_Perth_Assets.xlsx
+
+import argparse
+import json
+import sqlite3
+import sys
+import threading
+from datetime import date, datetime, time
+
+from openpyxl import Workbook, load_workbook
+
+from stock_journal import apply_entry, check_entry
+
+SQLITE_SUFFIXES = ('.db', '.sqlite', '.sqlite3')
+
+# Table -> fields, each with the header names it may appear under in the sheet
+SHEET_KINDS = {
+    'items': [
+        ('item', ['Item']),
+        ('last_count', ['LastCount']),
+        ('new_count', ['NewCount']),
+        ('threshold', ['Threshold']),
+    ],
+    'timestamps': [
+        ('timestamp', ['Timestamp']),
+        ('item', ['Item']),
+        ('action', ['Action']),
+        ('san', ['SAN #', 'SAN Number', 'SAN']),
+        ('op', ['Op']),
+        ('qty', ['Qty']),
+    ],
+    'all_sans': [
+        ('san', ['SAN Number', 'SAN']),
+        ('item', ['Item']),
+        ('time', ['Time']),
+        ('location', ['Location']),
+    ],
+    'san_returns': [
+        ('san', ['SAN']),
+        ('gen', ['Gen', 'Gen:']),
+        ('returned_by', ['Returned By']),
+        ('returned_to', ['Returned To']),
+        ('notes', ['Notes']),
+        ('timestamp', ['Timestamp']),
+    ],
+    'headsets': [
+        ('serial', ['Serial #']),
+        ('servicenow', ['ServiceNow #']),
+        ('notes', ['Notes']),
+    ],
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sheets (
+    name TEXT PRIMARY KEY,
+    position INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    site TEXT,
+    header TEXT NOT NULL,
+    columns TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS items (
+    id INTEGER PRIMARY KEY, sheet TEXT NOT NULL, site TEXT, row INTEGER NOT NULL,
+    item TEXT, last_count, new_count, threshold, extra TEXT
+);
+CREATE INDEX IF NOT EXISTS items_sheet_row ON items (sheet, row);
+CREATE INDEX IF NOT EXISTS items_site_item ON items (site, item);
+CREATE TABLE IF NOT EXISTS timestamps (
+    id INTEGER PRIMARY KEY, sheet TEXT NOT NULL, site TEXT, row INTEGER NOT NULL,
+    timestamp, item TEXT, action TEXT, san TEXT, op INTEGER, qty INTEGER, extra TEXT
+);
+CREATE INDEX IF NOT EXISTS timestamps_sheet_row ON timestamps (sheet, row);
+CREATE INDEX IF NOT EXISTS timestamps_site_timestamp ON timestamps (site, timestamp);
+CREATE INDEX IF NOT EXISTS timestamps_item ON timestamps (item);
+CREATE INDEX IF NOT EXISTS timestamps_san ON timestamps (san);
+CREATE TABLE IF NOT EXISTS all_sans (
+    id INTEGER PRIMARY KEY, sheet TEXT NOT NULL, row INTEGER NOT NULL,
+    san TEXT, item TEXT, time, location TEXT, extra TEXT
+);
+CREATE INDEX IF NOT EXISTS all_sans_sheet_row ON all_sans (sheet, row);
+CREATE INDEX IF NOT EXISTS all_sans_san ON all_sans (san);
+CREATE INDEX IF NOT EXISTS all_sans_item ON all_sans (item);
+CREATE TABLE IF NOT EXISTS san_returns (
+    id INTEGER PRIMARY KEY, sheet TEXT NOT NULL, row INTEGER NOT NULL,
+    san TEXT, gen TEXT, returned_by TEXT, returned_to TEXT, notes TEXT, timestamp, extra TEXT
+);
+CREATE INDEX IF NOT EXISTS san_returns_sheet_row ON san_returns (sheet, row);
+CREATE INDEX IF NOT EXISTS san_returns_san ON san_returns (san);
+CREATE INDEX IF NOT EXISTS san_returns_timestamp ON san_returns (timestamp);
+CREATE TABLE IF NOT EXISTS headsets (
+    id INTEGER PRIMARY KEY, sheet TEXT NOT NULL, row INTEGER NOT NULL,
+    serial TEXT, servicenow TEXT, notes TEXT, extra TEXT
+);
+CREATE INDEX IF NOT EXISTS headsets_sheet_row ON headsets (sheet, row);
+CREATE TABLE IF NOT EXISTS sheet_rows (
+    id INTEGER PRIMARY KEY, sheet TEXT NOT NULL, row INTEGER NOT NULL, extra TEXT
+);
+CREATE INDEX IF NOT EXISTS sheet_rows_sheet_row ON sheet_rows (sheet, row);
+"""
+
+# Python types SQLite can't hold natively, stored as ISO text and tagged in `extra`
+_ENCODED_TYPES = {'datetime': datetime, 'date': date, 'time': time, 'bool': bool}
+
+
+def is_sqlite_path(path):
+    return str(path).lower().endswith(SQLITE_SUFFIXES)
+
+
+def sheet_kind(sheet_name):
+    """
+    Return (table, site) for a sheet name; unknown sheets go to 'sheet_rows'.
+    """
+    if sheet_name == 'All_SANs':
+        return 'all_sans', None
+    if sheet_name == 'SAN_Returns':
+        return 'san_returns', None
+    if sheet_name == 'Headsets':
+        return 'headsets', None
+    if sheet_name.endswith('_Items'):
+        return 'items', sheet_name[:-len('_Items')]
+    if sheet_name.endswith('_Timestamps'):
+        return 'timestamps', sheet_name[:-len('_Timestamps')]
+    return 'sheet_rows', None
+
+
+def column_map(kind, header):
+    """
+    Map each field of a table to its 0-based column in the sheet, by header name.
+    Fields whose header is missing fall back to their usual position if free.
+    """
+    fields = SHEET_KINDS.get(kind, [])
+    names = [str(value).strip() if value is not None else None for value in header]
+    columns = {}
+    for field, aliases in fields:
+        for alias in aliases:
+            if alias in names and names.index(alias) not in columns.values():
+                columns[field] = names.index(alias)
+                break
+    for position, (field, _) in enumerate(fields):
+        if field not in columns and position not in columns.values() and position < max(len(header), 1):
+            columns[field] = position
+    return columns
+
+
+def _encode(value):
+    for name, value_type in _ENCODED_TYPES.items():
+        if type(value) is value_type:
+            return (value.isoformat(sep=' ') if name == 'datetime' else
+                    int(value) if name == 'bool' else value.isoformat()), name
+    return value, None
+
+
+def _decode(value, type_name):
+    if type_name == 'datetime':
+        return datetime.fromisoformat(value)
+    if type_name == 'date':
+        return date.fromisoformat(value)
+    if type_name == 'time':
+        return time.fromisoformat(value)
+    if type_name == 'bool':
+        return bool(value)
+    return value
+
+
+class SqliteStore:
+    """
+    SQLite database holding the workbook's sheets.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        self._add_missing_columns()
+        self._sheets = {}
+        self._load_sheets()
+        self._data_version = None
+
+    def _add_missing_columns(self):
+        # Databases created before a field was added to SHEET_KINDS lack its column
+        for kind, fields in SHEET_KINDS.items():
+            existing = {column for _, column, *_ in self.conn.execute(f"PRAGMA table_info({kind})")}
+            for field, _ in fields:
+                if field not in existing:
+                    self.conn.execute(f"ALTER TABLE {kind} ADD COLUMN {field}")
+        self.conn.commit()
+
+    def _load_sheets(self):
+        self._sheets = {}
+        for name, position, kind, site, header, columns in self.conn.execute(
+                "SELECT name, position, kind, site, header, columns FROM sheets ORDER BY position"):
+            self._sheets[name] = {
+                'position': position, 'kind': kind, 'site': site,
+                'header': json.loads(header), 'columns': json.loads(columns),
+            }
+
+    def sheetnames(self):
+        return list(self._sheets)
+
+    def header(self, sheet_name):
+        return list(self._sheets[sheet_name]['header'])
+
+    def close(self):
+        self.conn.close()
+
+    # Rows
+
+    def _row_params(self, sheet_name, values):
+        """
+        Split a sheet row into (typed field values, extra JSON).
+        """
+        meta = self._sheets[sheet_name]
+        columns = meta['columns']
+        by_position = {position: field for field, position in columns.items()}
+        fields = {field: None for field in columns}
+        extra_cells, types = {}, {}
+        for position, value in enumerate(values):
+            value, type_name = _encode(value)
+            if type_name:
+                types[str(position)] = type_name
+            if position in by_position:
+                fields[by_position[position]] = value
+            elif value is not None:
+                extra_cells[str(position)] = value
+        extra = {}
+        if extra_cells:
+            extra['cells'] = extra_cells
+        if types:
+            extra['types'] = types
+        return fields, json.dumps(extra) if extra else None
+
+    def _insert_row(self, sheet_name, row_idx, values):
+        meta = self._sheets[sheet_name]
+        fields, extra = self._row_params(sheet_name, values)
+        names = ['sheet', 'row'] + list(fields) + ['extra']
+        params = [sheet_name, row_idx] + list(fields.values()) + [extra]
+        if meta['kind'] in ('items', 'timestamps'):
+            names.insert(1, 'site')
+            params.insert(1, meta['site'])
+        self.conn.execute(
+            f"INSERT INTO {meta['kind']} ({', '.join(names)}) VALUES ({', '.join('?' * len(names))})", params)
+
+    def read_rows(self, sheet_name, min_row=1, max_row=None):
+        """
+        Yield (row number, list of cell values) for a sheet, in row order.
+        """
+        meta = self._sheets[sheet_name]
+        fields = list(meta['columns'])
+        select = ', '.join(['row'] + fields + ['extra'])
+        cursor = self.conn.execute(
+            f"SELECT {select} FROM {meta['kind']} WHERE sheet = ? AND row BETWEEN ? AND ? ORDER BY row",
+            (sheet_name, min_row, max_row if max_row is not None else 2 ** 62))
+        for record in cursor:
+            row_idx, field_values, extra = record[0], record[1:-1], json.loads(record[-1] or '{}')
+            cells = {meta['columns'][field]: value for field, value in zip(fields, field_values)}
+            cells.update({int(position): value for position, value in extra.get('cells', {}).items()})
+            for position, type_name in extra.get('types', {}).items():
+                if cells.get(int(position)) is not None:
+                    cells[int(position)] = _decode(cells[int(position)], type_name)
+            width = max([len(meta['header'])] + [position + 1 for position, value in cells.items() if value is not None])
+            yield row_idx, [cells.get(position) for position in range(width)]
+
+    def read_fields(self, sheet_name, fields, min_row=1):
+        """
+        Return (row number, *values) tuples of some of a sheet's fields, in row
+        order, straight from their columns: much faster than read_rows() for long
+        sheets, but dates come back as ISO text.
+        """
+        meta = self._sheets[sheet_name]
+        select = ', '.join(['row'] + [field if field in meta['columns'] else 'NULL' for field in fields])
+        return self.conn.execute(f"SELECT {select} FROM {meta['kind']} WHERE sheet = ? AND row >= ? ORDER BY row",
+                                 (sheet_name, min_row)).fetchall()
+
+    def _row_ids(self, sheet_name, row_idx):
+        kind = self._sheets[sheet_name]['kind']
+        return [row_id for (row_id,) in self.conn.execute(
+            f"SELECT id FROM {kind} WHERE sheet = ? AND row = ?", (sheet_name, row_idx))]
+
+    def _max_row(self, sheet_name):
+        kind = self._sheets[sheet_name]['kind']
+        (max_row,) = self.conn.execute(f"SELECT MAX(row) FROM {kind} WHERE sheet = ?", (sheet_name,)).fetchone()
+        return max_row or 1
+
+    def _set_cell(self, sheet_name, row_idx, column, value):
+        meta = self._sheets[sheet_name]
+        position = column - 1
+        if row_idx == 1:
+            header = meta['header'] + [None] * max(0, column - len(meta['header']))
+            header[position] = value
+            self._save_sheet_meta(sheet_name, header)
+            return
+        row_ids = self._row_ids(sheet_name, row_idx)
+        if not row_ids:
+            values = [None] * column
+            values[position] = value
+            self._insert_row(sheet_name, row_idx, values)
+            return
+        by_position = {pos: field for field, pos in meta['columns'].items()}
+        (extra,) = self.conn.execute(f"SELECT extra FROM {meta['kind']} WHERE id = ?", (row_ids[0],)).fetchone()
+        extra = json.loads(extra or '{}')
+        stored, type_name = _encode(value)
+        types = extra.setdefault('types', {})
+        types.pop(str(position), None)
+        if type_name:
+            types[str(position)] = type_name
+        if position in by_position:
+            self.conn.execute(f"UPDATE {meta['kind']} SET {by_position[position]} = ? WHERE id = ?",
+                              (stored, row_ids[0]))
+        else:
+            extra.setdefault('cells', {})[str(position)] = stored
+        extra = {key: value for key, value in extra.items() if value}
+        self.conn.execute(f"UPDATE {meta['kind']} SET extra = ? WHERE id = ?",
+                          (json.dumps(extra) if extra else None, row_ids[0]))
+
+    def _delete_row(self, sheet_name, row_idx):
+        kind = self._sheets[sheet_name]['kind']
+        self.conn.execute(f"DELETE FROM {kind} WHERE sheet = ? AND row = ?", (sheet_name, row_idx))
+        self.conn.execute(f"UPDATE {kind} SET row = row - 1 WHERE sheet = ? AND row > ?", (sheet_name, row_idx))
+
+    # Sheets
+
+    def _save_sheet_meta(self, sheet_name, header, position=None):
+        kind, site = sheet_kind(sheet_name)
+        if position is None:
+            position = self._sheets[sheet_name]['position'] if sheet_name in self._sheets else len(self._sheets)
+        columns = self._sheets[sheet_name]['columns'] if sheet_name in self._sheets else column_map(kind, header)
+        # A newly named column can claim a field that had no header before
+        for field, position_in_header in column_map(kind, header).items():
+            if field not in columns and position_in_header not in columns.values():
+                columns[field] = position_in_header
+        header = [_encode(value)[0] for value in header]
+        self.conn.execute(
+            "INSERT OR REPLACE INTO sheets (name, position, kind, site, header, columns) VALUES (?, ?, ?, ?, ?, ?)",
+            (sheet_name, position, kind, site, json.dumps(header), json.dumps(columns)))
+        self._sheets[sheet_name] = {'position': position, 'kind': kind, 'site': site,
+                                    'header': header, 'columns': columns}
+
+    # Journal operations
+
+    def apply(self, entry):
+        """
+        Apply a journal entry (see stock_journal.apply_entry) as one transaction.
+        """
+        with self.conn:
+            self._apply_op(entry)
+
+    def _apply_op(self, entry):
+        op = entry["op"]
+        if op == "batch":
+            for batch_entry in entry["entries"]:
+                self._apply_op(batch_entry)
+        elif op == "append":
+            self._insert_row(entry["sheet"], self._max_row(entry["sheet"]) + 1, entry["row"])
+        elif op == "create_sheet":
+            if entry["sheet"] not in self._sheets:
+                self._save_sheet_meta(entry["sheet"], entry["header"])
+        elif op == "set_cell":
+            self._set_cell(entry["sheet"], entry["row"], entry["column"], entry["value"])
+        elif op == "set_cells":
+            for row_idx, column, value in entry["cells"]:
+                self._set_cell(entry["sheet"], row_idx, column, value)
+        elif op == "set_count":
+            self.conn.execute("UPDATE items SET last_count = ?, new_count = ? WHERE sheet = ? AND item = ?",
+                              (entry["last"], entry["new"], entry["sheet"], entry["item"]))
+        elif op == "delete_san":
+            row_idx = entry.get("row")
+            found = self.conn.execute("SELECT 1 FROM all_sans WHERE sheet = 'All_SANs' AND row = ? AND san = ?",
+                                      (row_idx, entry["san"])).fetchone() if row_idx else None
+            if not found:
+                (row_idx,) = self.conn.execute("SELECT MIN(row) FROM all_sans WHERE sheet = 'All_SANs' AND san = ?",
+                                               (entry["san"],)).fetchone()
+            if row_idx:
+                self._delete_row('All_SANs', row_idx)
+        else:
+            raise ValueError(f"Unknown journal operation: {op}")
+
+    # Import / export
+
+    def import_workbook(self, workbook):
+        """
+        Replace the database contents with every sheet of an openpyxl workbook.
+        """
+        with self.conn:
+            for table in ['sheets', 'sheet_rows'] + list(SHEET_KINDS):
+                self.conn.execute(f"DELETE FROM {table}")
+            self._sheets = {}
+            for position, sheet in enumerate(workbook.worksheets):
+                rows = sheet.iter_rows(values_only=True)
+                header = list(next(rows, ()))
+                self._save_sheet_meta(sheet.title, header, position)
+                for row_idx, values in enumerate(rows, start=2):
+                    self._insert_row(sheet.title, row_idx, values)
+
+    def to_workbook(self):
+        """
+        Build an openpyxl workbook with the same sheets, in order, as the database.
+        """
+        workbook = Workbook()
+        workbook.remove(workbook.active)
+        for sheet_name, meta in self._sheets.items():
+            sheet = workbook.create_sheet(sheet_name)
+            header = list(meta['header'])
+            if header:
+                sheet.append(header)
+            next_row = 2
+            for row_idx, values in self.read_rows(sheet_name):
+                while next_row < row_idx:  # Keep blank rows where the sheet had them
+                    sheet.append([])
+                    next_row += 1
+                sheet.append(values)
+                next_row += 1
+        return workbook
+
+    def export_workbook(self, xlsx_path):
+        self.to_workbook().save(xlsx_path)
+
+    # Change detection (same interface as workbook_model.WorkbookFingerprint)
+
+    def capture(self):
+        (self._data_version,) = self.conn.execute("PRAGMA data_version").fetchone()
+
+    def is_modified(self):
+        """
+        True if another connection committed to the database since capture().
+        """
+        (data_version,) = self.conn.execute("PRAGMA data_version").fetchone()
+        return data_version != self._data_version
+
+
+class SqliteJournal:
+    """
+    Drop-in replacement for stock_journal.StockJournal when the data lives in
+    SQLite: each recorded change is committed to the database immediately, so
+    there is nothing to replay or checkpoint.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.path = store.path
+        self.lock = threading.RLock()
+        self.seq = 0
+        self.pending = 0
+        self.checkpoint_listeners = []
+
+    def replay(self, workbook):
+        return 0
+
+    def record(self, workbook, op, **fields):
+        with self.lock:
+            entry = {"seq": self.seq + 1, "op": op, **fields}
+            check_entry(workbook, entry)
+            self.store.apply(entry)
+            self.seq = entry["seq"]
+            apply_entry(workbook, entry)
+            return entry
+
+    def checkpoint(self, workbook, force=False, full=False):
+        return False
+
+    def close(self):
+        with self.lock:
+            self.store.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert the EUC stock workbook to and from SQLite.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    import_parser = subparsers.add_parser("import", help="Load an xlsx workbook into a database")
+    import_parser.add_argument("xlsx")
+    import_parser.add_argument("db")
+    export_parser = subparsers.add_parser("export", help="Write a database back out as an xlsx workbook")
+    export_parser.add_argument("db")
+    export_parser.add_argument("xlsx")
+    args = parser.parse_args(argv)
+
+    if args.command == "import":
+        store = SqliteStore(args.db)
+        store.import_workbook(load_workbook(args.xlsx))
+        print(f"Imported {len(store.sheetnames())} sheets from {args.xlsx} into {args.db}")
+    else:
+        store = SqliteStore(args.db)
+        store.export_workbook(args.xlsx)
+        print(f"Exported {len(store.sheetnames())} sheets from {args.db} to {args.xlsx}")
+    store.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
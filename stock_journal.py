@@ -0,0 +1,329 @@
+# Append-only journal of stock movements for euc_stock_wa.v2.py
+#
+# Every change made by the app is written to "<workbook>.journal" first (one JSON
+# object per line, flushed to disk) and applied to the in-memory workbook. The
+# xlsx itself is only rewritten by a checkpoint, which runs on an interval in a
+# background thread and once more on exit. If the app dies between checkpoints,
+# replay() re-applies the outstanding entries on the next start. Checkpoints only
+# re-serialise the sheets the journaled entries touched (see xlsx_partial.py).
+
+from datetime import datetime
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+
+from openpyxl.packaging.custom import StringProperty
+
+from xlsx_partial import PartialXlsxWriter
+
+# Custom document property holding the last journal entry folded into the xlsx
+SEQ_PROPERTY = "JournalSeq"
+
+
+def journal_path_for(workbook_path):
+    """
+    Return the journal file that belongs to the given workbook.
+    """
+    return Path(f"{workbook_path}.journal")
+
+
+def _encode_value(value):
+    # Timestamps are written to the sheets as datetimes; JSON has no type for them
+    if isinstance(value, datetime):
+        return {"$datetime": value.isoformat(sep=' ')}
+    raise TypeError(f"Cannot journal a value of type {type(value).__name__}")
+
+
+def _decode_value(obj):
+    if obj.keys() == {"$datetime"}:
+        return datetime.fromisoformat(obj["$datetime"])
+    return obj
+
+
+def encode_entry(entry):
+    """
+    Serialize a journal entry as one line of JSON.
+    """
+    return json.dumps(entry, default=_encode_value)
+
+
+def decode_entry(line):
+    """
+    Parse a journal line written by encode_entry().
+    """
+    return json.loads(line, object_hook=_decode_value)
+
+
+def get_checkpoint_seq(workbook):
+    """
+    Return the sequence number of the last journal entry saved into the workbook.
+    """
+    for prop in workbook.custom_doc_props.props:
+        if prop.name == SEQ_PROPERTY:
+            try:
+                return int(prop.value)
+            except (TypeError, ValueError):
+                return 0
+    return 0
+
+
+def set_checkpoint_seq(workbook, seq):
+    """
+    Record in the workbook that every journal entry up to seq has been applied.
+    """
+    props = workbook.custom_doc_props
+    props.props = [prop for prop in props.props if prop.name != SEQ_PROPERTY]
+    props.append(StringProperty(name=SEQ_PROPERTY, value=str(seq)))
+
+
+def entry_sheets(entry):
+    """
+    Return the names of the sheets a journal entry changes, or None if it
+    changes the workbook's structure (adds a sheet).
+    """
+    op = entry["op"]
+    if op == "batch":
+        sheets = set()
+        for batch_entry in entry["entries"]:
+            batch_sheets = entry_sheets(batch_entry)
+            if batch_sheets is None:
+                return None
+            sheets |= batch_sheets
+        return sheets
+    if op == "create_sheet":
+        return None
+    if op == "delete_san":
+        return {"All_SANs"}
+    return {entry["sheet"]}
+
+
+def _check_position(value, what):
+    if not isinstance(value, int) or isinstance(value, bool) or value < 1:
+        raise ValueError(f"Invalid {what} in journal entry: {value!r}")
+
+
+def check_entry(workbook, entry, new_sheets=None):
+    """
+    Raise ValueError if apply_entry() would fail on the workbook: an unknown
+    operation, a sheet that doesn't exist or a row/column that isn't valid.
+    new_sheets holds sheets created earlier in the same batch.
+    """
+    new_sheets = set() if new_sheets is None else new_sheets
+    op = entry.get("op")
+    if op == "batch":
+        for batch_entry in entry["entries"]:
+            check_entry(workbook, batch_entry, new_sheets)
+        return
+    if op not in ("append", "create_sheet", "set_cell", "set_cells", "set_count", "delete_san"):
+        raise ValueError(f"Unknown journal operation: {op}")
+    sheet_name = "All_SANs" if op == "delete_san" else entry.get("sheet")
+    if op == "create_sheet":
+        new_sheets.add(sheet_name)
+    elif sheet_name not in new_sheets and sheet_name not in workbook.sheetnames:
+        raise ValueError(f"Journal entry for missing sheet: {sheet_name}")
+    if op == "set_cell":
+        _check_position(entry.get("row"), "row")
+        _check_position(entry.get("column"), "column")
+    elif op == "set_cells":
+        for row_idx, column, _value in entry["cells"]:
+            _check_position(row_idx, "row")
+            _check_position(column, "column")
+
+
+def apply_entry(workbook, entry):
+    """
+    Apply a single journal entry to an openpyxl workbook.
+
+    Entries are replayed in the order they were recorded, so row based operations
+    land on the same rows they did originally. A "batch" entry holds several
+    operations that are journaled (and so replayed) all together or not at all.
+    """
+    op = entry["op"]
+    if op == "batch":
+        for batch_entry in entry["entries"]:
+            apply_entry(workbook, batch_entry)
+    elif op == "append":
+        workbook[entry["sheet"]].append(entry["row"])
+    elif op == "create_sheet":
+        if entry["sheet"] not in workbook.sheetnames:
+            sheet = workbook.create_sheet(entry["sheet"])
+            sheet.append(entry["header"])
+    elif op == "set_cell":
+        # Assigned rather than passed to cell(), which ignores value=None
+        workbook[entry["sheet"]].cell(row=entry["row"], column=entry["column"]).value = entry["value"]
+    elif op == "set_cells":
+        sheet = workbook[entry["sheet"]]
+        for row_idx, column, value in entry["cells"]:
+            sheet.cell(row=row_idx, column=column).value = value
+    elif op == "set_count":
+        sheet = workbook[entry["sheet"]]
+        for row in sheet.iter_rows(min_row=2):
+            if row[0].value == entry["item"]:
+                row[1].value = entry["last"]  # LastCount
+                row[2].value = entry["new"]   # NewCount
+    elif op == "delete_san":
+        sheet = workbook["All_SANs"]
+        row_idx = entry.get("row")  # Row hint from the SAN index, checked before use
+        if row_idx and sheet.cell(row=row_idx, column=1).value == entry["san"]:
+            sheet.delete_rows(row_idx)
+            return
+        for row in sheet.iter_rows(min_row=2):
+            if row[0].value == entry["san"]:
+                sheet.delete_rows(row[0].row)
+                break
+    else:
+        raise ValueError(f"Unknown journal operation: {op}")
+
+
+class StockJournal:
+    """
+    Durable, append-only log of workbook changes with checkpointing into the xlsx.
+    """
+
+    def __init__(self, workbook_path):
+        self.workbook_path = Path(workbook_path)
+        self.path = journal_path_for(workbook_path)
+        # Guards the workbook against a checkpoint saving it mid-change
+        self.lock = threading.RLock()
+        self.seq = 0
+        self.pending = 0  # Entries recorded since the last checkpoint
+        self.checkpoint_listeners = []  # Called (under the lock) after each checkpoint
+        self.writer = PartialXlsxWriter()
+        self.dirty_sheets = set()  # Sheets changed since the last checkpoint; None if all of them
+        self._file = None
+
+    def replay(self, workbook):
+        """
+        Re-apply journal entries that never made it into the xlsx and open the
+        journal for appending. Returns the number of entries replayed.
+        """
+        with self.lock:
+            if self._file is not None:
+                self._file.close()  # Replaying onto a freshly reloaded workbook
+            self.seq = get_checkpoint_seq(workbook)
+            self.writer.track(workbook, self.workbook_path)
+            self.dirty_sheets = set()
+            replayed = 0
+            if self.path.exists():
+                with open(self.path, "r", encoding="utf-8") as journal_file:
+                    for line in journal_file:
+                        try:
+                            entry = decode_entry(line)
+                        except json.JSONDecodeError:
+                            # A torn final line from a crash mid-write; nothing after it is valid
+                            logging.warning(f"Ignoring incomplete journal line in {self.path}")
+                            break
+                        if entry["seq"] <= self.seq:
+                            continue  # Already checkpointed before the crash
+                        self.seq = entry["seq"]
+                        try:
+                            check_entry(workbook, entry)
+                            apply_entry(workbook, entry)
+                        except Exception as e:
+                            # One bad entry mustn't stop the app starting or the rest replaying
+                            logging.error(f"Skipping journal entry {entry['seq']} ({entry.get('op')}): {e}")
+                            continue
+                        self._mark_dirty(entry)
+                        replayed += 1
+            self.pending = replayed
+            self._file = open(self.path, "a", encoding="utf-8")
+            if replayed:
+                logging.info(f"Replayed {replayed} journal entries from {self.path}")
+            return replayed
+
+    def record(self, workbook, op, **fields):
+        """
+        Durably append a change to the journal, then apply it to the workbook.
+        Raises ValueError, before anything is written, if the change can't be applied.
+        """
+        with self.lock:
+            entry = {"seq": self.seq + 1, "op": op, **fields}
+            check_entry(workbook, entry)
+            self._file.write(encode_entry(entry) + "\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self.seq = entry["seq"]
+            apply_entry(workbook, entry)
+            self._mark_dirty(entry)
+            self.pending += 1
+            return entry
+
+    def _mark_dirty(self, entry):
+        sheets = entry_sheets(entry)
+        if sheets is None:
+            self.dirty_sheets = None
+        elif self.dirty_sheets is not None:
+            self.dirty_sheets |= sheets
+
+    def checkpoint(self, workbook, force=False, full=False):
+        """
+        Fold the journal into the xlsx: save the workbook atomically, then empty
+        the journal. Returns True if the workbook was written.
+
+        Only the sheets changed since the last checkpoint are written again,
+        unless full is set (or a partial save isn't possible).
+        """
+        with self.lock:
+            if not self.pending and not force:
+                return False
+            set_checkpoint_seq(workbook, self.seq)
+            temp_path = self.workbook_path.with_name(self.workbook_path.name + ".tmp")
+            saved = self.writer.save(workbook, temp_path, self.workbook_path,
+                                     dirty_sheets=None if full else self.dirty_sheets)
+            os.replace(temp_path, self.workbook_path)
+            # Entries up to self.seq are now in the xlsx; replay would skip them anyway
+            self._file.seek(0)
+            self._file.truncate()
+            rewritten = "" if saved == "full" else f" of {', '.join(sorted(self.dirty_sheets)) or 'no sheets'}"
+            logging.info(f"Checkpointed {self.pending} journal entries into {self.workbook_path} ({saved} save{rewritten})")
+            self.pending = 0
+            self.dirty_sheets = set()
+            for listener in self.checkpoint_listeners:
+                listener()
+            return True
+
+    def close(self):
+        with self.lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class Checkpointer(threading.Thread):
+    """
+    Background thread that checkpoints the journal every `interval` seconds.
+    Until workbook is set (e.g. while it is parsed in the background) nothing
+    is checkpointed.
+    """
+
+    def __init__(self, journal, workbook, interval=60):
+        super().__init__(name="journal-checkpointer", daemon=True)
+        self.journal = journal
+        self.workbook = workbook
+        self.interval = interval
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            if self.workbook is None:
+                continue
+            try:
+                self.journal.checkpoint(self.workbook)
+            except Exception as e:
+                # The journal still holds every entry, so the next attempt can retry
+                logging.error(f"Checkpoint failed: {e}")
+
+    def stop(self):
+        """
+        Stop the thread and run a final checkpoint so the xlsx is current on exit.
+        """
+        self._stop_event.set()
+        if self.is_alive():
+            self.join()
+        try:
+            if self.workbook is not None:
+                self.journal.checkpoint(self.workbook)
+        finally:
+            self.journal.close()
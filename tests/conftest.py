@@ -0,0 +1,48 @@
+# Shared fixtures for the tests of the app's modules
+#
+# The modules live as flat scripts at the top of the repository, so it is put on
+# sys.path here. small_workbook() writes a workbook with the sheets the modules
+# under test look at (All_SANs and one site's items and log), laid out like
+# EUC_Perth_Assets.xlsx.
+#
+#   python -m pytest -q
+
+from datetime import datetime
+from pathlib import Path
+import sys
+
+import pytest
+from openpyxl import Workbook
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+LOG_HEADER = ['Timestamp', 'Item', 'Action', 'SAN #', 'Op', 'Qty']
+
+
+def write_small_workbook(path):
+    workbook = Workbook()
+    all_sans = workbook.active
+    all_sans.title = 'All_SANs'
+    all_sans.append(['SAN Number', 'Item', 'Time', 'Location'])
+    for i in range(1, 6):
+        all_sans.append([f"SAN{100 + i}", 'Laptop 840 G9', datetime(2024, 1, i, 9), 'BR'])
+
+    items = workbook.create_sheet('BR_Items')
+    items.append(['Item', 'LastCount', 'NewCount', 'Threshold'])
+    items.append(['Laptop 840 G9', 3, 5, 10])
+    items.append(['Wired Mouse', 20, 18, 10])
+
+    log = workbook.create_sheet('BR_Timestamps')
+    log.append(LOG_HEADER)
+    log.append([datetime(2024, 1, 1, 9), 'Wired Mouse', 'add 20', None, 1, 20])
+    log.append([datetime(2024, 1, 2, 9), 'Wired Mouse', 'subtract 2', None, -1, 2])
+    workbook.save(path)
+    return path
+
+
+@pytest.fixture
+def small_workbook(tmp_path):
+    """
+    Path of a freshly written workbook in a temporary directory.
+    """
+    return write_small_workbook(tmp_path / "stock.xlsx")
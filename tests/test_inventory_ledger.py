@@ -0,0 +1,154 @@
+from datetime import datetime
+import random
+from zipfile import ZipFile
+
+import numpy as np
+from openpyxl import load_workbook
+import pytest
+
+from inventory_ledger import (Ledger, LedgerError, clamped_counts, drift, log_movements, open_source,
+                              rebuild_entries, stored_counts)
+from inventory_snapshots import action_delta
+from sqlite_store import SqliteStore
+from xlsx_partial import read_sheet_parts
+
+
+def naive_counts(codes, deltas, opening, opening_last):
+    # update_count(), one movement at a time
+    last, new, clamps = list(opening_last), list(opening), [0] * len(opening)
+    for code, delta in zip(codes, deltas):
+        last[code] = new[code]
+        if new[code] + delta < 0:
+            clamps[code] += 1
+        new[code] = max(new[code] + delta, 0)
+    return last, new, clamps
+
+
+def test_clamped_counts_match_update_count():
+    rng = random.Random(7)
+    for _ in range(200):
+        count = rng.randint(1, 6)
+        moves = rng.randint(0, 60)
+        codes = [rng.randrange(count) for _ in range(moves)]
+        deltas = [rng.choice([-1, 1]) * rng.randint(1, 5) for _ in range(moves)]
+        opening = [rng.randint(0, 8) for _ in range(count)]
+        opening_last = [rng.randint(0, 8) for _ in range(count)]
+        last, new, clamps = clamped_counts(np.array(codes, dtype=np.int64), np.array(deltas, dtype=np.int64),
+                                           np.array(opening, dtype=np.int64), np.array(opening_last, dtype=np.int64))
+        assert (last.tolist(), new.tolist(), clamps.tolist()) == naive_counts(codes, deltas, opening, opening_last)
+
+
+def test_log_movements_follow_action_delta():
+    rows = [
+        ('Wired Mouse', 'add 3', None, 1, 3),
+        ('Wired Mouse', 'subtract 2', '', None, None),  # From before the Op/Qty columns
+        ('Laptop 840 G9', 'add', 'SAN101', 1, 1),  # Counted again in the total that follows
+        ('Laptop 840 G9', 'add 1', None, 1, 1),
+        ('Wired Mouse', 'moved shelves', None, None, None),
+        (None, 'add 4', None, 1, 4),
+    ]
+    items, deltas = log_movements(*(list(column) for column in zip(*rows)))
+    expected = [(item, action_delta(action, san, op, qty)) for item, action, san, op, qty in rows
+                if item is not None and action_delta(action, san, op, qty) is not None]
+    assert list(zip(items, deltas.tolist())) == [(item, delta) for item, delta in expected]
+
+
+def log_rows(path, rows):
+    workbook = load_workbook(path)
+    for row in rows:
+        workbook['BR_Timestamps'].append(row)
+    workbook.save(path)
+
+
+def set_stored(path, counts):
+    workbook = load_workbook(path)
+    for row in workbook['BR_Items'].iter_rows(min_row=2):
+        if row[0].value in counts:
+            row[1].value, row[2].value = counts[row[0].value]
+    workbook.save(path)
+
+
+def end_with_formatted_row(path):
+    # As Excel leaves several sheets of the real workbook
+    with ZipFile(path) as archive:
+        parts = read_sheet_parts(archive)
+        members = {info.filename: archive.read(info) for info in archive.infolist()}
+    member = parts['BR_Timestamps']
+    members[member] = members[member].replace(
+        b'</sheetData>', b'<row r="1048576" ht="12.75" customHeight="1"/></sheetData>', 1)
+    with ZipFile(path, "w") as archive:
+        for name, data in members.items():
+            archive.writestr(name, data)
+
+
+def test_replay_from_an_adopted_snapshot(small_workbook):
+    ledger = Ledger(small_workbook)
+    ledger.take_snapshot(adopt=True)
+    with open_source(small_workbook) as source:
+        assert drift(ledger.replay(source), {'BR': stored_counts(source, 'BR')}) == []
+
+    log_rows(small_workbook, [
+        [datetime(2024, 1, 3, 9), 'Wired Mouse', 'subtract 30', None, -1, 30],  # Stops at zero
+        [datetime(2024, 1, 3, 10), 'Wired Mouse', 'add 4', None, 1, 4],
+        [datetime(2024, 1, 3, 11), 'Laptop 840 G9', 'add', 'SAN106', 1, 1],
+        [datetime(2024, 1, 3, 11), 'Laptop 840 G9', 'add 1', None, 1, 1],
+        [datetime(2024, 1, 3, 12), 'Headset', 'add 2', None, 1, 2],
+    ])
+    end_with_formatted_row(small_workbook)
+    state = Ledger(small_workbook).replay()
+    assert state.replayed_rows == {'BR': 5}
+    assert state.counts('BR') == {'Laptop 840 G9': (5, 6), 'Wired Mouse': (0, 4), 'Headset': (0, 2)}
+    assert state.clamped == {'BR': {'Wired Mouse': 1}}
+
+    with open_source(small_workbook) as source:
+        differences = drift(state, {'BR': stored_counts(source, 'BR')})
+    assert differences == [('BR', 'Laptop 840 G9', 5, 6), ('BR', 'Wired Mouse', 18, 4), ('BR', 'Headset', None, 2)]
+    assert rebuild_entries(state, differences) == [
+        {"op": "set_count", "sheet": "BR_Items", "item": "Laptop 840 G9", "last": 5, "new": 6},
+        {"op": "set_count", "sheet": "BR_Items", "item": "Wired Mouse", "last": 0, "new": 4},
+    ]
+
+
+def test_trailing_formatted_rows_are_not_log_rows(small_workbook):
+    end_with_formatted_row(small_workbook)
+    with open_source(small_workbook) as source:
+        first_row, values = source.read_fields('BR_Timestamps', 'timestamps', ('item', 'qty'))
+        assert (first_row, values) == (2, {'item': ['Wired Mouse', 'Wired Mouse'], 'qty': [20, 2]})
+        assert source.read_fields('BR_Timestamps', 'timestamps', ('item',), min_row=4) == (4, {'item': []})
+        assert source.read_fields('BR_Timestamps', 'timestamps', ('item',), min_row=3, max_row=3) == \
+            (3, {'item': ['Wired Mouse']})
+
+
+def test_edits_above_a_snapshot_are_noticed(small_workbook):
+    ledger = Ledger(small_workbook)
+    ledger.take_snapshot(adopt=True)
+    workbook = load_workbook(small_workbook)
+    workbook['BR_Timestamps']['C3'] = 'subtract 5'  # The snapshot's last row, changed in Excel
+    workbook.save(small_workbook)
+    with pytest.raises(LedgerError):
+        ledger.replay()
+
+    ledger.take_snapshot(adopt=True)  # Checked and adopted again
+    log_rows(small_workbook, [[datetime(2024, 1, 4, 9), 'Wired Mouse', 'add 1', None, 1, 1]])
+    assert ledger.replay().counts('BR')['Wired Mouse'] == (18, 19)
+    # From the oldest snapshot the logs still match: the first no longer does
+    state = ledger.replay(full=True)
+    assert state.based_on is ledger.snapshots[1] and state.replayed_rows == {'BR': 1}
+
+
+def test_sqlite_store_replays_the_same(small_workbook, tmp_path):
+    log_rows(small_workbook, [[datetime(2024, 1, 3, 9), 'Wired Mouse', 'subtract 3', None, -1, 3]])
+    set_stored(small_workbook, {'Wired Mouse': (18, 15)})
+    db_path = tmp_path / "stock.db"
+    store = SqliteStore(str(db_path))
+    store.import_workbook(load_workbook(small_workbook))
+    store.close()
+    for path in (small_workbook, db_path):
+        ledger = Ledger(path)
+        state = ledger.replay()
+        assert state.counts('BR') == {'Wired Mouse': (18, 15)}
+        ledger.take_snapshot(adopt=True)
+        assert ledger.snapshots[-1]['sites']['BR']['row'] == 4
+        assert ledger.snapshots[-1]['sites']['BR']['anchor'] == \
+            ['2024-01-03 09:00:00', 'Wired Mouse', 'subtract 3', None]
+        assert ledger.replay().replayed_rows == {'BR': 0}
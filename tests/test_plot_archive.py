@@ -0,0 +1,96 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from plot_archive import PlotArchive, legacy_entry, site_for_chart
+
+NOW = datetime(2024, 12, 1, 12, 0, 0)
+
+
+@pytest.fixture
+def archive(tmp_path):
+    archive = PlotArchive(tmp_path / "Plots")
+    yield archive
+    archive.close()
+
+
+def add_chart(archive, tmp_path, chart, content, days_ago):
+    png = tmp_path / f"{chart}.png"
+    png.write_bytes(content)
+    content_hash = archive.add_file(png, data_digest=f"{chart}-{content.hex()}")
+    archive.record(chart, content_hash, generated_at=NOW - timedelta(days=days_ago))
+    return content_hash
+
+
+def test_identical_images_are_stored_once(archive, tmp_path):
+    first = add_chart(archive, tmp_path, "BR_inventory", b"image-1", 3)
+    second = add_chart(archive, tmp_path, "Darwin_inventory", b"image-1", 2)
+    assert first == second
+    assert archive.stats() == (2, 1, len(b"image-1"))
+    assert archive.find("BR_inventory-" + b"image-1".hex()) == first
+    assert [row['chart'] for row in archive.history()] == ["Darwin_inventory", "BR_inventory"]
+    assert [row['chart'] for row in archive.history(site="BR")] == ["BR_inventory"]
+
+
+def test_prune_by_age_keeps_the_newest_of_each_chart(archive, tmp_path):
+    old = add_chart(archive, tmp_path, "BR_inventory", b"old", 100)
+    add_chart(archive, tmp_path, "BR_inventory", b"new", 1)
+    lonely = add_chart(archive, tmp_path, "Darwin_inventory", b"lonely", 200)
+    assert archive.prune(keep_days=90, keep_last=1, now=NOW) == (1, 1, len(b"old"))
+    assert not archive.blob_path(old).exists()
+    assert archive.find("BR_inventory-" + b"old".hex()) is None  # Its digest goes with it
+    assert archive.blob_path(lonely).exists()
+    assert archive.stats() == (2, 2, len(b"new") + len(b"lonely"))
+
+
+def test_prune_keeps_images_still_referenced(archive, tmp_path):
+    shared = add_chart(archive, tmp_path, "BR_inventory", b"same", 100)
+    add_chart(archive, tmp_path, "BR_inventory", b"same", 1)
+    assert archive.prune(keep_days=30, now=NOW) == (1, 0, 0)
+    assert archive.blob_path(shared).exists()
+
+
+def test_prune_to_a_size_forgets_the_oldest_first(archive, tmp_path):
+    for days_ago in (5, 4, 3, 2):
+        add_chart(archive, tmp_path, "BR_inventory", bytes([days_ago]) * 100, days_ago)
+    newest = add_chart(archive, tmp_path, "BR_inventory", b"x" * 100, 1)
+    assert archive.prune(max_bytes=250, now=NOW) == (3, 3, 300)
+    assert [row['generated_at'] for row in archive.history()] == \
+        [str(NOW - timedelta(days=1)), str(NOW - timedelta(days=2))]
+    # The newest generation of a chart is kept however large it is
+    assert archive.prune(max_bytes=0, now=NOW) == (1, 1, 100)
+    assert archive.blob_path(newest).exists()
+
+
+def test_legacy_names(tmp_path):
+    plots = tmp_path / "Plots"
+    assert legacy_entry(plots / "BR_inventory_17.11.24-12.56.23.png", plots) == \
+        ("BR_inventory", datetime(2024, 11, 17, 12, 56, 23), None)
+    assert legacy_entry(plots / "All_20241119_020602" / "4.2_inventory.png", plots) == \
+        ("4.2_inventory", datetime(2024, 11, 19, 2, 6, 2), "All_20241119_020602")
+    assert legacy_entry(plots / "19-11-2024" / "darwin_levels_12.17.10.png", plots) == \
+        ("darwin_levels", datetime(2024, 11, 19, 12, 17, 10), None)
+    assert site_for_chart("build_room_inventory") == "BR"
+    assert site_for_chart("summary") is None
+
+
+def test_prune_keeps_new_images_that_were_never_recorded(archive, tmp_path):
+    png = tmp_path / "BR_inventory.png"
+    png.write_bytes(b"rendering")
+    unrecorded = archive.add_file(png)  # e.g. a render whose report isn't recorded yet
+    assert archive.prune(keep_days=30, now=datetime.now()) == (0, 0, 0)
+    assert archive.blob_path(unrecorded).exists()
+    assert archive.prune(keep_days=30, now=datetime.now() + timedelta(days=2)) == (0, 1, len(b"rendering"))
+
+
+def test_standalone_archive_runs_are_recorded(archive, tmp_path):
+    from inventory_plots import record_history
+
+    png = tmp_path / "Build_Room_inventory.png"
+    png.write_bytes(b"br-chart")
+    results = [{'name': 'BR', 'path': str(png), 'ok': True, 'error': None, 'seconds': None},
+               {'name': 'Darwin', 'path': str(tmp_path / "missing.png"), 'ok': False, 'error': "boom", 'seconds': None}]
+    record_history(archive.root, results, "All_20241201_120000")
+    assert [(row['chart'], row['site'], row['report']) for row in archive.history()] == \
+        [("Build_Room_inventory", "BR", "All_20241201_120000")]
+    assert archive.prune(keep_days=30, now=datetime.now() + timedelta(days=2)) == (0, 0, 0)
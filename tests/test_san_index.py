@@ -0,0 +1,69 @@
+import random
+
+from openpyxl import load_workbook
+
+import san_index
+from san_index import SanIndex, latest_san_locations, normalize_san
+
+
+def test_normalize_san():
+    assert normalize_san(12345) == "SAN12345"
+    assert normalize_san("SAN12345") == "SAN12345"
+
+
+def test_from_rows_keeps_the_first_duplicate():
+    index = SanIndex.from_rows([("SAN1", "A", None, "BR"), (None,), ("SAN2", "B"), ("SAN1", "C", None, None)], 5)
+    assert len(index) == 2
+    assert index.get("SAN1").row == 2 and index.get("SAN1").item == "A"
+    assert index.get("SAN2") == (4, "B", None, None)
+    assert index.max_row == 5
+
+
+def test_rows_shift_up_after_removals():
+    index = SanIndex.from_rows([(f"SAN{i}", "A", None, "BR") for i in range(2, 12)], 11)  # SANn on row n
+    index.remove("SAN5")
+    index.remove("SAN3")
+    assert index.get("SAN2").row == 2
+    assert index.get("SAN4").row == 3
+    assert index.get("SAN6").row == 4
+    assert index.get("SAN11").row == 9
+    assert index.max_row == 9
+    index.add("SAN99", "B", None, "Darwin")  # Appended after the last row
+    assert index.get("SAN99").row == 10
+    index.remove("SAN2")
+    assert index.get("SAN99").row == 9 and index.get("SAN4").row == 2
+
+
+def test_rows_match_the_sheet_through_compaction(small_workbook, monkeypatch):
+    monkeypatch.setattr(san_index, "COMPACT_AFTER", 4)
+    rng = random.Random(3)
+    workbook = load_workbook(small_workbook)
+    sheet = workbook['All_SANs']
+    index = SanIndex.from_sheet(sheet)
+    next_san = 200
+    for _ in range(200):
+        if len(index) and rng.random() < 0.5:
+            san_number = rng.choice(list(index))
+            sheet.delete_rows(index.get(san_number).row)
+            index.remove(san_number)
+        else:
+            san_number = f"SAN{next_san}"
+            next_san += 1
+            sheet.append([san_number, "Laptop 840 G9", None, "BR"])
+            index.add(san_number, "Laptop 840 G9", None, "BR")
+        rows = {row[0].value: row[0].row for row in sheet.iter_rows(min_row=2) if row[0].value}
+        assert {san: index.get(san).row for san in index} == rows
+        assert index.max_row == len(rows) + 1
+
+
+def test_latest_san_locations_follow_the_newest_movement(small_workbook):
+    workbook = load_workbook(small_workbook)
+    darwin = workbook.create_sheet('Darwin_Timestamps')
+    darwin.append(['Timestamp', 'Item', 'Action', 'SAN #'])
+    darwin.append(['2024-02-01 10:00:00', 'Laptop 840 G9', 'add', 'SAN101'])  # Text, as before migration
+    br = workbook['BR_Timestamps']
+    br.append(['2024-01-15 10:00:00', 'Laptop 840 G9', 'add', 'SAN101'])
+    br.append(['2024-01-15 10:00:00', 'Laptop 840 G9', 'add', 'SAN102'])
+    locations = latest_san_locations(workbook, {'BR_Timestamps': 'BR', 'Darwin_Timestamps': 'Darwin',
+                                                '4.2_Timestamps': '4.2'})
+    assert locations == {'SAN101': 'Darwin', 'SAN102': 'BR'}
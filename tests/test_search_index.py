@@ -0,0 +1,44 @@
+from search_index import SearchIndex, ngrams
+
+ROWS = [
+    ("SAN100200", "Laptop 840 G9"),
+    ("SAN100201", "Laptop x360 G8"),
+    ("SAN300400", "Monitor 24"),
+    ("SAN300401", None),
+]
+
+
+def naive_search(rows, query):
+    query = query.strip().lower()
+    return [row for row in rows if query in " ".join(str(value) for value in row if value is not None).lower()]
+
+
+def test_ngrams():
+    assert ngrams("abcd") == {"abc", "bcd"}
+    assert ngrams("ab") == set()
+
+
+def test_search_matches_a_substring_scan():
+    index = SearchIndex(ROWS, fields=(0, 1))
+    for query in ["", "s", "sa", "san", "SAN1002", "g9", "laptop", "0 g", "zzz", "  monitor ", "3004"]:
+        assert index.search(query) == naive_search(ROWS, query), query
+
+
+def test_narrowing_reuses_the_previous_hits():
+    index = SearchIndex(ROWS, fields=(0, 1))
+    index.search("san1")
+    index._text[2] = "san1 planted"  # Not a previous hit, so narrowing must not find it
+    assert index.search("san10") == ROWS[:2]
+    assert index.search("san100") == ROWS[:2]
+    assert index.search("san1002") == ROWS[:2]
+    assert index.search("san10020") == ROWS[:2]
+    # A query that doesn't extend the last one is looked up in the trigram
+    # postings again, which were built from the original text
+    assert index.search("laptop") == ROWS[:2]
+    assert index.search("planted") == []
+
+
+def test_typing_then_deleting_widens_the_results_again():
+    index = SearchIndex(ROWS, fields=(0, 1))
+    for query in ["m", "mo", "mon", "mo", "m", ""]:
+        assert index.search(query) == naive_search(ROWS, query), query
@@ -0,0 +1,98 @@
+from datetime import date, datetime, time
+
+from openpyxl import load_workbook
+
+from sqlite_store import SqliteStore, column_map, is_sqlite_path, sheet_kind
+from stock_journal import apply_entry
+
+
+def sheet_values(workbook):
+    # Trailing empty cells and rows don't survive a save either way
+    def trimmed(row):
+        row = list(row)
+        while row and row[-1] is None:
+            row.pop()
+        return tuple(row)
+
+    values = {}
+    for sheet in workbook.worksheets:
+        rows = [trimmed(row) for row in sheet.iter_rows(values_only=True)]
+        while rows and not rows[-1]:
+            rows.pop()
+        values[sheet.title] = rows
+    return values
+
+
+def full_workbook(path):
+    workbook = load_workbook(path)
+    returns = workbook.create_sheet('SAN_Returns')
+    returns.append(['SAN', 'Gen:', 'Returned By', 'Returned To', None, 'Notes', 'Timestamp'])
+    returns.append(['100200', 'G9', 'user', 'stores', None, None, datetime(2024, 5, 1, 14, 2, 3)])
+    headsets = workbook.create_sheet('Headsets')
+    headsets.append(['Serial #', 'ServiceNow #', ' Notes'])
+    headsets.append(['HS00001', 'RITM300000', 'spare'])
+    other = workbook.create_sheet('Notes')
+    other.append(['When', 'Flag', 'At', 'Amount'])
+    other.append([date(2024, 6, 1), True, time(9, 30), 2.5])
+    other.append([])  # A blank row in the middle is kept
+    other.append(['text', False, None, 7, 'beyond the header'])
+    workbook['BR_Items'].cell(row=2, column=6, value='an extra cell')
+    workbook.save(path)
+    return path
+
+
+def test_sheet_kind_and_column_map():
+    assert sheet_kind('BR_Items') == ('items', 'BR')
+    assert sheet_kind('4.2_Timestamps') == ('timestamps', '4.2')
+    assert sheet_kind('All_SANs') == ('all_sans', None)
+    assert sheet_kind('Summary') == ('sheet_rows', None)
+    assert column_map('timestamps', ['Timestamp', 'Item', 'Action', 'SAN #', 'Op', 'Qty']) == \
+        {'timestamp': 0, 'item': 1, 'action': 2, 'san': 3, 'op': 4, 'qty': 5}
+    # Found by header name, wherever it is; missing ones take their usual column if free
+    assert column_map('items', ['Item', 'Threshold', 'LastCount']) == \
+        {'item': 0, 'threshold': 1, 'last_count': 2}
+    assert is_sqlite_path('EUC.DB') and not is_sqlite_path('EUC.xlsx')
+
+
+def test_import_export_round_trip(small_workbook, tmp_path):
+    path = full_workbook(small_workbook)
+    store = SqliteStore(str(tmp_path / "stock.db"))
+    store.import_workbook(load_workbook(path))
+    assert store.sheetnames() == load_workbook(path).sheetnames
+    store.export_workbook(tmp_path / "exported.xlsx")
+    store.close()
+    assert sheet_values(load_workbook(tmp_path / "exported.xlsx")) == sheet_values(load_workbook(path))
+
+
+def test_journal_entries_match_the_workbook(small_workbook, tmp_path):
+    workbook = load_workbook(small_workbook)
+    store = SqliteStore(str(tmp_path / "stock.db"))
+    store.import_workbook(workbook)
+    entries = [
+        {"op": "append", "sheet": "BR_Timestamps",
+         "row": [datetime(2024, 1, 3, 9), "Wired Mouse", "add 2", None, 1, 2]},
+        {"op": "set_count", "sheet": "BR_Items", "item": "Wired Mouse", "last": 18, "new": 20},
+        {"op": "set_cell", "sheet": "BR_Items", "row": 3, "column": 4, "value": 5},
+        {"op": "batch", "entries": [
+            {"op": "delete_san", "san": "SAN103", "row": 2},  # Stale row hint
+            {"op": "append", "sheet": "All_SANs", "row": ["SAN200", "Laptop 840 G9", datetime(2024, 2, 1), "BR"]},
+        ]},
+        {"op": "create_sheet", "sheet": "SAN_Returns", "header": ["SAN", "Gen", "Returned By"]},
+        {"op": "append", "sheet": "SAN_Returns", "row": ["100200", "G9", "user"]},
+        {"op": "set_cells", "sheet": "All_SANs", "cells": [[2, 4, "Darwin"], [3, 4, None]]},
+    ]
+    for entry in entries:
+        apply_entry(workbook, entry)
+        store.apply(entry)
+    assert sheet_values(store.to_workbook()) == sheet_values(workbook)
+    store.close()
+
+
+def test_read_fields_reads_the_typed_columns(small_workbook, tmp_path):
+    store = SqliteStore(str(tmp_path / "stock.db"))
+    store.import_workbook(load_workbook(small_workbook))
+    assert store.read_fields('BR_Timestamps', ['item', 'op', 'qty', 'missing']) == \
+        [(2, 'Wired Mouse', 1, 20, None), (3, 'Wired Mouse', -1, 2, None)]
+    assert store.read_fields('BR_Timestamps', ['timestamp'], min_row=3) == [(3, '2024-01-02 09:00:00')]
+    assert list(store.read_rows('BR_Items', min_row=3)) == [(3, ['Wired Mouse', 20, 18, 10])]
+    store.close()
@@ -0,0 +1,166 @@
+from datetime import datetime
+
+from openpyxl import load_workbook
+import pytest
+
+from stock_journal import (Checkpointer, StockJournal, apply_entry, decode_entry, encode_entry, entry_sheets,
+                           get_checkpoint_seq, journal_path_for)
+
+
+def sheet_rows(workbook, sheet_name):
+    return list(workbook[sheet_name].iter_rows(values_only=True))
+
+
+def test_entries_round_trip_datetimes():
+    entry = {"seq": 1, "op": "append", "sheet": "BR_Timestamps",
+             "row": [datetime(2024, 3, 1, 12, 30, 5), "Wired Mouse", "add 1", "", 1, 1]}
+    assert decode_entry(encode_entry(entry)) == entry
+
+
+def test_entry_sheets():
+    assert entry_sheets({"op": "append", "sheet": "BR_Timestamps"}) == {"BR_Timestamps"}
+    assert entry_sheets({"op": "delete_san", "san": "SAN101"}) == {"All_SANs"}
+    assert entry_sheets({"op": "batch", "entries": [{"op": "append", "sheet": "All_SANs"},
+                                                    {"op": "set_count", "sheet": "BR_Items"}]}) == {"All_SANs", "BR_Items"}
+    # Adding a sheet changes the workbook's structure, not just a sheet
+    assert entry_sheets({"op": "batch", "entries": [{"op": "create_sheet", "sheet": "SAN_Returns"}]}) is None
+
+
+def test_delete_san_checks_the_row_hint(small_workbook):
+    workbook = load_workbook(small_workbook)
+    apply_entry(workbook, {"op": "delete_san", "san": "SAN103", "row": 2})  # Stale hint: row 2 is SAN101
+    assert [row[0] for row in sheet_rows(workbook, 'All_SANs')[1:]] == ["SAN101", "SAN102", "SAN104", "SAN105"]
+    apply_entry(workbook, {"op": "delete_san", "san": "SAN104", "row": 4})
+    assert [row[0] for row in sheet_rows(workbook, 'All_SANs')[1:]] == ["SAN101", "SAN102", "SAN105"]
+
+
+def test_set_cells_can_clear_a_cell(small_workbook):
+    workbook = load_workbook(small_workbook)
+    apply_entry(workbook, {"op": "set_cells", "sheet": "All_SANs", "cells": [[2, 4, None], [3, 4, "Darwin"]]})
+    apply_entry(workbook, {"op": "set_cell", "sheet": "BR_Items", "row": 2, "column": 4, "value": None})
+    assert [row[3] for row in sheet_rows(workbook, 'All_SANs')[1:3]] == [None, "Darwin"]
+    assert sheet_rows(workbook, 'BR_Items')[1] == ('Laptop 840 G9', 3, 5, None)
+
+
+def record_movements(journal, workbook):
+    journal.record(workbook, "append", sheet="BR_Timestamps",
+                   row=[datetime(2024, 1, 3, 9), "Wired Mouse", "add 2", None, 1, 2])
+    journal.record(workbook, "set_count", sheet="BR_Items", item="Wired Mouse", last=18, new=20)
+    journal.record(workbook, "delete_san", san="SAN102", row=3)
+
+
+def test_replay_after_a_crash(small_workbook):
+    journal = StockJournal(small_workbook)
+    workbook = load_workbook(small_workbook)
+    assert journal.replay(workbook) == 0
+    record_movements(journal, workbook)
+    expected = {name: sheet_rows(workbook, name) for name in workbook.sheetnames}
+    journal.close()  # The app dies before checkpointing
+
+    reloaded = load_workbook(small_workbook)
+    restarted = StockJournal(small_workbook)
+    assert restarted.replay(reloaded) == 3
+    assert {name: sheet_rows(reloaded, name) for name in reloaded.sheetnames} == expected
+    assert restarted.seq == 3
+    restarted.close()
+
+
+def test_replay_ignores_a_torn_last_line(small_workbook):
+    journal = StockJournal(small_workbook)
+    workbook = load_workbook(small_workbook)
+    journal.replay(workbook)
+    record_movements(journal, workbook)
+    journal.close()
+    with open(journal_path_for(small_workbook), "a", encoding="utf-8") as journal_file:
+        journal_file.write('{"seq": 4, "op": "app')
+
+    restarted = StockJournal(small_workbook)
+    assert restarted.replay(load_workbook(small_workbook)) == 3
+    restarted.close()
+
+
+def test_checkpoint_folds_the_journal_into_the_xlsx(small_workbook):
+    journal = StockJournal(small_workbook)
+    workbook = load_workbook(small_workbook)
+    journal.replay(workbook)
+    record_movements(journal, workbook)
+    assert journal.dirty_sheets == {"BR_Timestamps", "BR_Items", "All_SANs"}
+    assert journal.checkpoint(workbook)
+    assert journal_path_for(small_workbook).stat().st_size == 0
+    assert not journal.checkpoint(workbook)  # Nothing pending
+    # The first save added the JournalSeq property; from then on only dirty sheets are written
+    journal.record(workbook, "set_count", sheet="BR_Items", item="Laptop 840 G9", last=5, new=6)
+    assert journal.dirty_sheets == {"BR_Items"}
+    assert journal.checkpoint(workbook)
+    assert journal.writer.last_save == "partial"
+    journal.close()
+
+    saved = load_workbook(small_workbook)
+    assert get_checkpoint_seq(saved) == 4
+    assert {name: sheet_rows(saved, name) for name in saved.sheetnames} == \
+        {name: sheet_rows(workbook, name) for name in workbook.sheetnames}
+    restarted = StockJournal(small_workbook)
+    assert restarted.replay(saved) == 0
+    restarted.close()
+
+
+def test_replay_skips_entries_already_checkpointed(small_workbook):
+    journal = StockJournal(small_workbook)
+    workbook = load_workbook(small_workbook)
+    journal.replay(workbook)
+    record_movements(journal, workbook)
+    journal.checkpoint(workbook)
+    journal.close()
+    # The journal is rewritten with the checkpointed entries, as if truncating it had failed
+    entries = [{"seq": 3, "op": "delete_san", "san": "SAN102", "row": 3},
+               {"seq": 4, "op": "set_count", "sheet": "BR_Items", "item": "Laptop 840 G9", "last": 5, "new": 4}]
+    journal_path_for(small_workbook).write_text("".join(encode_entry(entry) + "\n" for entry in entries))
+
+    reloaded = load_workbook(small_workbook)
+    restarted = StockJournal(small_workbook)
+    assert restarted.replay(reloaded) == 1
+    assert [row[0] for row in sheet_rows(reloaded, 'All_SANs')[1:]] == ["SAN101", "SAN103", "SAN104", "SAN105"]
+    assert sheet_rows(reloaded, 'BR_Items')[1] == ('Laptop 840 G9', 5, 4, 10)
+    restarted.close()
+
+
+def test_checkpointer_waits_for_the_workbook(small_workbook):
+    journal = StockJournal(small_workbook)
+    workbook = load_workbook(small_workbook)
+    journal.replay(workbook)
+    journal.record(workbook, "set_count", sheet="BR_Items", item="Wired Mouse", last=18, new=19)
+    checkpointer = Checkpointer(journal, None, interval=0.01)  # Still being parsed
+    checkpointer.start()
+    checkpointer.stop()
+    assert journal.pending == 1  # Nothing was saved without a workbook
+    assert load_workbook(small_workbook)['BR_Items']['C3'].value == 18
+
+
+def test_record_rejects_an_entry_it_cannot_apply(small_workbook):
+    journal = StockJournal(small_workbook)
+    workbook = load_workbook(small_workbook)
+    journal.replay(workbook)
+    with pytest.raises(ValueError):
+        journal.record(workbook, "append", sheet="Missing_Timestamps", row=["x"])
+    with pytest.raises(ValueError):
+        journal.record(workbook, "set_cell", sheet="BR_Items", row=0, column=2, value=1)
+    # A sheet created earlier in the same batch is fine
+    journal.record(workbook, "batch", entries=[{"op": "create_sheet", "sheet": "SAN_Returns", "header": ["SAN"]},
+                                               {"op": "append", "sheet": "SAN_Returns", "row": ["SAN101"]}])
+    journal.close()
+    lines = journal_path_for(small_workbook).read_text(encoding="utf-8").splitlines()
+    assert [decode_entry(line)["seq"] for line in lines] == [1]
+
+
+def test_replay_skips_entries_that_fail_to_apply(small_workbook):
+    with open(journal_path_for(small_workbook), "w", encoding="utf-8") as journal_file:
+        journal_file.write(encode_entry({"seq": 1, "op": "append", "sheet": "Gone", "row": ["x"]}) + "\n")
+        journal_file.write(encode_entry({"seq": 2, "op": "set_count", "sheet": "BR_Items",
+                                         "item": "Wired Mouse", "last": 18, "new": 20}) + "\n")
+
+    journal = StockJournal(small_workbook)
+    workbook = load_workbook(small_workbook)
+    assert journal.replay(workbook) == 1
+    assert journal.seq == 2
+    assert sheet_rows(workbook, 'BR_Items')[2][:3] == ('Wired Mouse', 18, 20)
+    journal.close()
@@ -0,0 +1,42 @@
+from datetime import date, datetime
+
+import pytest
+
+from workbook_reader import parse_action, to_datetime, to_number
+
+
+@pytest.mark.parametrize("action, expected", [
+    ("add 3", (1, 3)),
+    ("subtract 12", (-1, 12)),
+    ("add", (1, 1)),  # One SAN, or a row from before volumes were logged
+    ("subtract", (-1, 1)),
+    ("add 2.0", (1, 2)),
+    ("  add   4 ", (1, 4)),
+    ("add x", (None, None)),
+    ("Add 3", (None, None)),
+    ("remove 3", (None, None)),
+    ("", (None, None)),
+    (None, (None, None)),
+])
+def test_parse_action(action, expected):
+    assert parse_action(action) == expected
+
+
+def test_to_number():
+    assert to_number(5) == 5
+    assert to_number(5.0) == 5 and isinstance(to_number(5.0), int)
+    assert to_number(2.5) == 2.5
+    assert to_number(" 7 ") == 7
+    assert to_number("n/a") is None
+    assert to_number(None) is None
+    assert to_number(True) is None
+
+
+def test_to_datetime():
+    when = datetime(2024, 3, 1, 12, 30, 5)
+    assert to_datetime(when) is when
+    assert to_datetime(date(2024, 3, 1)) == datetime(2024, 3, 1)
+    assert to_datetime("2024-03-01 12:30:05") == when
+    assert to_datetime(" 2024-03-01 12:30:05 ") == when
+    assert to_datetime("01/03/2024") is None
+    assert to_datetime(None) is None
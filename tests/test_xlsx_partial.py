@@ -0,0 +1,90 @@
+import os
+from zipfile import ZipFile
+
+from openpyxl import load_workbook
+from openpyxl.comments import Comment
+
+from xlsx_partial import PartialXlsxWriter, read_sheet_parts
+
+
+def sheet_rows(workbook):
+    return {sheet.title: list(sheet.iter_rows(values_only=True)) for sheet in workbook.worksheets}
+
+
+def save(writer, workbook, path, dirty_sheets):
+    temp_path = path.with_name(path.name + ".tmp")
+    saved = writer.save(workbook, temp_path, path, dirty_sheets=dirty_sheets)
+    os.replace(temp_path, path)
+    return saved
+
+
+def tracked(path):
+    workbook = load_workbook(path)
+    writer = PartialXlsxWriter()
+    writer.track(workbook, path)
+    return workbook, writer
+
+
+def test_only_dirty_sheets_are_rewritten(small_workbook):
+    workbook, writer = tracked(small_workbook)
+    with ZipFile(small_workbook) as archive:
+        parts = read_sheet_parts(archive)
+        before = {info.filename: info.CRC for info in archive.infolist()}
+    workbook['BR_Items']['C3'] = 25
+    assert save(writer, workbook, small_workbook, {'BR_Items'}) == "partial"
+
+    with ZipFile(small_workbook) as archive:
+        after = {info.filename: info.CRC for info in archive.infolist()}
+    assert after.keys() == before.keys()
+    changed = {name for name in after if after[name] != before[name]}
+    assert parts['BR_Items'] in changed
+    assert parts['All_SANs'] not in changed and parts['BR_Timestamps'] not in changed
+    assert sheet_rows(load_workbook(small_workbook)) == sheet_rows(workbook)
+
+    # And again, from the file the partial save wrote
+    workbook['BR_Timestamps'].append([None, 'Wired Mouse', 'add 1', None, 1, 1])
+    assert save(writer, workbook, small_workbook, {'BR_Timestamps'}) == "partial"
+    assert sheet_rows(load_workbook(small_workbook)) == sheet_rows(workbook)
+
+
+def test_file_changed_on_disk_means_a_full_save(small_workbook):
+    workbook, writer = tracked(small_workbook)
+    other = load_workbook(small_workbook)
+    other['BR_Items']['C2'] = 99  # Saved from Excel meanwhile
+    other.save(small_workbook)
+    workbook['BR_Items']['C3'] = 25
+    assert save(writer, workbook, small_workbook, {'BR_Items'}) == "full"
+    assert sheet_rows(load_workbook(small_workbook)) == sheet_rows(workbook)
+    # The full save is tracked, so the next one can be partial again
+    workbook['BR_Items']['C3'] = 26
+    assert save(writer, workbook, small_workbook, {'BR_Items'}) == "partial"
+
+
+def test_structural_changes_mean_a_full_save(small_workbook):
+    workbook, writer = tracked(small_workbook)
+    workbook.create_sheet('SAN_Returns').append(['SAN', 'Gen'])
+    assert save(writer, workbook, small_workbook, {'SAN_Returns'}) == "full"
+    assert load_workbook(small_workbook).sheetnames == workbook.sheetnames
+
+    workbook['BR_Items']['A2'].comment = Comment("Counted on Friday", "stores")
+    assert save(writer, workbook, small_workbook, {'BR_Items'}) == "full"
+    assert load_workbook(small_workbook)['BR_Items']['A2'].comment.text == "Counted on Friday"
+
+    workbook['BR_Items']['C3'] = 1
+    assert save(writer, workbook, small_workbook, None) == "full"  # Dirty sheets unknown
+
+
+def test_styles_written_elsewhere_mean_a_full_save(small_workbook):
+    with ZipFile(small_workbook) as archive:
+        members = {info.filename: archive.read(info) for info in archive.infolist()}
+    # As if saved by Excel: the styles aren't byte for byte what openpyxl writes
+    members['xl/styles.xml'] = members['xl/styles.xml'].replace(b'<fonts count="1">', b'<fonts count="1" x="1">', 1)
+    with ZipFile(small_workbook, "w") as archive:
+        for name, data in members.items():
+            archive.writestr(name, data)
+
+    workbook, writer = tracked(small_workbook)
+    workbook['BR_Items']['C3'] = 25
+    assert save(writer, workbook, small_workbook, {'BR_Items'}) == "full"
+    workbook['BR_Items']['C3'] = 26
+    assert save(writer, workbook, small_workbook, {'BR_Items'}) == "partial"
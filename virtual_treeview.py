@@ -0,0 +1,188 @@
+# Virtualized ttk.Treeview for long logs
+#
+# A plain Treeview holds one Tk item per row, so showing a timestamp sheet with
+# years of history means tens of thousands of inserts on every refresh.
+# VirtualTreeview keeps the rows in a Python list and only materializes the rows
+# that fit on screen: a small pool of Tk items is reused, and scrolling just
+# rewrites their values. It is a drop-in Treeview for headings, columns, focus and
+# selection, with set_rows()/insert_top() in place of insert()/delete().
+
+import tkinter.ttk as ttk
+
+from workbook_reader import to_datetime
+
+
+def column_sort_key(values):
+    """
+    Pick a sort key for a column: datetime if every value parses as a timestamp,
+    else float if every value is numeric, else plain text.
+    """
+    def as_datetime(value):
+        parsed = to_datetime(value)
+        if parsed is None:
+            raise ValueError(f"Not a timestamp: {value!r}")
+        return parsed
+
+    for convert in (as_datetime, float):
+        try:
+            for value in values:
+                convert(value)
+        except (TypeError, ValueError):
+            continue
+        return convert
+    return lambda value: "" if value is None else str(value)
+
+
+class VirtualTreeview(ttk.Treeview):
+    """
+    Treeview that only creates Tk items for the visible window of rows.
+    """
+
+    def __init__(self, master=None, row_height=25, **kwargs):
+        self._yscrollcommand = kwargs.pop('yscrollcommand', None)
+        super().__init__(master, **kwargs)
+        self._rows = []
+        self._offset = 0  # Index of the first visible row
+        self._pool = []  # Reused Tk item ids, one per visible row
+        self._visible = int(kwargs.get('height', 10))
+        self._row_height = row_height
+        self._selected = None  # Absolute index of the selected row
+        self.tag_configure('oddrow', background='#f0f0f0')
+        self.tag_configure('evenrow', background='white')
+
+        self.bind('<Configure>', self._on_configure)
+        self.bind('<MouseWheel>', lambda e: self.scroll_rows(-3 if e.delta > 0 else 3))
+        self.bind('<Button-4>', lambda e: self.scroll_rows(-3))
+        self.bind('<Button-5>', lambda e: self.scroll_rows(3))
+        self.bind('<Up>', lambda e: self._on_arrow(-1))
+        self.bind('<Down>', lambda e: self._on_arrow(1))
+        self.bind('<<TreeviewSelect>>', self._on_select, add='+')
+
+    # Data
+
+    def set_rows(self, rows):
+        """
+        Replace all rows and redraw the visible window.
+        """
+        self._rows = list(rows)
+        self._selected = None
+        self._render()
+
+    def insert_top(self, row):
+        """
+        Add a row above the others (e.g. a new log entry) without a rebuild.
+        """
+        self._rows.insert(0, row)
+        if self._selected is not None:
+            self._selected += 1
+        self._render()
+
+    def rows(self):
+        return self._rows
+
+    def sort_column(self, col, descending=False):
+        """
+        Sort every row (not only the visible ones) by the given column.
+        """
+        idx = list(self['columns']).index(col)
+        key = column_sort_key([row[idx] for row in self._rows])
+        self._rows.sort(key=lambda row: key(row[idx]), reverse=descending)
+        self._selected = None
+        self._offset = 0
+        self._render()
+
+    # Scrolling
+
+    def configure(self, cnf=None, **kw):
+        if 'yscrollcommand' in kw:
+            # The scrollbar tracks the whole row list, not the Tk items
+            self._yscrollcommand = kw.pop('yscrollcommand')
+            self._update_scrollbar()
+            if cnf is None and not kw:
+                return None
+        return super().configure(cnf, **kw)
+
+    config = configure
+
+    def yview(self, *args):
+        if not args:
+            return self._fractions()
+        if args[0] == 'moveto':
+            self._offset = int(float(args[1]) * len(self._rows))
+        elif args[0] == 'scroll':
+            step = self._visible if args[2] == 'pages' else 1
+            self._offset += int(args[1]) * step
+        self._render()
+
+    def yview_moveto(self, fraction):
+        self.yview('moveto', fraction)
+
+    def yview_scroll(self, number, what):
+        self.yview('scroll', number, what)
+
+    def scroll_rows(self, count):
+        self._offset += count
+        self._render()
+        return "break"
+
+    # Internals
+
+    def _fractions(self):
+        if not self._rows:
+            return 0.0, 1.0
+        first = self._offset / len(self._rows)
+        last = min(self._offset + len(self._pool), len(self._rows)) / len(self._rows)
+        return first, last
+
+    def _update_scrollbar(self):
+        if self._yscrollcommand is not None:
+            self._yscrollcommand(*self._fractions())
+
+    def _render(self):
+        count = len(self._rows)
+        self._offset = max(0, min(self._offset, count - self._visible))
+        window = self._rows[self._offset:self._offset + self._visible]
+
+        while len(self._pool) < len(window):
+            self._pool.append(super().insert('', 'end'))
+        while len(self._pool) > len(window):
+            super().delete(self._pool.pop())
+
+        for i, (iid, row) in enumerate(zip(self._pool, window)):
+            tag = 'oddrow' if (self._offset + i) % 2 == 1 else 'evenrow'
+            super().item(iid, values=row, tags=(tag,))
+
+        # Keep the selection on the same row, not the same Tk item
+        slot = None if self._selected is None else self._selected - self._offset
+        if slot is not None and 0 <= slot < len(self._pool):
+            if self.selection() != (self._pool[slot],):
+                self.selection_set(self._pool[slot])
+            self.focus(self._pool[slot])
+        elif self.selection():
+            self.selection_remove(*self.selection())
+        self._update_scrollbar()
+
+    def _on_configure(self, event):
+        # One row's worth of height goes to the headings
+        visible = max(1, event.height // self._row_height - 1)
+        if visible != self._visible:
+            self._visible = visible
+            self._render()
+
+    def _on_select(self, event):
+        # An empty selection only means the selected row scrolled out of view
+        selection = self.selection()
+        if selection and selection[0] in self._pool:
+            self._selected = self._offset + self._pool.index(selection[0])
+
+    def _on_arrow(self, delta):
+        focus = self.focus()
+        if focus not in self._pool:
+            return None
+        slot = self._pool.index(focus) + delta
+        if 0 <= slot < len(self._pool):
+            return None  # Let the Treeview move within the window
+        self._selected = max(0, min(self._offset + slot, len(self._rows) - 1))
+        self._offset += delta
+        self._render()
+        return "break"
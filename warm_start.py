@@ -0,0 +1,174 @@
+# Warm-start snapshot of the parsed workbook
+#
+# Parsing EUC_Perth_Assets.xlsx with openpyxl is the slowest part of starting
+# the app, and the window can't be used until it's done. The first screen only
+# needs values, though: the items sheets (counts and thresholds), All_SANs for
+# the SAN index and the *_Timestamps logs. A snapshot of exactly those values is
+# pickled next to the workbook ("<workbook>.warm") and tagged with the xlsx's
+# mtime, size and hash. When they still match at startup, the models are built
+# from the snapshot and the openpyxl workbook is parsed in the background; until
+# it arrives, PendingWorkbook stands in for it and anything that really needs
+# the workbook waits for the parse. Any mismatch means a normal full parse.
+#
+# The snapshot is rewritten after every checkpoint, so it follows the xlsx.
+# Sheets a LazyWorkbook hasn't loaded are unchanged on disk since the previous
+# snapshot, so their values are carried over from it rather than read again.
+
+import logging
+import os
+from pathlib import Path
+import pickle
+import threading
+
+from lazy_workbook import LazyWorkbook, sheet_values
+
+SNAPSHOT_VERSION = 1  # Bump when the snapshot layout changes
+
+
+def warm_start_path_for(workbook_path):
+    """
+    Return the snapshot file that belongs to the given workbook.
+    """
+    return Path(f"{workbook_path}.warm")
+
+
+def fingerprint_key(fingerprint):
+    """
+    Return the (mtime, size, hash) a snapshot is tagged with, from a captured WorkbookFingerprint.
+    """
+    return fingerprint.mtime_ns, fingerprint.size, fingerprint.digest
+
+
+def capture(workbook, fingerprint, item_sheets, previous=None):
+    """
+    Copy the values the app starts from out of a loaded openpyxl workbook.
+
+    Call it while the workbook matches the file fingerprint describes, e.g.
+    right after a checkpoint and under the journal's lock.
+
+    :param previous: The last snapshot taken of the same file. Sheets a
+                     LazyWorkbook hasn't loaded are copied from it, or streamed
+                     from the file without it.
+    """
+    def unchanged(section, sheet_name):
+        return (previous is not None and isinstance(workbook, LazyWorkbook) and not workbook.is_loaded(sheet_name)
+                and sheet_name in previous[section])
+
+    snapshot = {
+        'version': SNAPSHOT_VERSION,
+        'key': fingerprint_key(fingerprint),
+        'headers': {},
+        'items': {},
+        'logs': {},
+        'sans': [],
+        'san_max_row': 1,
+    }
+    for sheet_name in workbook.sheetnames:
+        snapshot['headers'][sheet_name] = (previous['headers'][sheet_name] if unchanged('headers', sheet_name)
+                                           else next(iter(sheet_values(workbook, sheet_name, max_row=1)), ()))
+    for sheet_name in item_sheets:
+        if sheet_name in workbook.sheetnames:
+            snapshot['items'][sheet_name] = (previous['items'][sheet_name] if unchanged('items', sheet_name)
+                                             else sheet_values(workbook, sheet_name, min_row=2))
+    for sheet_name in workbook.sheetnames:
+        if sheet_name.endswith('_Timestamps'):
+            snapshot['logs'][sheet_name] = (
+                previous['logs'][sheet_name] if unchanged('logs', sheet_name)
+                else [row for row in sheet_values(workbook, sheet_name, min_row=2) if row[0] is not None])
+    if 'All_SANs' in workbook.sheetnames:
+        if unchanged('headers', 'All_SANs'):
+            snapshot['sans'], snapshot['san_max_row'] = previous['sans'], previous['san_max_row']
+        else:
+            snapshot['sans'] = sheet_values(workbook, 'All_SANs', min_row=2, max_col=4)
+            snapshot['san_max_row'] = len(snapshot['sans']) + 1
+    return snapshot
+
+
+def save(snapshot, path):
+    """
+    Write a snapshot atomically.
+    """
+    path = Path(path)
+    temp_path = path.with_name(path.name + ".tmp")
+    with open(temp_path, "wb") as snapshot_file:
+        pickle.dump(snapshot, snapshot_file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temp_path, path)
+
+
+def save_in_background(snapshot, path):
+    """
+    Write a snapshot from a separate thread; the app waits for it on exit.
+    """
+    def write():
+        try:
+            save(snapshot, path)
+        except OSError as e:
+            logging.warning(f"Could not write the warm-start snapshot {path}: {e}")
+
+    thread = threading.Thread(target=write, name="warm-start-snapshot")
+    thread.start()
+    return thread
+
+
+def load(path, fingerprint):
+    """
+    Return the snapshot at path if it was taken from the file fingerprint
+    describes, or None if it is missing, stale or unreadable.
+    """
+    try:
+        with open(path, "rb") as snapshot_file:
+            snapshot = pickle.load(snapshot_file)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logging.warning(f"Ignoring unreadable warm-start snapshot {path}: {e}")
+        return None
+    if snapshot.get('version') != SNAPSHOT_VERSION or tuple(snapshot.get('key', ())) != fingerprint_key(fingerprint):
+        logging.info(f"Warm-start snapshot {path} doesn't match the workbook; parsing it in full")
+        return None
+    return snapshot
+
+
+class PendingWorkbook:
+    """
+    Stands in for the openpyxl workbook while it is parsed in the background.
+    Using it waits for the parse to finish, then forwards to the real workbook.
+    """
+
+    def __init__(self):
+        self._ready = threading.Event()
+        self._workbook = None
+        self._error = None
+
+    @property
+    def loaded(self):
+        return self._ready.is_set()
+
+    def set(self, workbook):
+        self._workbook = workbook
+        self._ready.set()
+
+    def fail(self, error):
+        self._error = error
+        self._ready.set()
+
+    def wait(self):
+        """
+        Return the workbook once it has been parsed.
+        """
+        self._ready.wait()
+        if self._error is not None:
+            raise RuntimeError(f"The workbook failed to load: {self._error}")
+        return self._workbook
+
+    def __getattr__(self, name):
+        return getattr(self.wait(), name)
+
+    def __getitem__(self, key):
+        return self.wait()[key]
+
+    def __contains__(self, key):
+        return key in self.wait()
+
+    def __iter__(self):
+        return iter(self.wait())
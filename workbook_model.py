@@ -0,0 +1,186 @@
+# In-memory model of the workbook used to drive the GUI
+#
+# The item tree is rendered from ItemModel rather than by reading the xlsx, and
+# the write path in update_count updates the model directly. WorkbookFingerprint
+# tells the app when the file on disk was changed by someone else (e.g. saved
+# from Excel) so it only reloads in that case. LowStockTracker keeps the set of
+# items under their threshold current as the model's counts change.
+
+import hashlib
+import os
+
+from lazy_workbook import sheet_values
+
+
+def file_digest(path, chunk_size=1 << 20):
+    """
+    Return the SHA-1 hex digest of a file's contents.
+    """
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class WorkbookFingerprint:
+    """
+    Remembers the mtime, size and hash of the xlsx as last loaded or saved by the app.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.mtime_ns = None
+        self.size = None
+        self.digest = None
+
+    def capture(self):
+        """
+        Record the current state of the file, e.g. right after the app saved it.
+        """
+        stat = os.stat(self.path)
+        self.mtime_ns, self.size = stat.st_mtime_ns, stat.st_size
+        self.digest = file_digest(self.path)
+
+    def is_modified(self):
+        """
+        True if the file differs from the captured state. The hash is only
+        computed when mtime or size have moved.
+        """
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return False  # Mid-replace or removed; nothing to reload from
+        if (stat.st_mtime_ns, stat.st_size) == (self.mtime_ns, self.size):
+            return False
+        digest = file_digest(self.path)
+        if digest == self.digest:
+            # Touched but not changed; remember the new stat so we don't hash again
+            self.mtime_ns, self.size = stat.st_mtime_ns, stat.st_size
+            return False
+        return True
+
+
+DEFAULT_THRESHOLD = 10  # For sheets without a Threshold column (L17, B4.3)
+
+
+class LowStockTracker:
+    """
+    Items whose NewCount is below their threshold, updated one item at a time.
+    """
+
+    def __init__(self, default_threshold=DEFAULT_THRESHOLD):
+        self.default_threshold = default_threshold
+        self._low = {}  # (sheet name, item) -> (count, threshold)
+        self.listeners = []  # Called as listener(sheet, item, count, threshold, is_low) when an item crosses
+
+    def __len__(self):
+        return len(self._low)
+
+    def __contains__(self, key):
+        return key in self._low
+
+    def update(self, sheet_name, item, count, threshold, notify=True):
+        """
+        Record an item's current count; listeners hear about it if it crossed its threshold.
+        """
+        if threshold is None:
+            threshold = self.default_threshold
+        key = (sheet_name, item)
+        was_low = key in self._low
+        is_low = isinstance(count, (int, float)) and isinstance(threshold, (int, float)) and count < threshold
+        if is_low:
+            self._low[key] = (count, threshold)
+        else:
+            self._low.pop(key, None)
+        if notify and is_low != was_low:
+            for listener in self.listeners:
+                listener(sheet_name, item, count, threshold, is_low)
+
+    def clear_sheet(self, sheet_name):
+        for key in [key for key in self._low if key[0] == sheet_name]:
+            del self._low[key]
+
+    def items(self):
+        """
+        Return (sheet, item, count, threshold) for every low item, in sheet and item order.
+        """
+        return [(sheet_name, item, count, threshold)
+                for (sheet_name, item), (count, threshold) in sorted(self._low.items(), key=lambda kv: (kv[0][0], str(kv[0][1])))]
+
+
+class ItemModel:
+    """
+    Rows of the *_Items sheets, kept in sheet order and indexed by item name.
+    """
+
+    def __init__(self):
+        self._rows = {}   # sheet name -> list of row lists
+        self._by_item = {}  # sheet name -> {item: [row lists]}
+        self._threshold_col = {}  # sheet name -> index of its Threshold column, or None
+        self.low_stock = LowStockTracker()
+
+    def load(self, workbook, sheet_names):
+        for sheet_name in sheet_names:
+            self.load_sheet(workbook, sheet_name)
+
+    def load_sheet(self, workbook, sheet_name):
+        """
+        (Re)read one items sheet from the openpyxl workbook, without making a
+        LazyWorkbook load it.
+        """
+        if sheet_name in workbook.sheetnames:
+            rows = sheet_values(workbook, sheet_name)
+            self.load_rows(sheet_name, rows[0] if rows else (), rows[1:])
+        else:
+            self.load_rows(sheet_name, (), [])
+
+    def load_rows(self, sheet_name, header_row, sheet_rows):
+        """
+        (Re)load one items sheet from its header and row values, e.g. from a warm-start snapshot.
+        """
+        rows = []
+        by_item = {}
+        header = [str(value).strip() if value is not None else None for value in header_row]
+        threshold_col = header.index('Threshold') if 'Threshold' in header else None
+        for row in sheet_rows:
+            if row[0] is not None:
+                row = list(row)
+                rows.append(row)
+                by_item.setdefault(row[0], []).append(row)
+        self._rows[sheet_name] = rows
+        self._by_item[sheet_name] = by_item
+        self._threshold_col[sheet_name] = threshold_col
+
+        self.low_stock.clear_sheet(sheet_name)
+        for row in rows:
+            self.low_stock.update(sheet_name, row[0], row[2] if len(row) > 2 else None,
+                                  self.threshold(sheet_name, row), notify=False)
+
+    def threshold(self, sheet_name, row):
+        """
+        Return the threshold stored in an item row, or None if the sheet has none.
+        """
+        threshold_col = self._threshold_col.get(sheet_name)
+        if threshold_col is None or threshold_col >= len(row):
+            return None
+        return row[threshold_col]
+
+    def rows(self, sheet_name):
+        return self._rows.get(sheet_name, [])
+
+    def get(self, sheet_name, item):
+        """
+        Return the first row for an item, or None.
+        """
+        rows = self._by_item.get(sheet_name, {}).get(item)
+        return rows[0] if rows else None
+
+    def set_count(self, sheet_name, item, last, new):
+        """
+        Mirror a LastCount/NewCount change made to the sheet.
+        """
+        for row in self._by_item.get(sheet_name, {}).get(item, []):
+            row[1] = last
+            row[2] = new
+            self.low_stock.update(sheet_name, item, new, self.threshold(sheet_name, row))
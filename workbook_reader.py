@@ -0,0 +1,202 @@
+# Streaming, read-only access to the stock workbook for reports and lookups
+#
+# load_workbook() builds every cell of every sheet, styles included, before
+# anything can be read. Code here opens the file with read_only=True instead:
+# rows stream from the sheet XML one at a time, only the sheets asked for are
+# touched, cells outside the requested columns are skipped, and each row comes
+# out as a namedtuple with counts as numbers and timestamps as datetimes. Memory
+# stays flat however long the *_Timestamps logs grow. SQLite stores (.db) are
+# read the same way.
+#
+#   for row in iter_rows('EUC_Perth_Assets.xlsx', '4.2_Timestamps', fields=('timestamp', 'item')):
+#       print(row.timestamp, row.item)
+
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import date, datetime
+from functools import lru_cache
+
+from openpyxl import load_workbook
+
+from sqlite_store import SHEET_KINDS, SqliteStore, column_map, is_sqlite_path, sheet_kind
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Header of the *_Timestamps sheets. Op (+1 add, -1 subtract) and Qty hold the
+# Action as numbers so movements can be summed without parsing the text.
+LOG_HEADER = ['Timestamp', 'Item', 'Action', 'SAN #', 'Op', 'Qty']
+
+
+def to_number(value):
+    """
+    Return a count as an int (or float), or None if it isn't numeric.
+    """
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return int(value) if float(value).is_integer() else value
+    try:
+        return to_number(float(str(value).strip()))
+    except ValueError:
+        return None
+
+
+@lru_cache(maxsize=65536)
+def _parse_timestamp(text):
+    # Cached: unmigrated sheets and Tk cell text hand the same strings back on every sort and refresh
+    try:
+        return datetime.strptime(text.strip(), TIMESTAMP_FORMAT)
+    except ValueError:
+        return None
+
+
+def to_datetime(value):
+    """
+    Return a timestamp cell as a datetime, or None if it can't be parsed.
+    """
+    if isinstance(value, datetime):
+        return value
+    if isinstance(value, date):
+        return datetime(value.year, value.month, value.day)
+    if value is None:
+        return None
+    return _parse_timestamp(str(value))
+
+
+def parse_action(action):
+    """
+    Split an Action such as "add 3" or "subtract 1" into (op, qty).
+
+    A bare "add"/"subtract" (one SAN, or a row from before volumes were logged)
+    is one unit. Returns (None, None) for anything else.
+    """
+    words = str(action).split() if action else []
+    if not words or words[0] not in ('add', 'subtract'):
+        return None, None
+    qty = to_number(words[1]) if len(words) > 1 else 1
+    if qty is None:
+        return None, None
+    return (1 if words[0] == 'add' else -1), qty
+
+
+def timestamp_now():
+    """
+    Return the current time as written to timestamp cells (whole seconds).
+    """
+    return datetime.now().replace(microsecond=0)
+
+
+# Fields converted on the way out; everything else is passed through as read
+FIELD_TYPES = {
+    'last_count': to_number,
+    'new_count': to_number,
+    'threshold': to_number,
+    'op': to_number,
+    'qty': to_number,
+    'timestamp': to_datetime,
+    'time': to_datetime,
+}
+
+
+@lru_cache(maxsize=None)
+def row_type(kind, fields):
+    """
+    Return the namedtuple class for rows of a sheet kind with the given fields.
+    """
+    return namedtuple(f"{kind.title().replace('_', '')}Row", fields)
+
+
+def kind_fields(sheet_name):
+    """
+    Return (kind, every field name) for a sheet, using the SQLite store's table layout.
+    """
+    kind, _ = sheet_kind(sheet_name)
+    if kind not in SHEET_KINDS:
+        raise ValueError(f"No typed row layout for sheet '{sheet_name}'")
+    return kind, tuple(field for field, _ in SHEET_KINDS[kind])
+
+
+@contextmanager
+def open_workbook(path):
+    """
+    Open a workbook for streaming reads; closed again on exit.
+    """
+    if is_sqlite_path(path):
+        store = SqliteStore(path)
+        try:
+            yield store
+        finally:
+            store.close()
+        return
+    workbook = load_workbook(path, read_only=True, data_only=True, keep_links=False)
+    try:
+        yield workbook
+    finally:
+        workbook.close()  # Read-only workbooks keep the zip open until closed
+
+
+def _read_header(source, sheet_name):
+    """
+    Return the header row of a sheet in an open workbook or SQLite store.
+    """
+    if isinstance(source, SqliteStore):
+        if sheet_name not in source.sheetnames():
+            raise KeyError(f"Worksheet {sheet_name} does not exist.")
+        return source.header(sheet_name)
+    if sheet_name not in source.sheetnames:
+        raise KeyError(f"Worksheet {sheet_name} does not exist.")
+    return next(source[sheet_name].iter_rows(min_row=1, max_row=1, values_only=True), ())
+
+
+def iter_sheet(source, sheet_name, fields=None):
+    """
+    Yield typed rows from a sheet of a workbook opened with open_workbook().
+
+    :param fields: Field names to read (see sqlite_store.SHEET_KINDS); all by default.
+                   Rows with none of these fields filled in are skipped.
+    """
+    kind, all_fields = kind_fields(sheet_name)
+    fields = tuple(fields or all_fields)
+    missing = [field for field in fields if field not in all_fields]
+    if missing:
+        raise ValueError(f"Unknown fields for {sheet_name}: {', '.join(missing)}")
+    columns = column_map(kind, _read_header(source, sheet_name))
+    positions = [columns.get(field) for field in fields]
+
+    if isinstance(source, SqliteStore):
+        first = 0
+        rows = (values for _, values in source.read_rows(sheet_name))
+    else:
+        # Only the span of columns holding the requested fields is read
+        present = [position for position in positions if position is not None] or [0]
+        first = min(present)
+        rows = source[sheet_name].iter_rows(min_row=2, min_col=first + 1, max_col=max(present) + 1, values_only=True)
+
+    converters = [FIELD_TYPES.get(field) for field in fields]
+    make_row = row_type(kind, fields)
+    for values in rows:
+        raw = []
+        for position in positions:
+            index = None if position is None else position - first
+            raw.append(values[index] if index is not None and index < len(values) else None)
+        if all(value is None for value in raw):
+            continue  # Nothing in the requested columns
+        yield make_row(*(convert(value) if convert is not None else value for value, convert in zip(raw, converters)))
+
+
+def iter_rows(path, sheet_name, fields=None):
+    """
+    Stream typed rows from one sheet of the workbook file at path.
+    """
+    with open_workbook(path) as source:
+        yield from iter_sheet(source, sheet_name, fields)
+
+
+def read_sheets(path, sheet_names, fields=None):
+    """
+    Read several sheets with a single open of the file.
+
+    Returns a dict of sheet name -> list of typed rows.
+    """
+    with open_workbook(path) as source:
+        return {sheet_name: list(iter_sheet(source, sheet_name, fields)) for sheet_name in sheet_names}
@@ -0,0 +1,210 @@
+# Partial xlsx saves: rewrite only the worksheets that changed
+#
+# workbook.save() serialises every worksheet, the styles and the document parts
+# from scratch, so a checkpoint after changing one count in 4.2_Items costs as
+# much as writing out the whole workbook. PartialXlsxWriter instead builds the
+# new xlsx from the file already on disk: every zip member is copied across as
+# it is (the compressed bytes, without inflating them), and only the worksheets
+# marked dirty are serialised again, along with the small parts that change on
+# every save (core.xml, custom.xml, and styles.xml if a change added a style).
+# openpyxl writes strings inline rather than into sharedStrings.xml, so a
+# rewritten sheet never touches the shared strings, and the copied sheets'
+# references into them stay valid.
+#
+# That only works while the file on disk is the one the in-memory workbook was
+# loaded from or last saved to, openpyxl reads its styles back unchanged and no
+# sheet was added. Otherwise (and for dirty sheets with tables, comments, images
+# or hyperlinks, which need parts of their own) the writer falls back to a full
+# workbook.save(), after which partial saves work again.
+#
+#   writer = PartialXlsxWriter()
+#   writer.track(workbook, path)            # straight after load_workbook(path)
+#   ... change 4.2_Items ...
+#   writer.save(workbook, temp_path, path, dirty_sheets={'4.2_Items'})
+
+from datetime import datetime, timezone
+from io import BytesIO
+import logging
+import os
+import posixpath
+import struct
+import zipfile
+from zipfile import ZIP_DEFLATED, BadZipFile, ZipFile, ZipInfo
+
+from openpyxl.styles.stylesheet import write_stylesheet
+from openpyxl.worksheet._writer import WorksheetWriter
+from openpyxl.xml.constants import ARC_CORE, ARC_CUSTOM, ARC_STYLE, ARC_WORKBOOK, ARC_WORKBOOK_RELS
+from openpyxl.xml.functions import fromstring, tostring
+
+SHEET_MAIN_NS = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+PACKAGE_RELS_NS = "http://schemas.openxmlformats.org/package/2006/relationships"
+OFFICE_RELS_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+
+
+class FullSaveNeeded(Exception):
+    """
+    A dirty sheet can't be written on its own; save the whole workbook instead.
+    """
+
+
+def _file_state(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+def read_sheet_parts(archive):
+    """
+    Return a dict of sheet name -> zip member holding it, in workbook order.
+    """
+    targets = {}
+    for rel in fromstring(archive.read(ARC_WORKBOOK_RELS)).iter(f"{{{PACKAGE_RELS_NS}}}Relationship"):
+        target = rel.get("Target")
+        # Targets are relative to xl/ unless they start with a slash
+        targets[rel.get("Id")] = target.lstrip("/") if target.startswith("/") else posixpath.join("xl", target)
+    sheets = fromstring(archive.read(ARC_WORKBOOK)).find(f"{{{SHEET_MAIN_NS}}}sheets")
+    return {sheet.get("name"): targets[sheet.get(f"{{{OFFICE_RELS_NS}}}id")]
+            for sheet in sheets.iter(f"{{{SHEET_MAIN_NS}}}sheet")}
+
+
+def rels_part_for(member):
+    folder, name = posixpath.split(member)
+    return posixpath.join(folder, "_rels", f"{name}.rels")
+
+
+def copy_member(source, target, info):
+    """
+    Copy a zip member's compressed bytes from one open archive to another,
+    without inflating and deflating them again.
+    """
+    source.fp.seek(info.header_offset)
+    header = source.fp.read(zipfile.sizeFileHeader)
+    name_length, extra_length = struct.unpack("<HH", header[26:30])
+    source.fp.seek(info.header_offset + zipfile.sizeFileHeader + name_length + extra_length)
+    data = source.fp.read(info.compress_size)
+
+    copied = ZipInfo(info.filename, info.date_time)
+    copied.compress_type = info.compress_type
+    copied.create_system = info.create_system
+    copied.external_attr = info.external_attr
+    copied.flag_bits = info.flag_bits & ~0x08  # Sizes are in the header, so no data descriptor follows
+    copied.CRC = info.CRC
+    copied.compress_size = info.compress_size
+    copied.file_size = info.file_size
+    copied.header_offset = target.fp.tell()
+    target.fp.write(copied.FileHeader())
+    target.fp.write(data)
+    target.filelist.append(copied)
+    target.NameToInfo[copied.filename] = copied
+    target.start_dir = target.fp.tell()
+    target._didModify = True
+
+
+class PartialXlsxWriter:
+    """
+    Saves a workbook by rewriting only its dirty worksheets in the xlsx on disk.
+    """
+
+    def __init__(self):
+        self.workbook = None  # The workbook the file on disk matches
+        self._file_state = None  # (size, mtime) of that file
+        self._sheet_parts = {}  # Sheet name -> zip member, in workbook order
+        self._members = set()
+        self._styles_xml = None  # Its styles.xml, if identical to what openpyxl would write
+        self.last_save = None  # "full" or "partial"
+
+    def track(self, workbook, path):
+        """
+        Note the file a workbook was just loaded from, before anything changes it.
+        """
+        self.workbook = workbook
+        try:
+            with ZipFile(path) as archive:
+                self._read_layout(archive)
+                styles_xml = archive.read(ARC_STYLE)
+        except (OSError, KeyError, BadZipFile) as e:
+            logging.info(f"Partial saves disabled until the next full save of {path}: {e}")
+            self._file_state = None
+            return
+        # Saved by Excel, or by another openpyxl version: the style ids may not line up
+        self._styles_xml = styles_xml if styles_xml == tostring(write_stylesheet(workbook)) else None
+        self._file_state = _file_state(path)
+
+    def _read_layout(self, archive):
+        self._sheet_parts = read_sheet_parts(archive)
+        self._members = set(archive.namelist())
+
+    def can_save_partially(self, workbook, source_path):
+        return (workbook is self.workbook
+                and self._styles_xml is not None
+                and self._file_state is not None
+                and self._file_state == _file_state(source_path)
+                and list(self._sheet_parts) == workbook.sheetnames
+                and (ARC_CUSTOM in self._members or not len(workbook.custom_doc_props)))
+
+    def save(self, workbook, target_path, source_path, dirty_sheets=None):
+        """
+        Write workbook to target_path, copying what hasn't changed from source_path.
+
+        :param dirty_sheets: Names of the sheets changed since source_path was
+                             written, or None to rewrite everything.
+        :return: "partial" or "full", whichever kind of save was made.
+        """
+        if dirty_sheets is None or not self.can_save_partially(workbook, source_path):
+            return self._save_full(workbook, target_path)
+        try:
+            parts = self._write_sheets(workbook, dirty_sheets)
+        except FullSaveNeeded as e:
+            logging.info(f"Saving the whole workbook: {e}")
+            return self._save_full(workbook, target_path)
+
+        workbook.properties.modified = datetime.now(tz=timezone.utc).replace(tzinfo=None)
+        parts[ARC_CORE] = tostring(workbook.properties.to_tree())
+        if len(workbook.custom_doc_props):
+            parts[ARC_CUSTOM] = tostring(workbook.custom_doc_props.to_tree())
+        styles_xml = tostring(write_stylesheet(workbook))  # After the sheets, which may add styles
+        if styles_xml != self._styles_xml:
+            parts[ARC_STYLE] = styles_xml
+
+        written_at = datetime.now().timetuple()[:6]
+        with ZipFile(source_path) as source, ZipFile(target_path, "w", ZIP_DEFLATED, allowZip64=True) as target:
+            for info in source.infolist():
+                if info.filename in parts:
+                    target.writestr(ZipInfo(info.filename, written_at), parts[info.filename], ZIP_DEFLATED)
+                else:
+                    copy_member(source, target, info)
+
+        self._styles_xml = styles_xml
+        self._file_state = _file_state(target_path)  # os.replace() keeps size and mtime
+        self.last_save = "partial"
+        return self.last_save
+
+    def _write_sheets(self, workbook, dirty_sheets):
+        parts = {}
+        for sheet_name in dirty_sheets:
+            if sheet_name not in workbook.sheetnames:
+                continue
+            sheet = workbook[sheet_name]
+            member = self._sheet_parts[sheet_name]
+            if rels_part_for(member) in self._members:
+                raise FullSaveNeeded(f"{sheet_name} has related parts")
+            if sheet._images or sheet._charts or sheet.tables or sheet._pivots or sheet.legacy_drawing:
+                raise FullSaveNeeded(f"{sheet_name} has images, charts, tables or comments")
+            writer = WorksheetWriter(sheet, out=BytesIO())
+            writer.write()
+            if writer._rels or sheet._comments:
+                raise FullSaveNeeded(f"{sheet_name} has hyperlinks or comments")
+            parts[member] = writer.read()
+        return parts
+
+    def _save_full(self, workbook, target_path):
+        workbook.save(target_path)
+        with ZipFile(target_path) as archive:
+            self._read_layout(archive)
+            self._styles_xml = archive.read(ARC_STYLE)
+        self.workbook = workbook
+        self._file_state = _file_state(target_path)
+        self.last_save = "full"
+        return self.last_save